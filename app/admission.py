@@ -0,0 +1,205 @@
+# admission.py
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (MAX_CONCURRENT_CONVERSIONS, MAX_QUEUED_CONVERSIONS, QUEUE_TIMEOUT, RETRY_AFTER,
+                    LARGE_LANE_CONCURRENCY, LARGE_LANE_QUEUE, LARGE_LANE_COST_MS, MAX_CONCURRENT_PARSES,
+                    MAX_QUEUED_PARSES)
+from logger import get_logger
+from metrics import metrics
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Экзекутор полосы, в которой выполняется текущая конвертация (run_blocking выполняет
+# блокирующие этапы в нем); вне конвертации не задан
+current_executor = contextvars.ContextVar("current_executor", default=None)
+# Разрешение текущей конвертации: run_blocking регистрирует в нем задания экзекутора
+current_ticket = contextvars.ContextVar("current_ticket", default=None)
+
+
+class ConversionRejected(Exception):
+    """Конвертация не принята: очередь заполнена или истекло время ожидания слота."""
+
+    def __init__(self, message, retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    Разрешение на выполнение конвертации; хранит полосу, время ожидания в очереди
+    и задания, отправленные в экзекутор полосы.
+    """
+
+    def __init__(self, queue_wait, lane=None):
+        self.queue_wait = queue_wait
+        self.lane = lane
+        self._jobs = set()
+        self._lock = threading.Lock()
+
+    def track(self, job):
+        """Регистрирует задание экзекутора (concurrent.futures.Future) до его завершения."""
+        with self._lock:
+            self._jobs.add(job)
+        job.add_done_callback(self._discard)
+
+    def _discard(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def running_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs if not job.done()]
+
+
+class AdmissionController:
+    """
+    Ограничивает число одновременных конвертаций и длину очереди ожидания.
+
+    Запрос, для которого нет ни свободного слота, ни места в очереди, отклоняется сразу;
+    запрос в очереди ждет не дольше queue_timeout секунд. Блокирующие этапы допущенных
+    конвертаций выполняются в собственном экзекуторе на max_concurrent потоков.
+    """
+
+    def __init__(self, name, max_concurrent, max_queued, queue_timeout):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix=name)
+        self.active = 0
+        self.waiting = 0
+
+    async def acquire(self, timeout=None):
+        """Ждет слот не дольше queue_timeout (и timeout - оставшегося срока запроса, если задан)."""
+        started = time.perf_counter()
+        if not self._semaphore.locked():
+            # Свободный слот есть: захват проходит без переключения задач
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queued:
+            metrics.inc(f"{self.name}_rejected_queue_full")
+            raise ConversionRejected("Conversion queue is full")
+        else:
+            self.waiting += 1
+            try:
+                wait_timeout = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+                await asyncio.wait_for(self._semaphore.acquire(), wait_timeout)
+            except asyncio.TimeoutError:
+                metrics.inc(f"{self.name}_rejected_queue_timeout")
+                raise ConversionRejected("Timed out waiting for a conversion slot")
+            finally:
+                self.waiting -= 1
+
+        queue_wait = time.perf_counter() - started
+        self.active += 1
+        metrics.inc(f"{self.name}_admitted")
+        metrics.observe(f"{self.name}_queue_wait", queue_wait)
+        return Ticket(queue_wait, self)
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def state(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
+
+
+class CostLanes:
+    """
+    Полосы конвертаций по оценке стоимости документа: документы со стоимостью не ниже
+    large_cost выполняются в отдельной полосе со своими ограничениями, поэтому большие
+    документы не задерживают очередь небольших. Без большой полосы (large=None) все
+    конвертации проходят через одну полосу.
+    """
+
+    def __init__(self, small, large=None, large_cost=0):
+        self.small = small
+        self.large = large
+        self.large_cost = large_cost
+        self._deferred = set()
+
+    @property
+    def lanes(self):
+        return [lane for lane in (self.small, self.large) if lane is not None]
+
+    @property
+    def active(self):
+        return sum(lane.active for lane in self.lanes)
+
+    def lane_for(self, cost):
+        if self.large is not None and cost >= self.large_cost:
+            return self.large
+        return self.small
+
+    async def acquire(self, cost=0, timeout=None):
+        """
+        Ждет слот в полосе, соответствующей стоимости cost (оценка времени конвертации, мс),
+        не дольше timeout секунд, если задан. Экзекутор полосы устанавливается в контексте
+        вызывающей задачи.
+        """
+        lane = self.lane_for(cost)
+        ticket = await lane.acquire(timeout)
+        current_executor.set(lane.executor)
+        current_ticket.set(ticket)
+        return ticket
+
+    def release(self, ticket):
+        """
+        Освобождает слот. Если конвертация прервана (срок, отключение клиента), а ее задание
+        еще выполняется в экзекуторе полосы (поток прервать нельзя), слот освобождается только
+        после завершения задания: иначе следующая допущенная конвертация ждала бы поток
+        экзекутора вне очереди и метрик ожидания, а одновременных рендерингов стало бы больше.
+        """
+        jobs = ticket.running_jobs()
+        if not jobs:
+            ticket.lane.release()
+            return
+        metrics.inc(f"{ticket.lane.name}_release_deferred")
+        task = asyncio.ensure_future(self._release_after(ticket, jobs))
+        self._deferred.add(task)  # Ссылка на задачу, чтобы ее не удалил сборщик мусора
+        task.add_done_callback(self._deferred.discard)
+
+    async def _release_after(self, ticket, jobs):
+        try:
+            await asyncio.wait([asyncio.wrap_future(job) for job in jobs])
+        finally:
+            ticket.lane.release()
+
+    def state(self):
+        state = {lane.name: lane.state() for lane in self.lanes}
+        if self.large is not None:
+            state["large_cost_ms"] = self.large_cost
+        return state
+
+
+if 0 < LARGE_LANE_CONCURRENCY < MAX_CONCURRENT_CONVERSIONS:
+    # Общее число конвертаций по-прежнему ограничено MAX_CONCURRENT_CONVERSIONS
+    conversion_gate = CostLanes(
+        AdmissionController("conversion_small", MAX_CONCURRENT_CONVERSIONS - LARGE_LANE_CONCURRENCY,
+                            MAX_QUEUED_CONVERSIONS, QUEUE_TIMEOUT),
+        AdmissionController("conversion_large", LARGE_LANE_CONCURRENCY, LARGE_LANE_QUEUE, QUEUE_TIMEOUT),
+        LARGE_LANE_COST_MS,
+    )
+else:
+    if LARGE_LANE_CONCURRENCY > 0:
+        # Малой полосе не остается слотов: разделение превысило бы MAX_CONCURRENT_CONVERSIONS
+        logger.warning(f"LARGE_LANE_CONCURRENCY={LARGE_LANE_CONCURRENCY} leaves no slots of "
+                       f"MAX_CONCURRENT_CONVERSIONS={MAX_CONCURRENT_CONVERSIONS} for small documents, "
+                       f"using a single conversion lane")
+    conversion_gate = CostLanes(
+        AdmissionController("conversion", MAX_CONCURRENT_CONVERSIONS, MAX_QUEUED_CONVERSIONS, QUEUE_TIMEOUT))
+
+# Разбор, проверка и оценка стоимости загрузок до допуска к конвертации: в собственном
+# экзекуторе и не больше MAX_CONCURRENT_PARSES одновременно, поэтому поток загрузок
+# не занимает потоки и память без ограничения еще до conversion_gate
+parse_gate = AdmissionController("parsing", MAX_CONCURRENT_PARSES, MAX_QUEUED_PARSES, QUEUE_TIMEOUT)
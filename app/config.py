@@ -27,4 +27,147 @@ LOG_FILE_PATH = os.path.join(STORAGE_DIR, "app.log")  # Путь к лог-фа
 F_DATE = "%d.%m.%Y %H:%M:%S (UTC+3)"
 
 # Количество строк в списке файлоа
-PAGES = 15
\ No newline at end of file
+PAGES = 15
+
+# Настройки логирования
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text или json (по одной JSON-записи на строку)
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size").lower()  # size, time или none
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # Размер файла для ротации по размеру
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")  # Интервал для ротации по времени
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))  # Количество хранимых архивных файлов
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Размер очереди записей для фонового писателя
+
+# Ограничение нагрузки на конвертацию
+MAX_CONCURRENT_CONVERSIONS = int(os.getenv("MAX_CONCURRENT_CONVERSIONS", 4))  # Одновременных конвертаций
+MAX_QUEUED_CONVERSIONS = int(os.getenv("MAX_QUEUED_CONVERSIONS", 16))  # Запросов в очереди ожидания
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", 30))  # Максимальное ожидание слота в очереди (секунды)
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", 5))  # Значение заголовка Retry-After при отказе (секунды)
+# Разбор, проверка и оценка стоимости загруженного XML до допуска к конвертации
+MAX_CONCURRENT_PARSES = int(os.getenv("MAX_CONCURRENT_PARSES", 2))  # Одновременных разборов
+MAX_QUEUED_PARSES = int(os.getenv("MAX_QUEUED_PARSES", MAX_QUEUED_CONVERSIONS))  # Запросов в очереди разбора
+
+# Срок обработки запроса на конвертацию: по истечении или при отключении клиента конвертация прерывается
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 0))  # Срок по умолчанию (секунды), 0 - без срока
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", 600))  # Наибольший срок из X-Request-Timeout
+DETECT_DISCONNECT = os.getenv("DETECT_DISCONNECT", "True").lower() == "true"  # Прерывать при отключении клиента
+
+# Контроль блокировок цикла событий: задержка цикла и стеки кода, блокирующего его дольше порога
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "False").lower() == "true"
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", 100))  # Период измерения задержки
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", 100))  # Порог блокировки для снятия стека
+LOOP_OFFENDERS = int(os.getenv("LOOP_OFFENDERS", 20))  # Хранимых мест блокировки
+
+# Полосы конвертаций: документы с оценкой стоимости не ниже LARGE_LANE_COST_MS выполняются
+# в отдельной полосе на LARGE_LANE_CONCURRENCY конвертаций (входят в MAX_CONCURRENT_CONVERSIONS,
+# должно быть меньше него - иначе используется одна общая полоса)
+LARGE_LANE_CONCURRENCY = int(os.getenv("LARGE_LANE_CONCURRENCY", 1))  # 0 - одна общая полоса
+LARGE_LANE_QUEUE = int(os.getenv("LARGE_LANE_QUEUE", 4))  # Запросов в очереди большой полосы
+LARGE_LANE_COST_MS = float(os.getenv("LARGE_LANE_COST_MS", 3000))  # Порог стоимости большой полосы
+# Коэффициенты оценки стоимости (ожидаемого времени) конвертации, мс
+COST_BASE_MS = float(os.getenv("COST_BASE_MS", 300))
+COST_PER_PLOT_MS = float(os.getenv("COST_PER_PLOT_MS", 10))
+COST_PER_POINT_MS = float(os.getenv("COST_PER_POINT_MS", 1))
+COST_PER_DEPOSIT_MS = float(os.getenv("COST_PER_DEPOSIT_MS", 30))
+COST_PER_INPUT_KB_MS = float(os.getenv("COST_PER_INPUT_KB_MS", 0.5))
+
+
+def available_cpus():
+    """
+    Число ядер, доступных процессу: привязка к ядрам (sched_getaffinity), ограниченная
+    квотой CPU контейнера (cgroup v2 cpu.max или cgroup v1 cpu.cfs_quota_us), с округлением вверх.
+    """
+    cpus = len(os.sched_getaffinity(0))
+    quota = period = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            max_value, period_value = f.read().split()
+        if max_value != "max":
+            quota, period = int(max_value), int(period_value)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            quota = period = None
+    if quota and quota > 0 and period:
+        cpus = min(cpus, -(-quota // period))
+    return max(cpus, 1)
+
+
+# Многопроцессный режим (gunicorn_conf.py): число воркеров, auto — по числу доступных ядер с учетом квоты CPU
+_web_concurrency = os.getenv("WEB_CONCURRENCY", "1")
+WEB_CONCURRENCY = available_cpus() if _web_concurrency == "auto" else int(_web_concurrency)
+PORT = int(os.getenv("PORT", 8000))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", 120))  # Таймаут зависшего воркера (секунды)
+
+# Режим больших документов: координаты рендерятся частями ограниченного размера.
+# Включается явно: шаблон template2.html должен поддерживать coords_chunked (см. README)
+LARGE_DOC_POINTS = int(os.getenv("LARGE_DOC_POINTS", 0))  # Порог по общему числу точек, 0 - не задан
+LARGE_DOC_PLOTS = int(os.getenv("LARGE_DOC_PLOTS", 0))  # Порог по числу участков, 0 - не задан
+LARGE_DOC_CHUNKING = bool(LARGE_DOC_POINTS or LARGE_DOC_PLOTS)  # Режим включен хотя бы одним порогом
+LARGE_DOC_CHUNK_POINTS = int(os.getenv("LARGE_DOC_CHUNK_POINTS", 1000))  # Точек в одной части
+
+# Точность форматирования координат (знаков после запятой); по умолчанию - как во входных данных
+COORD_PRECISION = int(os.getenv("COORD_PRECISION")) if os.getenv("COORD_PRECISION") else None
+
+# Учет памяти конвертаций
+CONVERSION_STATS_PATH = os.path.join(STORAGE_DIR, "conversion_stats")  # Статистика по этапам, файл на документ
+CONVERSION_STATS_MAX_ENTRIES = int(os.getenv("CONVERSION_STATS_MAX_ENTRIES", 10000))  # Хранимых записей статистики
+MEMORY_TRACE_SAMPLE_RATE = float(os.getenv("MEMORY_TRACE_SAMPLE_RATE", 0.05))  # Доля конвертаций под tracemalloc
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", 0))  # Бюджет памяти на конвертацию, 0 - без ограничения
+# Коэффициенты модели прогноза памяти
+MEMORY_BASE_MB = float(os.getenv("MEMORY_BASE_MB", 60))
+MEMORY_PER_POINT_KB = float(os.getenv("MEMORY_PER_POINT_KB", 40))
+MEMORY_PER_POINT_CHUNKED_KB = float(os.getenv("MEMORY_PER_POINT_CHUNKED_KB", 2))
+MEMORY_PER_DEPOSIT_KB = float(os.getenv("MEMORY_PER_DEPOSIT_KB", 200))
+
+# Сжатие хранилища: none, gzip или zstd (требует пакет zstandard)
+STORAGE_COMPRESSION = os.getenv("STORAGE_COMPRESSION", "none").lower()
+COMPRESS_AFTER_DAYS = float(os.getenv("COMPRESS_AFTER_DAYS", 0))  # 0 - сжимать сразу при записи
+COMPRESS_OUTPUTS = os.getenv("COMPRESS_OUTPUTS", "False").lower() == "true"  # Сжимать также выходные PDF
+STORAGE_MAINTENANCE_INTERVAL = int(os.getenv("STORAGE_MAINTENANCE_INTERVAL", 3600))  # Период обслуживания (секунды)
+
+# Раскладка хранилища и срок хранения файлов
+STORAGE_SHARDING = os.getenv("STORAGE_SHARDING", "True").lower() == "true"  # Новые файлы в подкаталогах YYYY/MM/DD
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", 0))  # Срок хранения файлов, 0 - без ограничения
+RETENTION_MAX_GB = float(os.getenv("RETENTION_MAX_GB", 0))  # Общий объем input_data и output_data, 0 - без ограничения
+RETENTION_ACTION = os.getenv("RETENTION_ACTION", "delete").lower()  # delete или archive
+ARCHIVE_PATH = os.getenv("ARCHIVE_PATH", os.path.join(STORAGE_DIR, "archive"))  # Каталог для RETENTION_ACTION=archive
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", 500))  # Файлов в пакете переноса и очистки
+STORAGE_BATCH_PAUSE = float(os.getenv("STORAGE_BATCH_PAUSE", 1.0))  # Пауза между пакетами (секунды)
+
+# Кэширование сохраненных файлов браузером (Cache-Control: private, max-age), секунды
+FILE_CACHE_MAX_AGE = int(os.getenv("FILE_CACHE_MAX_AGE", 3600))
+
+# Повторная подпись: неподписанные PDF сохраняются после рендеринга для штампа и подписи без повторного рендеринга
+KEEP_UNSIGNED_PDF = os.getenv("KEEP_UNSIGNED_PDF", "False").lower() == "true"
+UNSIGNED_PATH = os.path.join(STORAGE_DIR, "unsigned_data")  # Папка для неподписанных PDF
+RESIGN_CONCURRENCY = int(os.getenv("RESIGN_CONCURRENCY", 2))  # Документов, подписываемых параллельно
+RESIGN_JOBS_PATH = os.path.join(STORAGE_DIR, "resign_jobs.json")  # Состояние заданий /admin/resign
+
+# Секции документа по порядку: шаблоны через запятую, префикс static: - статическая секция,
+# одинаковая для всех заявлений (рендерится один раз на версию шаблона и кэшируется)
+DOCUMENT_SECTIONS = os.getenv("DOCUMENT_SECTIONS", "template2.html")
+
+# Разбор XML: lxml (быстрее, скомпилированные XPath) или etree (xml.etree.ElementTree)
+XML_BACKEND = os.getenv("XML_BACKEND", "lxml").lower()
+XML_SCHEMA_PATH = os.getenv("XML_SCHEMA_PATH", "")  # XSD-схема для проверки заявлений до рендеринга
+# Поля, без которых заявление отклоняется до рендеринга
+_xml_required_fields = os.getenv("XML_REQUIRED_FIELDS", "UniqueID,RequestDateTime")
+XML_REQUIRED_FIELDS = [field.strip() for field in _xml_required_fields.split(",") if field.strip()]
+
+# Оптимизация PDF перед подписью (pikepdf): потоки объектов и линеаризация
+PDF_OPTIMIZE = os.getenv("PDF_OPTIMIZE", "True").lower() == "true"
+PDF_OBJECT_STREAMS = os.getenv("PDF_OBJECT_STREAMS", "True").lower() == "true"
+PDF_LINEARIZE = os.getenv("PDF_LINEARIZE", "False").lower() == "true"
+
+# Прием заявлений через каталог-спул (spool.py): inbox, processing и failed внутри SPOOL_DIR
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(STORAGE_DIR, "spool"))
+SPOOL_WORKERS = int(os.getenv("SPOOL_WORKERS", MAX_CONCURRENT_CONVERSIONS))  # Одновременных конвертаций
+SPOOL_POLL_INTERVAL = float(os.getenv("SPOOL_POLL_INTERVAL", 2))  # Период сканирования inbox (секунды)
+SPOOL_MIN_AGE = float(os.getenv("SPOOL_MIN_AGE", 5))  # Файл не изменялся столько секунд - запись завершена
+
+# Выгрузка документов архивом ZIP (/admin/export): одновременных выгрузок, остальные получают 503
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))
@@ -0,0 +1,93 @@
+# coordinates.py
+import math
+from array import array
+from decimal import Decimal
+
+from config import COORD_PRECISION
+
+# Наибольшая точность по входным данным: double точно хранит 15 значащих цифр, из которых
+# до трех занимает целая часть долготы; при большей точности печатался бы шум двоичного
+# представления, которого нет во входном документе
+MAX_INPUT_PRECISION = 12
+
+
+class Polygon:
+    """
+    Координаты полигона в компактных числовых массивах array('d') вместо строк на каждую точку.
+
+    Для совместимости с шаблонами полигон ведет себя как список строк "широта, долгота":
+    итерация, len(), индексация и срезы (срез возвращает Polygon). Строки формируются
+    пакетно для всего полигона с единой точностью precision знаков после запятой.
+    """
+
+    __slots__ = ("latitudes", "longitudes", "precision")
+
+    def __init__(self, latitudes, longitudes, precision):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.precision = precision
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Polygon(self.latitudes[index], self.longitudes[index], self.precision)
+        return self._format() % (self.latitudes[index], self.longitudes[index])
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def _format(self):
+        return f"%.{self.precision}f, %.{self.precision}f"
+
+    def rows(self):
+        """Форматирует все точки полигона одной операцией форматирования."""
+        count = len(self.latitudes)
+        if not count:
+            return []
+        # Чередуем широты и долготы в одном массиве и форматируем его целиком
+        values = array('d', bytes(16 * count))
+        values[0::2] = self.latitudes
+        values[1::2] = self.longitudes
+        return ((self._format() + "\n") * count % tuple(values)).split("\n")[:-1]
+
+
+def decimals(text):
+    """Количество знаков после запятой в записи числа (с учетом порядка: 1e-3 - три знака)."""
+    if "e" in text or "E" in text:
+        return max(-Decimal(text).as_tuple().exponent, 0)
+    point = text.find(".")
+    return 0 if point < 0 else len(text) - point - 1
+
+
+def parse_polygon(latitude_texts, longitude_texts):
+    """
+    Преобразует строковые значения широт и долгот полигона в Polygon.
+
+    Значения разбираются и проверяются пакетно; при некорректном числе или выходе за
+    допустимый диапазон (широта -90..90, долгота -180..180) выбрасывается ValueError.
+    Точность форматирования - COORD_PRECISION или, если она не задана, наибольшее
+    число знаков после запятой во входных значениях полигона (не больше MAX_INPUT_PRECISION).
+    """
+    latitude_texts = [text.strip().replace(",", ".") for text in latitude_texts]
+    longitude_texts = [text.strip().replace(",", ".") for text in longitude_texts]
+    try:
+        latitudes = array('d', map(float, latitude_texts))
+        longitudes = array('d', map(float, longitude_texts))
+    except ValueError as e:
+        raise ValueError(f"Invalid coordinate value: {e}")
+    # float принимает nan и inf, которые не отсеиваются сравнением с границами диапазона
+    if not all(map(math.isfinite, latitudes)) or not all(map(math.isfinite, longitudes)):
+        raise ValueError("Invalid coordinate value: not a finite number")
+
+    if latitudes and (min(latitudes) < -90 or max(latitudes) > 90):
+        raise ValueError("Latitude out of range -90..90")
+    if longitudes and (min(longitudes) < -180 or max(longitudes) > 180):
+        raise ValueError("Longitude out of range -180..180")
+
+    if COORD_PRECISION is not None:
+        precision = COORD_PRECISION
+    else:
+        precision = min(max(map(decimals, latitude_texts + longitude_texts), default=0), MAX_INPUT_PRECISION)
+    return Polygon(latitudes, longitudes, precision)
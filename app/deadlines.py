@@ -0,0 +1,143 @@
+# deadlines.py
+import asyncio
+import contextvars
+import threading
+import time
+
+from config import REQUEST_TIMEOUT, REQUEST_TIMEOUT_MAX, DETECT_DISCONNECT
+from logger import get_logger
+from metrics import metrics
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Заголовок, в котором клиент передает срок обработки запроса (секунды)
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Срок текущей конвертации; контекст копируется в задачи и потоки экзекутора (run_blocking),
+# поэтому проверки выполняются на любом этапе. Вне конвертации не задан
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Конвертация прервана: истек срок обработки запроса или клиент отключился."""
+
+    def __init__(self, reason, stage=None):
+        message = "Client disconnected" if reason == "client_disconnected" else "Request deadline exceeded"
+        super().__init__(f"{message} at stage {stage}" if stage else message)
+        self.reason = reason
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Срок обработки запроса. Проверяется между этапами конвертации (check); Deadline.run
+    отменяет конвертацию при истечении срока или отключении клиента. Отмена учитывается
+    в метриках один раз: cancelled_<причина> и cancelled_stage_<этап>.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.stage = None
+        self.reason = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Срок из заголовка X-Request-Timeout (не больше REQUEST_TIMEOUT_MAX) или REQUEST_TIMEOUT.
+        Выбрасывает ValueError, если значение заголовка некорректно.
+        """
+        value = request.headers.get(TIMEOUT_HEADER)
+        if value is None:
+            return cls(REQUEST_TIMEOUT or None)
+        try:
+            timeout = float(value)
+        except ValueError:
+            raise ValueError(f"{TIMEOUT_HEADER} must be a number of seconds")
+        if not timeout > 0:
+            raise ValueError(f"{TIMEOUT_HEADER} must be positive")
+        return cls(min(timeout, REQUEST_TIMEOUT_MAX) if REQUEST_TIMEOUT_MAX else timeout)
+
+    def remaining(self):
+        """Оставшееся время (секунды) или None, если срока нет."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expire(self, reason):
+        """Отмечает срок истекшим (timeout) или клиента отключившимся (client_disconnected)."""
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+        metrics.inc(f"cancelled_{reason}")
+        if self.stage:
+            metrics.inc(f"cancelled_stage_{self.stage}")
+        logger.warning(f"Conversion cancelled ({reason}) at stage {self.stage}")
+
+    def check(self, stage):
+        """Перед этапом stage: выбрасывает DeadlineExceeded, если срок истек или клиент отключился."""
+        self.stage = stage
+        if self.reason is None and self.expires_at is not None and time.monotonic() >= self.expires_at:
+            self.expire("timeout")
+        if self.reason is not None:
+            raise DeadlineExceeded(self.reason, stage)
+
+    async def run(self, coro, request=None):
+        """
+        Выполняет корутину конвертации до срока, отслеживая отключение клиента (DETECT_DISCONNECT;
+        тело запроса к этому моменту должно быть прочитано). При истечении срока или отключении
+        задача конвертации отменяется: ожидающие задания экзекутора снимаются с очереди, csptest
+        завершается (sign_pdf), а выполняющиеся задания экзекутора прерываются на ближайшей
+        проверке срока.
+        """
+        watch = request is not None and DETECT_DISCONNECT
+        if self.expires_at is None and not watch:
+            return await coro
+        task = asyncio.ensure_future(coro)
+        watcher = asyncio.ensure_future(wait_disconnected(request)) if watch else None
+        try:
+            while True:
+                done, _ = await asyncio.wait([task, watcher] if watcher else [task], timeout=self.remaining(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if task in done:
+                    return task.result()
+                if watcher in done and watcher.exception() is not None:
+                    # Состояние соединения не удалось проверить: конвертация продолжается до срока
+                    logger.warning(f"Disconnect check failed: {watcher.exception()}")
+                    watcher = None
+                    continue
+                break
+            self.expire("client_disconnected" if watcher in done else "timeout")
+            task.cancel()
+            await asyncio.wait([task])
+            if not task.cancelled() and task.exception() is None:
+                return task.result()  # Конвертация успела завершиться
+            raise DeadlineExceeded(self.reason, self.stage)
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not task.done():
+                task.cancel()
+
+
+async def wait_disconnected(request):
+    """
+    Завершается, когда клиент закрывает соединение. После чтения тела запроса следующее
+    сообщение ASGI - http.disconnect; Request.is_disconnected за промежуточным слоем
+    @app.middleware("http") его не получает, поэтому сообщение ожидается напрямую.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def check(stage):
+    """Проверка срока текущей конвертации перед этапом stage (вне конвертации ничего не делает)."""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
@@ -0,0 +1,184 @@
+# file_responses.py
+import asyncio
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from config import FILE_CACHE_MAX_AGE
+import storage
+
+
+class RangeNotSatisfiable(Exception):
+    """Запрошенный диапазон байтов лежит за пределами файла."""
+
+
+def content_disposition(disposition, filename):
+    """Заголовок Content-Disposition с корректной передачей не-ASCII имен файлов."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+def accepts_encoding(request: Request, encoding):
+    """Проверяет, что клиент принимает данную кодировку (Accept-Encoding, q > 0)."""
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        name, *params = item.split(";")
+        if name.strip().lower() != encoding:
+            continue
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def entity_tag(stat, content_encoding=None):
+    """
+    Сильный ETag по времени изменения и размеру файла. Файлы не меняются после записи
+    (замена при повторной подписи меняет время изменения), поэтому хэш содержимого не нужен.
+    У сжатого представления (Content-Encoding) собственный тег.
+    """
+    tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return f'"{tag}-{content_encoding}"' if content_encoding else f'"{tag}"'
+
+
+def parse_http_date(value):
+    """Время из заголовка даты HTTP (секунды эпохи) или None, если дата некорректна."""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request: Request, etag, mtime):
+    """Проверяет условия If-None-Match (приоритетно) и If-Modified-Since."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Для If-None-Match используется слабое сравнение тегов
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since:
+        since = parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок Range с одним диапазоном байтов. Возвращает (start, end) включительно
+    или None, если заголовок некорректен или содержит несколько диапазонов (отдается весь файл).
+    Выбрасывает RangeNotSatisfiable, если диапазон лежит за пределами файла.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, separator, last = ranges.strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start < 0 or (last and int(last) < start):
+                return None
+        else:
+            suffix_length = int(last)
+            if suffix_length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix_length, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def range_allowed(request: Request, etag, mtime):
+    """If-Range: диапазон отдается, только если представление не изменилось."""
+    if_range = request.headers.get("If-Range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date(if_range) == int(mtime)
+
+
+def locate_stored_file(directory, filename):
+    """
+    Путь, кодировка сжатия и stat сохраненного файла по логическому имени; (None, None, None),
+    если файла нет. Проверяет несколько каталогов и вариантов сжатия на сетевом хранилище,
+    поэтому вызывается в потоке.
+    """
+    path, encoding = storage.locate(directory, filename)
+    if path is None:
+        return None, None, None
+    try:
+        return path, encoding, os.stat(path)
+    except FileNotFoundError:  # Файл удален между поиском и stat (хранение, повторная подпись)
+        return None, None, None
+
+
+async def stored_file_response(request: Request, directory, filename, media_type=None, disposition=None,
+                               conditional=True, headers=None):
+    """
+    Ответ с сохраненным файлом по логическому имени; None, если файла нет.
+
+    Поиск файла и stat выполняются в потоке. Файл отдается через FileResponse (sendfile, без чтения в память процесса). Сжатый файл
+    отдается как есть с Content-Encoding, если клиент принимает эту кодировку, иначе
+    распаковывается потоково. Ответ содержит ETag и Last-Modified; при conditional на
+    условные запросы отвечает 304, а для файлов, отдаваемых без распаковки, поддерживаются
+    запросы одного диапазона байтов (Range, ответ 206). headers дополняют и заменяют заголовки ответа.
+    """
+    path, encoding, stat = await asyncio.to_thread(locate_stored_file, directory, filename)
+    if path is None:
+        return None
+    media_type = media_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    content_encoding = encoding if encoding and accepts_encoding(request, encoding) else None
+    # Без распаковки отдается и диапазон байтов (для сжатого файла - в сжатом представлении)
+    as_stored = encoding is None or content_encoding is not None
+    etag = entity_tag(stat, content_encoding)
+    extra_headers = headers or {}
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"private, max-age={FILE_CACHE_MAX_AGE}",
+        "Accept-Ranges": "bytes" if as_stored and conditional else "none",
+    }
+    if encoding is not None:
+        headers["Vary"] = "Accept-Encoding"
+    headers.update(extra_headers)
+    if conditional and is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if disposition:
+        headers["Content-Disposition"] = content_disposition(disposition, filename)
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    if not as_stored:
+        return StreamingResponse(storage.iter_decompressed(path, encoding), media_type=media_type, headers=headers)
+
+    range_header = request.headers.get("Range") if conditional else None
+    if range_header and range_allowed(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(storage.iter_range(path, start, end - start + 1), status_code=206,
+                                     media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
@@ -0,0 +1,22 @@
+# gunicorn_conf.py
+# Многопроцессный режим: gunicorn с воркерами uvicorn.
+# Запуск: gunicorn -c gunicorn_conf.py main_app:app
+from config import WEB_CONCURRENCY, PORT, WORKER_TIMEOUT
+
+bind = f"0.0.0.0:{PORT}"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = WORKER_TIMEOUT
+
+# Приложение (шрифты, шаблоны, WeasyPrint) загружается в мастере до fork,
+# воркеры разделяют эти страницы памяти по copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # Вызывается в мастере после загрузки приложения и до запуска воркеров
+    from warmup import warm_up
+    try:
+        warm_up()
+    except Exception:
+        pass  # Ошибка залогирована; воркеры повторят прогрев при старте, /readyz покажет ошибку
@@ -1,9 +1,21 @@
 # logger.py
+import atexit
+import contextvars
+import copy
+import datetime
+import fcntl
+import json
 import logging
+import logging.handlers
 import os
-import datetime
+import queue
+import time
 
-from config import LOG_FILE_PATH
+from config import (LOG_FILE_PATH, LOG_FORMAT, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT,
+                    LOG_QUEUE_SIZE)
+
+# Идентификатор текущего запроса (correlation id), проставляется middleware в main_app
+request_id_var = contextvars.ContextVar("request_id", default="-")
 
 
 # Формат сообщений с московским временем
@@ -21,7 +33,104 @@ class MoscowFormatter(logging.Formatter):
         return s
 
 
-formatter = MoscowFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Формат JSON: одна запись на строку
+class JsonFormatter(MoscowFormatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        # Трейсбек форматирует DroppingQueueHandler.prepare до постановки в очередь
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Фильтр, добавляющий идентификатор запроса в каждую запись.
+# Выполняется в потоке, где вызван логгер, поэтому видит контекст текущего запроса
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+# Обработчик, помещающий записи в очередь; при переполнении запись отбрасывается,
+# чтобы логирование никогда не блокировало цикл событий
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    dropped = 0
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        """
+        В отличие от QueueHandler.prepare, трейсбек не склеивается с сообщением: он форматируется
+        здесь же (exc_info не передается в поток писателя) и остается в exc_text, поэтому
+        форматтеры писателя выводят его отдельно (в JSON - в поле exc_info).
+        """
+        prepared = copy.copy(record)
+        prepared.message = prepared.msg = record.getMessage()
+        prepared.args = None
+        if record.exc_info:
+            prepared.exc_text = record.exc_text or self._exception_formatter.formatException(record.exc_info)
+        prepared.exc_info = None
+        return prepared
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+# Фоновый писатель; маркер остановки кладется блокирующе, чтобы остановка работала и при полной очереди
+class BlockingSentinelQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# Ротация, безопасная при записи в один файл из нескольких процессов (воркеров):
+# проверка и переименование выполняются под flock, а процесс, чей файл уже
+# ротирован другим воркером, переоткрывает его перед записью
+class ProcessSafeRotationMixin:
+    def emit(self, record):
+        with open(f"{self.baseFilename}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rotated()
+                super().emit(record)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+            if hasattr(self, "rolloverAt"):
+                self.rolloverAt = self.computeRollover(int(time.time()))
+
+
+class SafeRotatingFileHandler(ProcessSafeRotationMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class SafeTimedRotatingFileHandler(ProcessSafeRotationMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+if LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = MoscowFormatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s')
 
 # Если лог-файл не существует, создаем его
 log_dir = os.path.dirname(LOG_FILE_PATH)
@@ -32,8 +141,15 @@ if not os.path.exists(LOG_FILE_PATH):
     with open(LOG_FILE_PATH, "w") as f:
         pass  # Просто создаем пустой файл
 
-# Обработчик для файла
-file_handler = logging.FileHandler(LOG_FILE_PATH)
+# Обработчик для файла (с ротацией по размеру или по времени)
+if LOG_ROTATION == "size":
+    file_handler = SafeRotatingFileHandler(
+        LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+elif LOG_ROTATION == "time":
+    file_handler = SafeTimedRotatingFileHandler(
+        LOG_FILE_PATH, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+else:
+    file_handler = logging.FileHandler(LOG_FILE_PATH, encoding="utf-8")
 file_handler.setLevel(logging.INFO)
 file_handler.setFormatter(formatter)
 
@@ -42,14 +158,42 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(formatter)
 
+# Очередь и фоновый писатель: вызывающий поток только кладет запись в очередь,
+# форматирование и запись в файл/консоль выполняются в отдельном потоке
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+
+queue_handler = DroppingQueueHandler(log_queue)
+queue_handler.setLevel(logging.INFO)
+queue_handler.addFilter(RequestIdFilter())
+
+listener = BlockingSentinelQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+
+
+def start_listener():
+    """Запускает фоновый поток записи логов."""
+    if listener._thread is None:
+        listener.start()
+
+
+def stop_listener():
+    """Останавливает фоновый поток, дописав оставшиеся в очереди записи."""
+    if listener._thread is not None:
+        listener.stop()
+
+
+start_listener()
+atexit.register(stop_listener)
+# Поток писателя не переживает fork: останавливаем его перед fork (очередь дописывается)
+# и запускаем заново и в родителе, и в дочернем процессе (воркере)
+os.register_at_fork(before=stop_listener, after_in_parent=start_listener, after_in_child=start_listener)
+
 
 def get_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)  # Устанавливаем уровень логирования для логгера
 
-    # Добавляем обработчики к логгеру, если их еще нет
+    # Добавляем обработчик очереди к логгеру, если его еще нет
     if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        logger.addHandler(queue_handler)
 
     return logger
@@ -0,0 +1,145 @@
+# loop_monitor.py
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from config import LOOP_LAG_INTERVAL_MS, LOOP_BLOCK_THRESHOLD_MS, LOOP_OFFENDERS
+from logger import get_logger
+from metrics import metrics
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Границы корзин гистограммы задержки цикла событий, мс
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# Кадров стека, сохраняемых для блокировки (ближайшие к месту блокировки)
+STACK_LIMIT = 20
+
+
+class LoopMonitor:
+    """
+    Измеряет задержку цикла событий и находит код, который его блокирует.
+
+    Задача в цикле событий засыпает на interval и измеряет, насколько позже она проснулась
+    (задержка цикла); результаты попадают в гистограмму и в метрику event_loop_lag.
+    Сторожевой поток следит за ожидаемым временем пробуждения задачи: если к моменту
+    «ожидаемое пробуждение + threshold» задача не проснулась, задержка цикла уже достигла
+    threshold, и поток снимает стек потока цикла событий (sys._current_frames). Стеки группируются
+    по месту блокировки; для каждого хранятся число блокировок, суммарная и наибольшая
+    длительность. Хранится не более max_offenders мест с наибольшей суммарной длительностью.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL_MS / 1000, threshold=LOOP_BLOCK_THRESHOLD_MS / 1000,
+                 max_offenders=LOOP_OFFENDERS):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+        self._lock = threading.Lock()
+        self._histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self._offenders = {}
+        self._pending = None  # (отметка времени, ключ стека, стек) текущей блокировки
+        self._expected = None  # Ожидаемое время пробуждения задачи измерения
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+        self.blocked = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        """Измерение задержки; выполняется в цикле событий до отмены задачи."""
+        self._loop_thread_id = threading.get_ident()
+        self._expected = time.monotonic() + self.interval
+        watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        watchdog.start()
+        logger.info(f"Event loop monitor started: interval {self.interval * 1000:.0f} ms, "
+                    f"threshold {self.threshold * 1000:.0f} ms")
+        try:
+            while True:
+                expected = self._expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                self._record(max(time.monotonic() - expected, 0.0), expected)
+        finally:
+            self._stop.set()
+
+    def _record(self, lag, expected):
+        metrics.observe("event_loop_lag", lag)
+        lag_ms = lag * 1000
+        bucket = next((index for index, bound in enumerate(LAG_BUCKETS_MS) if lag_ms <= bound),
+                      len(LAG_BUCKETS_MS))
+        with self._lock:
+            self._histogram[bucket] += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            pending, self._pending = self._pending, None
+        # Стек относится к этой задержке, только если снят в ожидании этого пробуждения
+        if pending is not None and pending[0] == expected:
+            self._add_offender(pending[1], pending[2], lag)
+
+    def _watch(self):
+        """
+        Сторожевой поток: снимает стек цикла событий, если задержка пробуждения задачи
+        измерения достигла threshold. Поток просыпается ровно к сроку «ожидаемое пробуждение +
+        threshold», поэтому стек снимается, пока блокировка еще продолжается.
+        """
+        reported = None
+        while not self._stop.is_set():
+            expected = self._expected
+            remaining = expected + self.threshold - time.monotonic()
+            if remaining > 0 or expected == reported:
+                # До срока или блокировка уже отмечена: ждем следующего пробуждения задачи
+                self._stop.wait(remaining if remaining > 0 else self.threshold / 2)
+                continue
+            reported = expected
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None or self._expected != expected:
+                continue  # Задача успела проснуться: стек к задержке не относится
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            key = tuple((entry.filename, entry.lineno, entry.name) for entry in stack)
+            with self._lock:
+                self._pending = (expected, key, traceback.format_list(stack))
+            metrics.inc("event_loop_blocked")
+            self.blocked += 1
+            logger.warning(f"Event loop blocked for more than {self.threshold * 1000:.0f} ms in "
+                           f"{stack[-1].name} ({stack[-1].filename}:{stack[-1].lineno})")
+
+    def _add_offender(self, key, stack, duration):
+        with self._lock:
+            offender = self._offenders.get(key)
+            if offender is None:
+                offender = self._offenders[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": stack}
+            offender["count"] += 1
+            offender["total_ms"] += duration * 1000
+            offender["max_ms"] = max(offender["max_ms"], duration * 1000)
+            if len(self._offenders) > self.max_offenders:
+                smallest = min(self._offenders, key=lambda item: self._offenders[item]["total_ms"])
+                del self._offenders[smallest]
+        logger.warning(f"Event loop was blocked for {duration * 1000:.0f} ms:\n{''.join(stack)}")
+
+    def state(self):
+        """Гистограмма задержки и число блокировок (для /metrics)."""
+        with self._lock:
+            histogram = list(self._histogram)
+        labels = [f"le_{bound}" for bound in LAG_BUCKETS_MS] + [f"gt_{LAG_BUCKETS_MS[-1]}"]
+        return {
+            "interval_ms": round(self.interval * 1000),
+            "threshold_ms": round(self.threshold * 1000),
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "blocked": self.blocked,
+            "lag_histogram_ms": dict(zip(labels, histogram)),
+        }
+
+    def offenders(self):
+        """Места блокировки цикла событий по убыванию суммарной длительности."""
+        with self._lock:
+            offenders = [dict(offender) for offender in self._offenders.values()]
+        for offender in offenders:
+            offender["total_ms"] = round(offender["total_ms"], 1)
+            offender["max_ms"] = round(offender["max_ms"], 1)
+        return sorted(offenders, key=lambda offender: offender["total_ms"], reverse=True)
+
+
+loop_monitor = LoopMonitor()
@@ -1,27 +1,43 @@
+import asyncio
 import base64
 import datetime
 import json
 import os
 import re
-import shutil
-import tempfile
 import time
 import traceback
+import uuid
 from functools import wraps
-from io import BytesIO
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response, Query, status
-from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBasic
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-
-from config import STORAGE_PATH, OUTPUT_PATH, FILE_ERRORS_PATH, LOG_FILE_PATH, PAGES, USERNAME, PASSWORD
-from logger import get_logger
-from pdf_utils import create_error_pdf
-from xml_processor import convert_xml_to_pdf, find_values_in_xml
+from starlette.background import BackgroundTask
+
+from admission import conversion_gate, parse_gate, current_executor, ConversionRejected
+from config import (STORAGE_PATH, OUTPUT_PATH, FILE_ERRORS_PATH, CONVERSION_STATS_PATH,
+                    CONVERSION_STATS_MAX_ENTRIES, LOG_FILE_PATH, PAGES,
+                    USERNAME, PASSWORD, COMPRESS_OUTPUTS, COMPRESS_AFTER_DAYS, STORAGE_MAINTENANCE_INTERVAL,
+                    STORAGE_SHARDING, RETENTION_DAYS, RETENTION_MAX_GB, RETENTION_ACTION, ARCHIVE_PATH,
+                    STORAGE_BATCH_SIZE, STORAGE_BATCH_PAUSE, KEEP_UNSIGNED_PDF, UNSIGNED_PATH, LOOP_MONITOR)
+from deadlines import Deadline, DeadlineExceeded, current_deadline
+from file_responses import stored_file_response, content_disposition
+from logger import get_logger, request_id_var
+from loop_monitor import loop_monitor
+from metrics import metrics
+import naming
+from pdf_utils import error_pdf_bytes
+from profiling import ConversionProfile, MemoryBudgetExceeded
+import resign
+from shared_store import SharedJsonStore, JsonDirStore
+import storage
+import warmup
+from xml_processor import convert_xml_to_pdf, find_values_in_xml, run_blocking, estimate_cost
+import xml_backend
+import zip_export
 import secrets
-import xml.etree.ElementTree as ET
 
 # Настройка логирования
 logger = get_logger(__name__)
@@ -37,21 +53,16 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 # Указываем каталог для статических файлов
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
-# Загрузка ошибок из файла при запуске приложения
-try:
-    with open(FILE_ERRORS_PATH, "r") as f:
-        file_errors = json.load(f)
-except FileNotFoundError:
-    # Если файл не найден, создаем его и инициализируем пустым словарем
-    with open(FILE_ERRORS_PATH, "w") as f:
-        json.dump({}, f)  # Сохраняем пустой словарь в файл
-    file_errors = {}
+# Ошибки обработки файлов хранятся в общем для всех процессов JSON-файле
+file_errors = SharedJsonStore(FILE_ERRORS_PATH)
+# Статистика конвертаций (время и память по этапам) для каталога файлов
+conversion_stats = JsonDirStore(CONVERSION_STATS_PATH)
 
 # Настройка базовой HTTP-аутентификации
 security = HTTPBasic()
 
 # Создаем папки для сохранения файлов, если они не существуют
-for path in [STORAGE_PATH, OUTPUT_PATH]:
+for path in [STORAGE_PATH, OUTPUT_PATH, UNSIGNED_PATH]:
     if not os.path.exists(path):
         try:
             os.makedirs(path)
@@ -96,24 +107,117 @@ def require_auth(func):
                 content="Invalid authentication credentials"
             )
         response = await func(request, *args, **kwargs)
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        response.headers["Pragma"] = "no-cache"
+        # HTML-страницы не кэшируются; сохраненные файлы задают свои заголовки кэширования
+        if "Cache-Control" not in response.headers:
+            response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+            response.headers["Pragma"] = "no-cache"
         return response
 
     return wrapper
 
 
-def cleanup_temp_files():
-    temp_dir = tempfile.gettempdir()
-    for filename in os.listdir(temp_dir):
-        file_path = os.path.join(temp_dir, filename)
+@app.on_event("startup")
+async def start_warm_up():
+    # В режиме gunicorn прогрев уже выполнен в мастере до fork; иначе прогреваем в фоне,
+    # не задерживая запуск, а /readyz сообщает о готовности по завершении
+    if not warmup.is_ready():
+        asyncio.get_event_loop().create_task(run_warm_up())
+
+
+# Задача измерения задержки цикла событий: ссылка хранится, иначе задачу может удалить сборщик мусора
+loop_monitor_task = None
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    global loop_monitor_task
+    if LOOP_MONITOR:
+        loop_monitor_task = asyncio.get_event_loop().create_task(loop_monitor.run())
+
+
+@app.on_event("startup")
+async def start_storage_maintenance():
+    compression = COMPRESS_AFTER_DAYS > 0 and storage.compression_method()
+    if compression or STORAGE_SHARDING or RETENTION_DAYS or RETENTION_MAX_GB:
+        asyncio.get_event_loop().create_task(run_storage_maintenance())
+
+
+def maintain_storage():
+    """
+    Один проход обслуживания хранилища: перенос файлов из корня каталогов в подкаталоги
+    по дате, сжатие файлов старше COMPRESS_AFTER_DAYS и очистка по сроку хранения и объему.
+    """
+    if STORAGE_SHARDING:
+        for directory in [STORAGE_PATH, OUTPUT_PATH, UNSIGNED_PATH]:
+            while True:
+                moved = storage.migrate_flat(directory, limit=STORAGE_BATCH_SIZE)
+                if moved:
+                    logger.info(f"Moved {moved} files into dated subdirectories of {directory}")
+                if moved < STORAGE_BATCH_SIZE:
+                    break
+                time.sleep(STORAGE_BATCH_PAUSE)
+
+    if COMPRESS_AFTER_DAYS > 0 and storage.compression_method():
+        for directory in [STORAGE_PATH] + ([OUTPUT_PATH] if COMPRESS_OUTPUTS else []):
+            compressed = storage.compress_aged(directory, COMPRESS_AFTER_DAYS * 86400)
+            if compressed:
+                logger.info(f"Compressed {compressed} aged files in {directory}")
+
+    if RETENTION_DAYS or RETENTION_MAX_GB:
+        processed = storage.apply_retention(
+            [STORAGE_PATH, OUTPUT_PATH, UNSIGNED_PATH],
+            max_age_seconds=RETENTION_DAYS * 86400,
+            max_total_bytes=int(RETENTION_MAX_GB * 1024 ** 3),
+            archive_dir=ARCHIVE_PATH if RETENTION_ACTION == "archive" else None,
+            batch_size=STORAGE_BATCH_SIZE,
+            batch_pause=STORAGE_BATCH_PAUSE,
+        )
+        if processed:
+            # Статистика хранится по именам входных файлов, ошибки - также под именем до добавления
+            # UniqueID (<имя>_<метка>.xml, см. handle_error)
+            input_names = [name for directory, name in processed if directory == STORAGE_PATH]
+            file_errors.delete(input_names + [storage.upload_name(name) for name in input_names
+                                              if storage.upload_name(name)])
+            conversion_stats.delete(input_names)
+            action = "Archived" if RETENTION_ACTION == "archive" else "Deleted"
+            logger.info(f"{action} {len(processed)} files by retention policy")
+
+    pruned = conversion_stats.prune(CONVERSION_STATS_MAX_ENTRIES)
+    if pruned:
+        logger.info(f"Removed {pruned} oldest conversion stats entries")
+
+
+async def run_storage_maintenance():
+    """Периодически обслуживает хранилище; при нескольких воркерах проход выполняет один из них."""
+    while True:
         try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
+            with storage.maintenance_lock() as acquired:
+                if acquired:
+                    await asyncio.to_thread(maintain_storage)
         except Exception as e:
-            logger.error(f'Failed to delete {file_path}. Reason: {e}')
+            logger.error(f"Storage maintenance failed: {e}")
+        await asyncio.sleep(STORAGE_MAINTENANCE_INTERVAL)
+
+
+async def run_warm_up():
+    try:
+        await asyncio.to_thread(warmup.warm_up)
+    except Exception:
+        pass  # Ошибка уже залогирована и отражается в /readyz
+
+
+@app.get("/healthz")
+async def healthz():
+    """Проверка живости процесса (liveness), без аутентификации."""
+    return JSONResponse({"status": "ok"})
+
+
+@app.get("/readyz")
+async def readyz():
+    """Проверка готовности (readiness): 200 только после завершения прогрева."""
+    if warmup.is_ready():
+        return JSONResponse({"status": "ready", "warm_up_ms": warmup.state["duration_ms"]})
+    return JSONResponse({"status": "warming_up", "error": warmup.state["error"]}, status_code=503)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -122,183 +226,316 @@ async def upload_page(request: Request):
     return templates.TemplateResponse("upload.html", {"request": request})
 
 
+def wants_json(request: Request):
+    """Режим API: ошибки возвращаются в JSON (Accept: application/json или ?format=json)."""
+    if request.query_params.get("format", "").lower() == "json":
+        return True
+    return "application/json" in request.headers.get("Accept", "").lower()
+
+
+def json_error(status_code, error, message, document=None, headers=None):
+    """Структурированная ошибка режима API; document - имя документа без расширения, как в каталоге файлов."""
+    content = {"error": error, "message": message, "request_id": request_id_var.get()}
+    if document:
+        content["document"] = document
+    return JSONResponse(content, status_code=status_code, headers=headers)
+
+
+def bad_request(request: Request, message):
+    if wants_json(request):
+        return json_error(400, "bad_request", message)
+    return HTMLResponse(content=message, status_code=400)
+
+
+def server_busy(request: Request, e: ConversionRejected):
+    """Отказ в допуске (очередь заполнена или истекло ожидание) с Retry-After."""
+    headers = {"Retry-After": str(e.retry_after)}
+    if wants_json(request):
+        return json_error(503, "server_busy", str(e), headers=headers)
+    return HTMLResponse(content=f"Server is busy: {e}. Please retry later.", status_code=503, headers=headers)
+
+
+async def conversion_error(request: Request, status_code, error, message, base_filename):
+    """
+    Ошибка обработки документа. В режиме API возвращается JSON с кодом состояния без PDF,
+    в браузере - общий PDF с ошибкой (как и раньше, с кодом 200). Для каждой ошибки PDF
+    не сохраняется: каталог файлов ссылается на /output/<имя>_error.pdf, который отдает общий PDF.
+    """
+    if wants_json(request):
+        return json_error(status_code, error, message, document=base_filename)
+    pdf_filename = naming.error_filename(base_filename)
+    return Response(
+        content=await asyncio.to_thread(error_pdf_bytes),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"inline; filename={pdf_filename}"}
+    )
+
+
 @app.post("/upload/")
 @require_auth
 async def upload_file_or_xml(
         request: Request,
         file: UploadFile = File(None),
 ):
+    ticket = parse_ticket = None
+    original_filename = base_filename = file_extension = None
     try:
+        # Срок обработки: X-Request-Timeout или REQUEST_TIMEOUT; проверяется между этапами конвертации
+        try:
+            deadline = Deadline.from_request(request)
+        except ValueError as e:
+            return bad_request(request, str(e))
+        current_deadline.set(deadline)
+
         # Проверка на пустой файл или отсутствие XML-данных
         if file is None and request.headers.get("Content-Type") != "application/xml":
-            return HTMLResponse(content="No file selected or XML data provided. Please try again.", status_code=400)
+            return bad_request(request, "No file selected or XML data provided. Please try again.")
 
         if file is not None:
             # Проверка на пустой файл
             file_content = await file.read()
             if len(file_content) == 0:
-                return HTMLResponse(content="Empty file uploaded. Please select a valid file.", status_code=400)
+                return bad_request(request, "Empty file uploaded. Please select a valid file.")
             await file.seek(0)  # Сбрасываем позицию чтения файла в начало
             original_filename = file.filename
         elif request.headers.get("Content-Type") == "application/xml":
             # Проверка на пустые XML-данные
             xml_content = await request.body()
             if len(xml_content) == 0:
-                return HTMLResponse(content="Empty XML data provided. Please provide valid XML.", status_code=400)
+                return bad_request(request, "Empty XML data provided. Please provide valid XML.")
             original_filename = "uploaded_xml.xml"
         else:
-            return HTMLResponse(content="Invalid request. Please provide a file or XML data.", status_code=400)
+            return bad_request(request, "Invalid request. Please provide a file or XML data.")
 
         project_path = os.path.dirname(os.path.abspath(__file__))
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 
         # Формируем имя файла, сохраняя оригинальное имя в начале
-        file_extension = os.path.splitext(original_filename)[1]
-        base_filename = f"{os.path.splitext(original_filename)[0]}_{timestamp}"
+        base_filename, file_extension = naming.split_upload_name(original_filename)
 
         # Обработка файла, если он загружен
         if file:
-            file_path = os.path.join(STORAGE_PATH, f"{base_filename}{file_extension}")
-            with open(file_path, "wb") as f:
-                f.write(file_content)
             xml_content = file_content
-        # Обработка XML, если он передан в теле запроса
-        else:
-            file_path = os.path.join(STORAGE_PATH, f"{base_filename}{file_extension}")
-            with open(file_path, "wb") as f:
-                f.write(xml_content)
+
+        # Разбор, проверка и оценка стоимости до допуска выполняются в экзекуторе parse_gate,
+        # не больше MAX_CONCURRENT_PARSES одновременно; при заполненной очереди - отказ,
+        # входные данные при этом не сохраняются
+        try:
+            parse_ticket = await parse_gate.acquire(timeout=deadline.remaining())
+        except ConversionRejected as e:
+            logger.warning(f"Parsing of {original_filename} rejected: {e}")
+            return server_busy(request, e)
+        current_executor.set(parse_gate.executor)
+        # Входные данные сохраняются (при включенном сжатии - сжатыми)
+        await asyncio.to_thread(storage.write_file, STORAGE_PATH, f"{base_filename}{file_extension}", xml_content,
+                                compress=True)
 
         try:
             # Попытка парсинга XML
-            root = ET.fromstring(xml_content)
-        except ET.ParseError as parse_error:
-            error_message = f"Error parsing XML from {base_filename}{file_extension}: {str(parse_error)}"
-            logger.error(error_message)
-            handle_error(f"{base_filename}{file_extension}", "Invalid XML format")
-
-            # Создание PDF с ошибкой
-            pdf_filename = f"{base_filename}_error.pdf"
-            pdf_buffer = await create_error_pdf(pdf_filename, "Invalid XML format")
-            pdf_filepath = os.path.join(OUTPUT_PATH, pdf_filename)
-            with open(pdf_filepath, "wb") as f:
-                f.write(pdf_buffer.getvalue())
-
-            # Возврат PDF с ошибкой
-            pdf_buffer.seek(0)
-            return StreamingResponse(
-                pdf_buffer,
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"inline; filename={pdf_filename}"}
-            )
+            root = await run_blocking(xml_backend.parse, xml_content)
+        except xml_backend.InvalidXml:
+            logger.error(f"Error parsing XML from {base_filename}{file_extension}")
+            await handle_error(f"{base_filename}{file_extension}", "Invalid XML format")
+            return await conversion_error(request, 400, "invalid_xml", "Invalid XML format", base_filename)
 
-            # Извлечение UniqueID и дальнейшая обработка
+        # Извлечение UniqueID и дальнейшая обработка
         unique_id = find_values_in_xml(root, 'UniqueID')
         if not unique_id:
             error_message = f"UniqueID not found in XML file: {original_filename}"
             logger.error(error_message)
-            handle_error(f"{base_filename}{file_extension}", "UniqueID not found in XML")
-
-            # Создание PDF с ошибкой
-            pdf_filename = f"{base_filename}_error.pdf"
-            pdf_buffer = await create_error_pdf(pdf_filename, "UniqueID not found in XML")
-            pdf_filepath = os.path.join(OUTPUT_PATH, pdf_filename)
-            with open(pdf_filepath, "wb") as f:
-                f.write(pdf_buffer.getvalue())
-
-            # Возврат PDF с ошибкой
-            pdf_buffer.seek(0)
-            return StreamingResponse(
-                pdf_buffer,
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"inline; filename={pdf_filename}"}
-            )
+            await handle_error(f"{base_filename}{file_extension}", "UniqueID not found in XML")
+            return await conversion_error(request, 422, "missing_unique_id", "UniqueID not found in XML",
+                                          base_filename)
+
+        # Проверка обязательных полей и XSD-схемы до рендеринга
+        try:
+            await run_blocking(xml_backend.validate, root)
+        except xml_backend.InvalidDocument as e:
+            logger.error(f"Invalid document {original_filename}: {e}")
+            await handle_error(f"{base_filename}{file_extension}", str(e))
+            return await conversion_error(request, 422, "invalid_document", str(e), base_filename)
+
+        # Контроль допуска: ждем свободный слот в полосе по стоимости документа или сразу отказываем
+        cost = await run_blocking(estimate_cost, root, len(xml_content))
+        parse_gate.release()  # Разбор завершен: слот не занимается на время ожидания конвертации
+        parse_ticket = None
+        try:
+            ticket = await conversion_gate.acquire(cost, timeout=deadline.remaining())
+        except ConversionRejected as e:
+            logger.warning(f"Conversion of {original_filename} (cost {cost} ms) rejected: {e}")
+            # Отклоненный запрос не оставляет входных данных в хранилище
+            await asyncio.to_thread(storage.remove, STORAGE_PATH, f"{base_filename}{file_extension}")
+            return server_busy(request, e)
 
         # Переименование файла с добавлением UniqueID
-        new_file_path = os.path.join(STORAGE_PATH, f"{base_filename}_{unique_id}{file_extension}")
-        os.rename(file_path, new_file_path)
+        input_filename = naming.input_filename(base_filename, unique_id, file_extension)
+        new_file_path = await asyncio.to_thread(storage.rename, STORAGE_PATH, f"{base_filename}{file_extension}",
+                                                input_filename)
         logger.info(f"Saved input data from {original_filename} to: {new_file_path}")
 
-        # Генерация PDF
-        pdf_buffer = await convert_xml_to_pdf(xml_content.decode("utf-8"), project_path)
-        pdf_filename = f"{base_filename}_{unique_id}_signed.pdf"
-        pdf_filepath = os.path.join(OUTPUT_PATH, pdf_filename)
-        with open(pdf_filepath, "wb") as f:
-            f.write(pdf_buffer.read())
-
-        # Возврат PDF в браузере
-        pdf_buffer.seek(0)
-        return StreamingResponse(
-            BytesIO(pdf_buffer.getvalue()),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"inline; filename={pdf_filename}"}
+        # Генерация PDF. Запись "in_progress" остается в статистике, если процесс
+        # будет завершен во время конвертации (например, по нехватке памяти)
+        await asyncio.to_thread(conversion_stats.set, input_filename,
+                                {"status": "in_progress", "unique_id": unique_id})
+        processing_started = time.perf_counter()
+        with ConversionProfile() as profile:
+            profile.queue_wait_ms = round(ticket.queue_wait * 1000)
+            try:
+                # Неподписанный PDF сохраняется для повторной подписи без рендеринга (/admin/resign)
+                unsigned_filename = (resign.unsigned_filename(base_filename, unique_id)
+                                     if KEEP_UNSIGNED_PDF else None)
+                # Конвертация отменяется по истечении срока или при отключении клиента
+                pdf_buffer = await deadline.run(
+                    convert_xml_to_pdf(xml_content, project_path, profile, unsigned_filename, root=root), request)
+            finally:
+                stats = dict(profile.summary(), unique_id=unique_id, lane=ticket.lane.name, cost_ms=cost)
+                if deadline.reason:
+                    stats["cancelled"] = deadline.reason
+                await asyncio.to_thread(conversion_stats.set, input_filename, stats)
+                logger.info(f"Conversion stats for {unique_id}: {json.dumps(stats)}")
+        processing_time = time.perf_counter() - processing_started
+        metrics.observe("conversion_processing", processing_time)
+        metrics.observe(f"{ticket.lane.name}_processing", processing_time)
+        logger.info(f"Conversion of {unique_id} in {ticket.lane.name} (cost {cost} ms): "
+                    f"queue wait {ticket.queue_wait * 1000:.0f} ms, processing {processing_time * 1000:.0f} ms")
+        pdf_filename = naming.signed_filename(base_filename, unique_id)
+        await asyncio.to_thread(storage.write_file, OUTPUT_PATH, pdf_filename, pdf_buffer.getbuffer(),
+                                compress=COMPRESS_OUTPUTS)
+        del pdf_buffer  # Ответ отдается из сохраненного файла, буфер больше не нужен
+
+        # Возврат PDF в браузере из сохраненного файла (sendfile, без копирования через цикл событий)
+        response = await stored_file_response(
+            request, OUTPUT_PATH, pdf_filename, media_type="application/pdf", disposition="inline",
+            conditional=False,
+            headers={
+                "Cache-Control": "no-store",
+                "X-Queue-Wait-Ms": f"{ticket.queue_wait * 1000:.0f}",
+                "X-Processing-Ms": f"{processing_time * 1000:.0f}",
+            }
         )
+        if response is None:
+            # Файл удален после записи (например, обслуживанием хранилища); конвертация
+            # прошла успешно, поэтому ошибка документа не записывается
+            logger.error(f"Output {pdf_filename} disappeared before the response was sent")
+            if wants_json(request):
+                return json_error(500, "output_missing", "Converted PDF is no longer available")
+            return HTMLResponse(content="Converted PDF is no longer available. Please retry.", status_code=500)
+        return response
     except Exception as e:
         error_message = f"Error processing input from {original_filename}: {str(e)}"
         logger.error(error_message)
         logger.error(traceback.format_exc())  # Логируем полный стек-трейс
-        handle_error(f"{base_filename}{file_extension}", str(e))
-
-        # Создание PDF с ошибкой
-        pdf_filename = f"{base_filename}_error.pdf"
-        pdf_buffer = await create_error_pdf(pdf_filename, str(e))
-        pdf_filepath = os.path.join(OUTPUT_PATH, pdf_filename)
-        with open(pdf_filepath, "wb") as f:
-            f.write(pdf_buffer.getvalue())
-
-        # Возврат PDF с ошибкой
-        pdf_buffer.seek(0)
-        return StreamingResponse(
-            pdf_buffer,
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"inline; filename={pdf_filename}"}
-        )
+        if base_filename is None:
+            # Ошибка до сохранения входных данных: документа в каталоге файлов нет
+            if wants_json(request):
+                return json_error(500, "internal_error", str(e))
+            raise HTTPException(status_code=500, detail="Error processing input")
+        await handle_error(f"{base_filename}{file_extension}", str(e))
+
+        if isinstance(e, DeadlineExceeded):
+            # 499 - клиент закрыл соединение (ответ никто не получит), 504 - истек срок запроса
+            status_code, error = ((499, "client_disconnected") if e.reason == "client_disconnected"
+                                  else (504, "deadline_exceeded"))
+        elif isinstance(e, MemoryBudgetExceeded):
+            status_code, error = 413, "document_too_large"
+        elif isinstance(e, ValueError):
+            status_code, error = 422, "invalid_document"
+        else:
+            status_code, error = 500, "conversion_failed"
+        return await conversion_error(request, status_code, error, str(e), base_filename)
     finally:
-        cleanup_temp_files()
+        # Временные файлы каждая конвертация удаляет сама (каталог подписи sign_pdf, части
+        # большого документа): общий TMPDIR не очищается, в нем работают другие воркеры,
+        # демон спула и повторная подпись
+        if parse_ticket is not None:
+            parse_gate.release()
+        if ticket is not None:
+            conversion_gate.release(ticket)
 
 
-# Маршрут для просмотра файлов в /mnt/input_data
-@app.get("/files/", response_class=HTMLResponse)
+@app.get("/metrics")
 @require_auth
-async def list_files(request: Request,
-                     page: int = Query(1, ge=1),
-                     per_page: int = Query(PAGES, ge=1),
-                     search: str = Query(None)):
+async def get_metrics(request: Request):
+    """Возвращает метрики процесса: счетчики, длительности этапов и состояние очереди конвертаций."""
+    snapshot = metrics.snapshot()
+    snapshot["admission"] = conversion_gate.state()
+    snapshot["parsing"] = parse_gate.state()
+    if LOOP_MONITOR:
+        snapshot["event_loop"] = loop_monitor.state()
+    return JSONResponse(snapshot)
+
+
+@app.get("/admin/event-loop")
+@require_auth
+async def event_loop_offenders(request: Request):
+    """Места кода, блокировавшие цикл событий дольше LOOP_BLOCK_THRESHOLD_MS, со стеками."""
+    if not LOOP_MONITOR:
+        return json_error(404, "loop_monitor_disabled", "Event loop monitor is disabled (LOOP_MONITOR)")
+    return JSONResponse(dict(loop_monitor.state(), offenders=loop_monitor.offenders()))
+
+
+def collect_files(search=None):
+    """
+    Описания сохраненных входных файлов для каталога /files/ (обход всех подкаталогов
+    по дате с stat каждого файла - выполняется в потоке).
+    """
     files = []
-    for filename in os.listdir(STORAGE_PATH):
-        filepath = os.path.join(STORAGE_PATH, filename)
-        if os.path.isfile(filepath):
-            creation_time = datetime.datetime.fromtimestamp(os.path.getctime(filepath))
-            error_message = file_errors.get(filename)  # Получаем сообщение об ошибке, если есть
-
-            # Извлекаем UniqueID из имени файла с помощью регулярного выражения
-            match = re.search(r'_(\d{14})_(.+?)\.xml$', filename)
-            if match:
-                timestamp, unique_id = match.groups()
-            else:
-                unique_id = None
+    errors = file_errors.all()
+    # Файлы хранятся в подкаталогах по дате (и в корне каталога до переноса)
+    for entry in storage.iter_files(STORAGE_PATH):
+        # Сжатые файлы показываются под исходным именем; время изменения сохраняется при сжатии
+        filename = storage.logical_name(entry.name)
+        creation_time = datetime.datetime.fromtimestamp(entry.stat().st_mtime)
+        # Ошибка записывается под именем входного файла до добавления UniqueID (<имя>_<метка>.xml)
+        error_message, error_name = storage.find_error(errors, filename)
+
+        # Извлекаем UniqueID из имени файла с помощью регулярного выражения
+        match = re.search(r'_(\d{14})_(.+?)\.xml$', filename)
+        if match:
+            timestamp, unique_id = match.groups()
+        else:
+            unique_id = None
 
-            # Проверяем, совпадает ли search с UniqueID, если он найден
-            if search and unique_id and search.lower() != unique_id.lower():
-                continue  # Пропускаем файл, если search не совпадает
+        # Проверяем, совпадает ли search с UniqueID, если он найден
+        if search and unique_id and search.lower() != unique_id.lower():
+            continue  # Пропускаем файл, если search не совпадает
 
-            # Формируем имя PDF файла и URL для просмотра в браузере
-            base_filename = os.path.splitext(filename)[0]  # Получаем имя без расширения
+        # Формируем имя PDF файла и URL для просмотра в браузере
+        base_filename = os.path.splitext(filename)[0]  # Получаем имя без расширения
 
-            if error_message is None:
-                pdf_filename = f"{base_filename}_signed.pdf" if unique_id else f"{base_filename}.pdf"
-            else:
-                pdf_filename = f"{base_filename}_error.pdf"
+        if error_message is None:
+            pdf_filename = f"{base_filename}_signed.pdf" if unique_id else f"{base_filename}.pdf"
+        else:
+            # PDF с ошибкой сохраняется под тем же именем, что и ошибка (conversion_error)
+            pdf_filename = naming.error_filename(os.path.splitext(error_name)[0])
+
+        pdf_url = f"/output/{pdf_filename}?view=inline"  # URL для просмотра PDF
+
+        files.append({
+            "name": filename,
+            "creation_time": creation_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "url": f"/files/{filename}",
+            "error": error_message,
+            "pdf_url": pdf_url,
+            "pdf_filename": pdf_filename,
+        })
+
+    return files
 
-            pdf_url = f"/output/{pdf_filename}?view=inline"  # URL для просмотра PDF
 
-            files.append({
-                "name": filename,
-                "creation_time": creation_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "url": f"/files/{filename}",
-                "error": error_message,
-                "pdf_url": pdf_url,
-                "pdf_filename": pdf_filename
-            })
+def add_conversion_stats(files):
+    """Добавляет к описаниям файлов статистику их конвертаций (по файлу на документ)."""
+    for file in files:
+        file["stats"] = conversion_stats.get(file["name"])
+
+
+# Маршрут для просмотра файлов в /mnt/input_data
+@app.get("/files/", response_class=HTMLResponse)
+@require_auth
+async def list_files(request: Request,
+                     page: int = Query(1, ge=1),
+                     per_page: int = Query(PAGES, ge=1),
+                     search: str = Query(None)):
+    files = await asyncio.to_thread(collect_files, search)
 
     # Сортируем файлы по дате создания в обратном порядке (сначала новые)
     files.sort(key=lambda x: x["creation_time"], reverse=True)
@@ -309,6 +546,8 @@ async def list_files(request: Request,
     start_index = (page - 1) * per_page
     end_index = min(start_index + per_page, total_files)
     current_files = files[start_index:end_index]
+    # Статистика конвертаций (время и память по этапам) читается только для текущей страницы
+    await asyncio.to_thread(add_conversion_stats, current_files)
 
     return templates.TemplateResponse("files.html", {
         "request": request,
@@ -323,31 +562,29 @@ async def list_files(request: Request,
     })
 
 
-# Функция для обработки ошибок
-def handle_error(filename, error_message):
-    file_errors[filename] = error_message
-
+# Функция для обработки ошибок. Общий файл ошибок блокируется между воркерами,
+# поэтому запись выполняется в потоке, не блокируя цикл событий
+async def handle_error(filename, error_message):
     max_retries = 3
     retry_delay = 2  # Задержка между попытками записи (в секундах)
 
     for attempt in range(max_retries):
         try:
-            # Сохранение ошибок в файл
-            with open(FILE_ERRORS_PATH, "w") as f:
-                json.dump(file_errors, f)
+            # Сохранение ошибки в общий файл ошибок
+            await asyncio.to_thread(file_errors.set, filename, error_message)
             break  # Выходим из цикла, если запись успешна
         except Exception as e:
             if attempt + 1 == max_retries:
                 # Если после нескольких попыток ошибка не записана, уведомляем об этом
                 logger.critical(f"Failed to save error log after {max_retries} attempts: {e}")
             else:
-                time.sleep(retry_delay)  # Ждем перед новой попыткой
+                await asyncio.sleep(retry_delay)  # Ждем перед новой попыткой
 
 
 @app.get("/error/{filename}", response_class=HTMLResponse)
 @require_auth
 async def view_error(request: Request, filename: str):
-    error_message = file_errors.get(filename)
+    error_message = await asyncio.to_thread(file_errors.get, filename)
     if error_message:
         return templates.TemplateResponse("error.html", {
             "request": request,
@@ -362,26 +599,36 @@ async def view_error(request: Request, filename: str):
 @app.get("/output/{pdf_filename}")
 @require_auth
 async def download_pdf(request: Request, pdf_filename: str, view: str = "download"):  # Добавляем параметр view
-    pdf_filepath = os.path.join(OUTPUT_PATH, pdf_filename)
-    if os.path.isfile(pdf_filepath):
-        if view == "inline":
-            return FileResponse(pdf_filepath, media_type="application/pdf", filename=pdf_filename,
-                                headers={"Content-Disposition": f"inline; filename={pdf_filename}"})
-        else:
-            return FileResponse(pdf_filepath, media_type="application/pdf", filename=pdf_filename)
-    else:
+    disposition = "inline" if view == "inline" else "attachment"
+    response = await stored_file_response(request, OUTPUT_PATH, pdf_filename, media_type="application/pdf",
+                                          disposition=disposition)
+    if response is None and await asyncio.to_thread(has_error_pdf, pdf_filename):
+        # PDF с ошибкой один для всех документов и не сохраняется для каждой ошибки
+        response = Response(content=await asyncio.to_thread(error_pdf_bytes), media_type="application/pdf",
+                            headers={"Content-Disposition": content_disposition(disposition, pdf_filename),
+                                     "Cache-Control": "no-cache"})
+    if response is None:
         raise HTTPException(status_code=404, detail="PDF file not found")
+    return response
+
+
+def has_error_pdf(pdf_filename):
+    """Есть ли ошибка обработки документа, которому принадлежит имя <имя>_error.pdf."""
+    suffix = naming.error_filename("")
+    if not pdf_filename.endswith(suffix):
+        return False
+    base_filename = pdf_filename[:-len(suffix)]
+    return any(os.path.splitext(name)[0] == base_filename for name in file_errors.all())
 
 
 # Маршрут для просмотра конкретного файла
 @app.get("/files/{filename}")
 @require_auth
 async def view_file(request: Request, filename: str):
-    filepath = os.path.join(STORAGE_PATH, filename)
-    if os.path.isfile(filepath):
-        return FileResponse(filepath)
-    else:
+    response = await stored_file_response(request, STORAGE_PATH, filename)
+    if response is None:
         raise HTTPException(status_code=404, detail="File not found")
+    return response
 
 
 @app.get("/logs/", response_class=HTMLResponse)
@@ -420,14 +667,11 @@ async def clear_logs(request: Request):
 async def clear_files(request: Request):
     """Очищает содержимое директорий STORAGE_PATH, OUTPUT_PATH и файл FILE_ERRORS_PATH."""
     try:
-        for path in [STORAGE_PATH, OUTPUT_PATH]:
-            for filename in os.listdir(path):
-                file_path = os.path.join(path, filename)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)  # Удаляем файл
+        for path in [STORAGE_PATH, OUTPUT_PATH, UNSIGNED_PATH]:
+            await asyncio.to_thread(storage.clear, path)  # Удаляем файлы вместе с подкаталогами по дате
 
-        if os.path.exists(FILE_ERRORS_PATH):
-            os.remove(FILE_ERRORS_PATH)  # Удаляем файл ошибок
+        await asyncio.to_thread(file_errors.clear)  # Очищаем файл ошибок
+        await asyncio.to_thread(conversion_stats.clear)  # Очищаем статистику конвертаций
 
         logger.info("All files and error log cleared successfully.")
 
@@ -438,17 +682,117 @@ async def clear_files(request: Request):
         raise HTTPException(status_code=500, detail="Error clearing files")
 
 
+@app.post("/admin/resign")
+@require_auth
+async def resign_pdfs(request: Request):
+    """
+    Повторно ставит штамп, номера страниц и подпись на сохраненные неподписанные PDF
+    (KEEP_UNSIGNED_PDF) без повторного рендеринга, например после смены сертификата
+    или сбоя csptest. Тело запроса (JSON): {"unique_ids": [...], "since": "YYYY-MM-DD",
+    "until": "YYYY-MM-DD"} - условия отбора; {"all": true} - все документы.
+    Подпись выполняется в фоне со слотами полос конвертаций; ответ 202 содержит задание,
+    состояние которого возвращает GET /admin/resign/{id}.
+    """
+    try:
+        selection = await request.json()
+        unique_ids = selection.get("unique_ids")
+        if unique_ids is not None and (not isinstance(unique_ids, list)
+                                       or not all(isinstance(item, str) for item in unique_ids)):
+            raise ValueError("unique_ids must be a list of strings")
+        since = datetime.date.fromisoformat(selection["since"]) if selection.get("since") else None
+        until = datetime.date.fromisoformat(selection["until"]) if selection.get("until") else None
+    except (ValueError, AttributeError, TypeError) as e:
+        return json_error(400, "bad_request", f"Invalid selection: {e}")
+    if not (unique_ids or since or until or selection.get("all")):
+        return json_error(400, "bad_request", "Specify unique_ids, since/until or all")
+
+    filenames = await asyncio.to_thread(resign.select_documents, unique_ids, since, until)
+    logger.info(f"Re-signing {len(filenames)} documents")
+    job = await resign.start_job(filenames, os.path.dirname(os.path.abspath(__file__)))
+    return JSONResponse(job, status_code=202, headers={"Location": f"/admin/resign/{job['id']}"})
+
+
+@app.get("/admin/resign/{job_id}")
+@require_auth
+async def resign_job(request: Request, job_id: str):
+    """Состояние задания повторной подписи (общее для всех воркеров, см. resign.get_job)."""
+    job = await asyncio.to_thread(resign.get_job, job_id)
+    if job is None:
+        return json_error(404, "not_found", "Re-signing job not found")
+    return JSONResponse(job)
+
+
+@app.get("/admin/export")
+@require_auth
+async def export_documents(request: Request,
+                           since: str = Query(None),
+                           until: str = Query(None),
+                           unique_id: list[str] = Query(None),
+                           status: str = Query("all"),
+                           inputs: bool = Query(False),
+                           export_all: bool = Query(False, alias="all")):
+    """
+    Выгрузка PDF отобранных документов архивом ZIP, который формируется при отправке
+    (zip_export). Отбор: since и until - даты загрузки YYYY-MM-DD включительно, unique_id -
+    UniqueID (параметр повторяется или через запятую), status - all, signed или error;
+    all=true - все документы. inputs=true добавляет входные XML. В архив входит опись manifest.csv.
+    """
+    try:
+        since_date = datetime.date.fromisoformat(since) if since else None
+        until_date = datetime.date.fromisoformat(until) if until else None
+    except ValueError as e:
+        return json_error(400, "bad_request", f"Invalid date: {e}")
+    if status not in zip_export.STATUSES:
+        return json_error(400, "bad_request", f"status must be one of: {', '.join(zip_export.STATUSES)}")
+    unique_ids = [item.strip() for value in unique_id or [] for item in value.split(",") if item.strip()]
+    if not (unique_ids or since_date or until_date or status != "all" or export_all):
+        return json_error(400, "bad_request", "Specify unique_id, since/until, status or all")
+    # Место занимается без ожидания до отбора документов и передается генератору архива
+    slot = zip_export.try_acquire_slot()
+    if slot is None:
+        return json_error(503, "export_busy", "Too many exports in progress", headers={"Retry-After": "60"})
+
+    response = None
+    try:
+        documents = await asyncio.to_thread(zip_export.select_documents, file_errors.all, unique_ids,
+                                            since_date, until_date, status)
+        if not documents:
+            return json_error(404, "not_found", "No documents match the selection")
+        logger.info(f"Exporting {len(documents)} documents")
+        filename = f"export_{datetime.datetime.now():%Y%m%d%H%M%S}.zip"
+        response = StreamingResponse(zip_export.stream_archive(documents, slot, include_inputs=inputs),
+                                     media_type="application/zip",
+                                     headers={"Content-Disposition": content_disposition("attachment", filename)},
+                                     background=BackgroundTask(slot.release))
+        return response
+    finally:
+        if response is None:
+            slot.release()
+
+
+PROBE_PATHS = ("/healthz", "/readyz")
+
+
 # Middleware для логирования запросов и ответов
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    # Идентификатор запроса для сквозной корреляции записей лога
+    # Частые проверки оркестратора не логируем
+    if request.url.path in PROBE_PATHS:
+        return await call_next(request)
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
     logger.info(f"Request URL: {request.url}, Method: {request.method}")
     try:
         response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        logger.info(f"Response status code: {response.status_code}")
+        return response
     except Exception as e:
         logger.error(f"Error occurred: {e}")
         raise
-    logger.info(f"Response status code: {response.status_code}")
-    return response
+    finally:
+        request_id_var.reset(token)
 
 
 # Обработка HTTP исключений
@@ -0,0 +1,59 @@
+# metrics.py
+import threading
+from collections import defaultdict, deque
+
+# Количество последних измерений, по которым считаются перцентили
+TIMING_WINDOW = 1000
+
+
+class Metrics:
+    """
+    Простые метрики процесса: счетчики и окна последних измерений длительности.
+    Потокобезопасны, так как обновляются и из цикла событий, и из экзекутора.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = defaultdict(lambda: deque(maxlen=TIMING_WINDOW))
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._timings[name].append(seconds)
+
+    def snapshot(self):
+        """Возвращает счетчики и сводку по длительностям (в миллисекундах)."""
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: sorted(values) for name, values in self._timings.items()}
+        return {
+            "counters": counters,
+            "timings_ms": {name: summarize(values) for name, values in timings.items()},
+        }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(sorted_values):
+    if not sorted_values:
+        return {"count": 0}
+    return {
+        "count": len(sorted_values),
+        "avg": round(sum(sorted_values) / len(sorted_values) * 1000, 1),
+        "p50": round(percentile(sorted_values, 0.50) * 1000, 1),
+        "p95": round(percentile(sorted_values, 0.95) * 1000, 1),
+        "p99": round(percentile(sorted_values, 0.99) * 1000, 1),
+        "max": round(sorted_values[-1] * 1000, 1),
+    }
+
+
+metrics = Metrics()
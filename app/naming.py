@@ -0,0 +1,28 @@
+# naming.py
+import datetime
+import os
+
+
+def split_upload_name(original_filename, now=None):
+    """
+    Базовое имя документа и расширение: исходное имя файла с меткой времени загрузки,
+    <имя>_YYYYMMDDHHMMSS. Метка задает подкаталог хранилища (storage.shard_subdir).
+    """
+    timestamp = (now or datetime.datetime.now()).strftime('%Y%m%d%H%M%S')
+    stem, extension = os.path.splitext(original_filename)
+    return f"{stem}_{timestamp}", extension
+
+
+def input_filename(base_filename, unique_id, extension):
+    """Имя сохраненных входных данных после извлечения UniqueID."""
+    return f"{base_filename}_{unique_id}{extension}"
+
+
+def signed_filename(base_filename, unique_id):
+    """Имя подписанного PDF в OUTPUT_PATH."""
+    return f"{base_filename}_{unique_id}_signed.pdf"
+
+
+def error_filename(base_filename):
+    """Имя PDF с ошибкой в OUTPUT_PATH."""
+    return f"{base_filename}_error.pdf"
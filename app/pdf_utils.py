@@ -6,21 +6,14 @@ from io import BytesIO
 from datetime import datetime, timezone, timedelta
 from logging import Logger
 from typing import Union
-
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextBox
-from pyhanko.sign import signers, PdfSignatureMetadata
-from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
-from pyhanko.sign.signers.pdf_signer import PdfSigner
-from pdfrw import PdfReader, PdfWriter, PageMerge
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
+from functools import lru_cache
 import tempfile
 
-from config import F_DATE, OUTPUT_PATH
+# Тяжелые библиотеки (pdfminer, pyHanko, pdfrw, reportlab, pikepdf) импортируются внутри функций,
+# чтобы импорт модуля не замедлял запуск; прогрев выполняет warmup.warm_up()
+from config import F_DATE, PDF_OBJECT_STREAMS, PDF_LINEARIZE
 from logger import get_logger
+from metrics import metrics
 
 # Настройка логирования
 logger: Logger = get_logger(__name__)
@@ -36,14 +29,20 @@ STAMP_FONT_BOLD = 'Roboto-Bold'
 STAMP_FONT_SIZE_REGULAR = 9
 STAMP_FONT_SIZE_BOLD = 10
 
-# Предварительная регистрация шрифтов
-try:
-    roboto_regular = os.path.join('static', 'fonts', 'Roboto-Regular.ttf')
-    roboto_bold = os.path.join('static', 'fonts', 'Roboto-Bold.ttf')
-    pdfmetrics.registerFont(TTFont(STAMP_FONT_REGULAR, roboto_regular))
-    pdfmetrics.registerFont(TTFont(STAMP_FONT_BOLD, roboto_bold))
-except Exception as e:
-    logger.error(f"Error registering fonts: {e}")
+
+@lru_cache(maxsize=None)
+def register_fonts():
+    """Регистрирует шрифты штампа в reportlab (однократно, при первом использовании)."""
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfbase import pdfmetrics
+
+    try:
+        roboto_regular = os.path.join('static', 'fonts', 'Roboto-Regular.ttf')
+        roboto_bold = os.path.join('static', 'fonts', 'Roboto-Bold.ttf')
+        pdfmetrics.registerFont(TTFont(STAMP_FONT_REGULAR, roboto_regular))
+        pdfmetrics.registerFont(TTFont(STAMP_FONT_BOLD, roboto_bold))
+    except Exception as e:
+        logger.error(f"Error registering fonts: {e}")
 
 
 async def sign_pdf(input_pdf: BytesIO, output_pdf: BytesIO, pfx_path: str,
@@ -82,7 +81,15 @@ async def sign_pdf(input_pdf: BytesIO, output_pdf: BytesIO, pfx_path: str,
 
                 # Отправляем пароль и завершаем ввод
                 password_bytes = (password + '\n').encode('utf-8')
-                stdout, stderr = await process.communicate(input=password_bytes)
+                try:
+                    stdout, stderr = await process.communicate(input=password_bytes)
+                except asyncio.CancelledError:
+                    # Конвертация отменена (истек срок запроса или клиент отключился): подпись не нужна
+                    process.kill()
+                    await process.wait()
+                    metrics.inc("csptest_killed")
+                    logger.warning("csptest killed: conversion cancelled")
+                    raise
 
                 if process.returncode == 0:
                     logger.info(f"csptest completed successfully.")
@@ -100,6 +107,10 @@ async def sign_pdf(input_pdf: BytesIO, output_pdf: BytesIO, pfx_path: str,
             logger.error(f"Error during PDF signing: {str(e)}")
             raise  # Передаем исключение дальше для обработки в вызывающей функции
     else:
+        from pyhanko.sign import signers, PdfSignatureMetadata
+        from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+        from pyhanko.sign.signers.pdf_signer import PdfSigner
+
         try:
             signer = signers.SimpleSigner.load_pkcs12(
                 pfx_file=pfx_path,
@@ -115,12 +126,12 @@ async def sign_pdf(input_pdf: BytesIO, output_pdf: BytesIO, pfx_path: str,
             raise
 
 
-def create_stamp_pdf(signer_name: str, page_width: float, page_height: float) -> PdfReader:
+def draw_stamp(can, signer_name: str, page_width: float, y_offset: float = 0):
     """
-    Создает PDF-файл со штампом.
+    Рисует штамп подписи на текущей странице canvas reportlab: по центру страницы,
+    рамка на высоте 30 пунктов над y_offset.
     """
-    packet = BytesIO()
-    can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+    from reportlab.pdfbase import pdfmetrics
 
     current_time = datetime.now(MOSCOW_TZ).strftime(F_DATE)
 
@@ -138,7 +149,7 @@ def create_stamp_pdf(signer_name: str, page_width: float, page_height: float) ->
     width = max_text_width + 2 * STAMP_PADDING
     height = 60
     x = (page_width - width) / 2
-    y = 30
+    y = 30 + y_offset
 
     # Рисуем рамку штампа
     can.setStrokeColorRGB(0, 0, 0)
@@ -153,9 +164,11 @@ def create_stamp_pdf(signer_name: str, page_width: float, page_height: float) ->
     can.drawString(x + STAMP_PADDING, y + height - 30, text2)
     can.drawString(x + STAMP_PADDING, y + height - 45, text3)
 
-    can.save()
-    packet.seek(0)
-    return PdfReader(packet)
+
+def draw_page_number(can, page_num: int, total_pages: int):
+    """Рисует номер страницы на текущей странице canvas reportlab."""
+    can.setFont(STAMP_FONT_REGULAR, 10)
+    can.drawString(500, 20, f"Страница {page_num + 1} из {total_pages}")
 
 
 def get_bottom_margin(input_pdf: Union[str, io.BytesIO, bytes]) -> float:
@@ -165,6 +178,9 @@ def get_bottom_margin(input_pdf: Union[str, io.BytesIO, bytes]) -> float:
     :param input_pdf: Путь к файлу PDF, объект BytesIO или байтовая строка, содержащая PDF
     :return: Расстояние от нижнего края до последнего текстового элемента в пунктах
     """
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextBox
+
     try:
         # Подготавливаем входные данные
         if isinstance(input_pdf, str):
@@ -206,95 +222,135 @@ def get_bottom_margin(input_pdf: Union[str, io.BytesIO, bytes]) -> float:
         return 0
 
 
-def add_signature_stamp(input_pdf, output_pdf, signer_name):
+def stamp_offset(page, page_height: float) -> float:
+    """Смещение штампа по вертикали для страницы pdfrw с учетом нижнего отступа текста."""
+    from pdfrw import PdfWriter
+
+    # Получаем отступ для текущей страницы
+    page_buffer = BytesIO()
+    temp_writer = PdfWriter()
+    temp_writer.addpage(page)
+    temp_writer.write(page_buffer)
+    page_buffer.seek(0)
+    bottom_margin = get_bottom_margin(page_buffer)
+
+    if bottom_margin < STAMP_HEIGHT:
+        # Если места недостаточно, размещаем штамп выше текста
+        return page_height - STAMP_HEIGHT - 10
+    # Если места достаточно, размещаем штамп с учетом отступа
+    return page_height - STAMP_HEIGHT - 10 - bottom_margin
+
+
+def add_stamp_and_page_numbers(pdf_buffer, signer_name, compress=True) -> BytesIO:
+    """
+    Накладывает на каждую страницу штамп подписи и номер страницы.
+
+    Штампы и номера всех страниц рисуются в одном многостраничном наложении reportlab,
+    поэтому шрифты штампа и номеров встраиваются в документ один раз.
+    """
+    from pdfrw import PdfReader, PdfWriter, PageMerge
+    from reportlab.pdfgen import canvas
+
     try:
-        existing_pdf = PdfReader(input_pdf)
-        if len(existing_pdf.pages) == 0:
+        register_fonts()
+        pdf_reader = PdfReader(pdf_buffer)
+        total_pages = len(pdf_reader.pages)
+        if total_pages == 0:
             raise ValueError("PDF документ не содержит страниц")
 
-        # Получаем размеры первой страницы для создания штампа
-        first_page = existing_pdf.pages[0]
+        # Получаем размеры первой страницы для размещения штампа
+        first_page = pdf_reader.pages[0]
         if '/MediaBox' not in first_page:
             raise ValueError("Невозможно получить размеры страницы")
 
         page_width = float(first_page['/MediaBox'][2])
         page_height = float(first_page['/MediaBox'][3])
 
-        # Создаем штамп один раз, который будем использовать для всех страниц
-        stamp_pdf = create_stamp_pdf(signer_name, page_width, page_height)
-
-        output = PdfWriter()
-
-        # Обрабатываем каждую страницу
-        for page in existing_pdf.pages:
-            # Получаем отступ для текущей страницы
-            page_buffer = BytesIO()
-            temp_writer = PdfWriter()
-            temp_writer.addpage(page)
-            temp_writer.write(page_buffer)
-            page_buffer.seek(0)
-            bottom_margin = get_bottom_margin(page_buffer)
-
-            # Добавляем штамп на страницу
-            merger = PageMerge(page)
-
-            # Вычисляем позицию штампа
-            if bottom_margin < STAMP_HEIGHT:
-                # Если места недостаточно, размещаем штамп выше текста
-                stamp_y = page_height - STAMP_HEIGHT - 10
-            else:
-                # Если места достаточно, размещаем штамп с учетом отступа
-                stamp_y = page_height - STAMP_HEIGHT - 10 - bottom_margin
-
-            stamp_page = stamp_pdf.pages[0]
-            stamp_page.y = stamp_y
-
-            # Добавляем штамп и сохраняем страницу
-            merger.add(stamp_page).render()
-            output.addpage(merger.render())
-
-        output.write(output_pdf)
-        output_pdf.seek(0)
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+        for page_num, page in enumerate(pdf_reader.pages):
+            draw_stamp(can, signer_name, page_width, stamp_offset(page, page_height))
+            draw_page_number(can, page_num, total_pages)
+            can.showPage()
+        can.save()
+        packet.seek(0)
+        overlay = PdfReader(packet)
+
+        pdf_writer = PdfWriter(compress=compress)
+        for page, overlay_page in zip(pdf_reader.pages, overlay.pages):
+            PageMerge(page).add(overlay_page).render()
+            pdf_writer.addpage(page)
+
+        output_buffer = io.BytesIO()
+        pdf_writer.write(output_buffer)
+        output_buffer.seek(0)
+        return output_buffer
     except Exception as e:
         logger.error(f"Ошибка при добавлении штампов подписи: {str(e)}")
         raise
 
-FONT_PATH = os.path.join('static', 'fonts', 'Roboto-Regular.ttf')
+def merge_pdfs(inputs) -> BytesIO:
+    """
+    Объединяет несколько PDF (пути, файловые объекты или BytesIO) в один документ.
+    """
+    from pdfrw import PdfReader, PdfWriter
 
-def add_page_numbers(pdf_buffer):
-    pdf_reader = PdfReader(pdf_buffer)
-    pdf_writer = PdfWriter()
+    pdf_writer = PdfWriter(compress=True)
+    for pdf_input in inputs:
+        pdf_writer.addpages(PdfReader(pdf_input).pages)
 
-    for page_num, page in enumerate(pdf_reader.pages):
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
-        can.setFont("Roboto-Regular", 10)
-        can.drawString(500, 20, f"Страница {page_num + 1} из {len(pdf_reader.pages)}")
-        can.save()
-        packet.seek(0)
+    output_buffer = io.BytesIO()
+    pdf_writer.write(output_buffer)
+    output_buffer.seek(0)
+    return output_buffer
 
-        new_pdf = PdfReader(packet)
-        merger = PageMerge(page)
-        merger.add(new_pdf.pages[0]).render()
-        pdf_writer.addpage(page)
+@lru_cache(maxsize=None)
+def load_pikepdf():
+    """Модуль pikepdf или None, если он не установлен (предупреждение выводится один раз)."""
+    try:
+        import pikepdf
+        return pikepdf
+    except ImportError:
+        logger.warning("pikepdf is not installed, PDF optimization is skipped")
+        return None
+
+
+def optimize_pdf(pdf_buffer, object_streams=PDF_OBJECT_STREAMS, linearize=PDF_LINEARIZE) -> BytesIO:
+    """
+    Пересохраняет PDF через pikepdf перед подписью: сжимает несжатые потоки, при object_streams
+    упаковывает объекты в сжатые потоки объектов (PDF 1.5), при linearize линеаризует документ
+    для быстрого показа первой страницы в браузере. Без pikepdf возвращает PDF без изменений.
+    """
+    pikepdf = load_pikepdf()
+    if pikepdf is None:
+        return pdf_buffer
 
+    pdf_buffer.seek(0)
     output_buffer = io.BytesIO()
-    pdf_writer.write(output_buffer)
+    with pikepdf.open(pdf_buffer) as pdf:
+        pdf.save(output_buffer, compress_streams=True,
+                 object_stream_mode=(pikepdf.ObjectStreamMode.generate if object_streams
+                                     else pikepdf.ObjectStreamMode.preserve),
+                 linearize=linearize)
     output_buffer.seek(0)
     return output_buffer
 
 # Генерация пустого PDF
 def create_empty_pdf(buffer):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
     c = canvas.Canvas(buffer, pagesize=letter)
     c.drawString(100, 750, "Error: PDF file not generated due to an error.")
     c.showPage()
     c.save()
 
-# Функция для создания пустого PDF и обработки ошибок
-async def create_error_pdf(filename, message):
+@lru_cache(maxsize=None)
+def error_pdf_bytes():
+    """
+    PDF с ошибкой не зависит от документа, поэтому создается один раз на процесс (при прогреве)
+    и не сохраняется для каждой ошибки: /output/<имя>_error.pdf и выгрузка ZIP отдают этот PDF.
+    """
     pdf_buffer = BytesIO()
     create_empty_pdf(pdf_buffer)
-    pdf_filepath = os.path.join(OUTPUT_PATH, filename)
-    with open(pdf_filepath, "wb") as f:
-        f.write(pdf_buffer.getvalue())
-    return pdf_buffer
\ No newline at end of file
+    return pdf_buffer.getvalue()
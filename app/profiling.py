@@ -0,0 +1,166 @@
+# profiling.py
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import (MEMORY_TRACE_SAMPLE_RATE, MEMORY_BUDGET_MB, MEMORY_BASE_MB, MEMORY_PER_POINT_KB,
+                    MEMORY_PER_DEPOSIT_KB, MEMORY_PER_POINT_CHUNKED_KB, LARGE_DOC_CHUNK_POINTS, LARGE_DOC_CHUNKING)
+from logger import get_logger
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Прогноз потребления памяти документом превышает бюджет MEMORY_BUDGET_MB."""
+
+
+def read_status_kb(field):
+    """Значение поля из /proc/self/status в килобайтах (VmRSS, VmHWM), None вне Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Сбрасывает пиковый RSS процесса (VmHWM); возвращает False, если это недоступно."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# Выполняющиеся этапы конвертаций всего процесса и число начатых этапов: прирост RSS
+# и пик выделений записываются только для этапов, во время которых другие этапы не выполнялись
+_stages_lock = threading.Lock()
+_running_stages = 0
+_stage_starts = 0
+
+# Счетчик конвертаций, для которых включен tracemalloc
+_trace_lock = threading.Lock()
+_trace_users = 0
+
+
+class ConversionProfile:
+    """
+    Время и память по этапам одной конвертации.
+
+    Для каждого этапа фиксируется длительность, прирост пикового RSS относительно начала
+    этапа и, для выборки конвертаций (MEMORY_TRACE_SAMPLE_RATE), пик выделений Python по tracemalloc.
+    RSS и его пик (VmHWM), как и пик tracemalloc, - показатели всего процесса, поэтому прирост RSS
+    и пик выделений записываются только для этапов, выполнявшихся в одиночку; этапы, пересекшиеся
+    с другими конвертациями (в том числе с повторной подписью), отмечаются shared, и их пики
+    не сбрасываются.
+
+    Пока выполняется хотя бы одна конвертация из выборки, tracemalloc включен для всего процесса
+    и замедляет все параллельные конвертации, а не только отслеживаемую.
+    """
+
+    def __init__(self, trace=None):
+        self.stages = {}
+        self.trace = random.random() < MEMORY_TRACE_SAMPLE_RATE if trace is None else trace
+        self.queue_wait_ms = None
+
+    @contextmanager
+    def stage(self, name):
+        global _running_stages, _stage_starts
+        with _stages_lock:
+            _running_stages += 1
+            _stage_starts += 1
+            exclusive = _running_stages == 1
+            starts = _stage_starts
+        # VmHWM сбрасывается для всего процесса: только этап, выполняющийся в одиночку
+        rss_before = read_status_kb("VmRSS") if exclusive else None
+        peak_reset = reset_peak_rss() if exclusive else False
+        if self.trace and exclusive:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with _stages_lock:
+                _running_stages -= 1
+                exclusive = exclusive and _stage_starts == starts
+            record = {"ms": round((time.perf_counter() - started) * 1000)}
+            if exclusive:
+                rss_peak = read_status_kb("VmHWM") if peak_reset else read_status_kb("VmRSS")
+                if rss_before is not None and rss_peak is not None:
+                    record["rss_delta_mb"] = round((rss_peak - rss_before) / 1024, 1)
+                if self.trace:
+                    record["alloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+            else:
+                # Этап пересекся с другими: пики RSS и выделений не относятся к документу
+                record["shared"] = True
+            self.stages[name] = record
+
+    def __enter__(self):
+        global _trace_users
+        if self.trace:
+            with _trace_lock:
+                if _trace_users == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                _trace_users += 1
+        return self
+
+    def __exit__(self, *exc):
+        global _trace_users
+        if self.trace:
+            with _trace_lock:
+                _trace_users -= 1
+                if _trace_users == 0:
+                    tracemalloc.stop()
+
+    def summary(self):
+        result = {"stages": self.stages, "traced": self.trace}
+        if self.queue_wait_ms is not None:
+            result["queue_wait_ms"] = self.queue_wait_ms
+        peaks = [stage["rss_delta_mb"] for stage in self.stages.values() if "rss_delta_mb" in stage]
+        if peaks:
+            result["peak_rss_delta_mb"] = max(peaks)
+        return result
+
+
+def predict_memory_mb(points, deposits, chunked=False):
+    """
+    Прогноз пикового потребления памяти конвертацией (МБ) по числу точек и месторождений.
+    В режиме частей разметка WeasyPrint ограничена одной частью, а на каждую точку
+    приходится только объем итогового PDF.
+    """
+    if chunked:
+        layout_points = min(points, LARGE_DOC_CHUNK_POINTS)
+        return (MEMORY_BASE_MB + (layout_points * MEMORY_PER_POINT_KB + points * MEMORY_PER_POINT_CHUNKED_KB
+                                  + deposits * MEMORY_PER_DEPOSIT_KB) / 1024)
+    return MEMORY_BASE_MB + (points * MEMORY_PER_POINT_KB + deposits * MEMORY_PER_DEPOSIT_KB) / 1024
+
+
+def check_memory_budget(points, deposits, large):
+    """
+    Проверяет прогноз памяти до рендеринга. Возвращает True, если документ нужно рендерить
+    частями (он большой или в бюджет укладывается только режим частей, если он включен,
+    LARGE_DOC_CHUNKING); выбрасывает MemoryBudgetExceeded, если бюджет превышен и в режиме частей.
+    """
+    if not MEMORY_BUDGET_MB:
+        return large
+    predicted = predict_memory_mb(points, deposits, chunked=large)
+    if predicted <= MEMORY_BUDGET_MB:
+        return large
+    if not large and LARGE_DOC_CHUNKING:
+        predicted_chunked = predict_memory_mb(points, deposits, chunked=True)
+        if predicted_chunked <= MEMORY_BUDGET_MB:
+            logger.warning(f"Predicted memory {predicted:.0f} MB exceeds budget {MEMORY_BUDGET_MB} MB, "
+                           f"rendering in chunks ({predicted_chunked:.0f} MB)")
+            return True
+        predicted = predicted_chunked
+    raise MemoryBudgetExceeded(f"Document is too large: predicted memory {predicted:.0f} MB "
+                               f"exceeds budget {MEMORY_BUDGET_MB} MB ({points} points, {deposits} deposits)")
@@ -0,0 +1,202 @@
+# resign.py
+import asyncio
+import datetime
+import os
+import re
+import socket
+import uuid
+from io import BytesIO
+
+from admission import conversion_gate, ConversionRejected
+from config import (UNSIGNED_PATH, OUTPUT_PATH, FILE_ERRORS_PATH, COMPRESS_OUTPUTS, RESIGN_CONCURRENCY,
+                    RESIGN_JOBS_PATH)
+from logger import get_logger
+from shared_store import SharedJsonStore
+import storage
+from xml_processor import finalize_pdf
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Имя неподписанного PDF: <имя>_YYYYMMDDHHMMSS_<UniqueID>_unsigned.pdf; метка - последняя в имени
+UNSIGNED_RE = re.compile(r'^.*_(\d{14})_(.+?)_unsigned\.pdf$')
+
+file_errors = SharedJsonStore(FILE_ERRORS_PATH)
+
+# Состояние фоновых заданий повторной подписи (/admin/resign) хранится в общем файле:
+# его читает любой воркер, а после перезапуска воркера остаются результаты по документам.
+# Хранятся последние RESIGN_JOBS_KEPT заданий
+RESIGN_JOBS_KEPT = 50
+resign_jobs = SharedJsonStore(RESIGN_JOBS_PATH, max_entries=RESIGN_JOBS_KEPT)
+_job_tasks = set()
+
+
+def unsigned_filename(base_filename, unique_id):
+    return f"{base_filename}_{unique_id}_unsigned.pdf"
+
+
+def signed_filename(unsigned_name):
+    return unsigned_name[:-len("_unsigned.pdf")] + "_signed.pdf"
+
+
+def select_documents(unique_ids=None, since=None, until=None):
+    """
+    Отбирает сохраненные неподписанные PDF по UniqueID и/или по дате загрузки
+    (since и until - даты datetime.date включительно). Без условий отбираются все документы.
+    Возвращает логические имена файлов, от старых к новым.
+    """
+    unique_ids = {unique_id.lower() for unique_id in unique_ids} if unique_ids else None
+    selected = []
+    for entry in storage.iter_files(UNSIGNED_PATH):
+        filename = storage.logical_name(entry.name)
+        match = UNSIGNED_RE.search(filename)
+        if not match:
+            continue
+        timestamp, unique_id = match.groups()
+        if unique_ids is not None and unique_id.lower() not in unique_ids:
+            continue
+        uploaded = datetime.datetime.strptime(timestamp, "%Y%m%d%H%M%S").date()
+        if (since and uploaded < since) or (until and uploaded > until):
+            continue
+        selected.append((timestamp, filename))
+    return [filename for _, filename in sorted(selected)]
+
+
+async def resign_document(filename, project_path):
+    """
+    Повторно ставит штамп, номера страниц и подпись на сохраненный неподписанный PDF
+    и атомарно заменяет подписанный PDF. Ошибка обработки документа при этом снимается.
+    """
+    data = await asyncio.to_thread(storage.read_bytes, UNSIGNED_PATH, filename)
+    if data is None:
+        raise FileNotFoundError(f"Unsigned PDF not found: {filename}")
+    signed_pdf_buffer = await finalize_pdf(BytesIO(data), project_path)
+    pdf_filename = signed_filename(filename)
+    await asyncio.to_thread(storage.write_file, OUTPUT_PATH, pdf_filename, signed_pdf_buffer.getvalue(),
+                            compress=COMPRESS_OUTPUTS)
+
+    # Если подпись ранее завершилась ошибкой, входной файл числится с ошибкой и PDF с ошибкой.
+    # Ошибки записываются под именем входного файла без UniqueID (<имя>_YYYYMMDDHHMMSS.xml)
+    stem = filename[:-len("_unsigned.pdf")]
+    match = UNSIGNED_RE.search(filename)
+    base_filename = filename[:match.end(1)] if match else stem
+    errors = await asyncio.to_thread(file_errors.all)
+    failed = [name for name in errors if os.path.splitext(name)[0] in (base_filename, stem)]
+    if failed:
+        await asyncio.to_thread(file_errors.delete, failed)
+        await asyncio.to_thread(storage.remove, OUTPUT_PATH, f"{base_filename}_error.pdf")
+    return pdf_filename
+
+
+async def acquire_slot(cost=0):
+    """
+    Слот полосы конвертаций для стоимости cost (мс); при заполненной очереди ожидание
+    повторяется через Retry-After. Используется также демоном спула.
+    """
+    while True:
+        try:
+            return await conversion_gate.acquire(cost)
+        except ConversionRejected as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def resign_documents(filenames, project_path, concurrency=RESIGN_CONCURRENCY, progress=None):
+    """
+    Повторно подписывает документы, не более concurrency одновременно. Каждый документ
+    занимает слот полосы конвертаций (conversion_gate), поэтому повторная подпись не превышает
+    общий предел MAX_CONCURRENT_CONVERSIONS вместе с текущими конвертациями.
+    Возвращает словарь {имя файла: "ok" или текст ошибки}; после каждого документа
+    вызывается корутина progress(results), если она задана.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+
+    async def run(filename):
+        async with semaphore:
+            ticket = await acquire_slot()
+            try:
+                await resign_document(filename, project_path)
+                results[filename] = "ok"
+            except Exception as e:
+                logger.error(f"Re-signing {filename} failed: {e}")
+                results[filename] = str(e)
+            finally:
+                conversion_gate.release(ticket)
+            if progress is not None:
+                await progress(results)
+
+    await asyncio.gather(*(run(filename) for filename in filenames))
+    succeeded = sum(1 for result in results.values() if result == "ok")
+    logger.info(f"Re-signed {succeeded} of {len(filenames)} documents")
+    return results
+
+
+def job_state(job, results):
+    """Состояние задания: число отобранных, подписанных и ошибки по документам."""
+    failed = {filename: error for filename, error in results.items() if error != "ok"}
+    return dict(job, resigned=len(results) - len(failed), failed=failed)
+
+
+def _worker_alive(worker):
+    """Жив ли процесс воркера <хост>-<pid>; о процессах другого хоста судить нельзя - считаются живыми."""
+    host, _, pid = worker.rpartition("-")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        pass
+    return True
+
+
+def get_job(job_id):
+    """
+    Состояние задания из общего хранилища или None. Задание, воркер которого завершился
+    до окончания подписи, отмечается interrupted: результаты по документам сохраняются.
+    """
+    state = resign_jobs.get(job_id)
+    if state is not None and state["status"] == "running" and not _worker_alive(state["worker"]):
+        state = dict(state, status="interrupted")
+    return state
+
+
+async def _run_job(job, filenames, project_path):
+    lock = asyncio.Lock()
+    latest = {}
+
+    async def progress(results):
+        # Записи выполняются по очереди, чтобы более раннее состояние не заменило позднее
+        async with lock:
+            latest.update(results)
+            await asyncio.to_thread(resign_jobs.set, job["id"], job_state(job, latest))
+
+    try:
+        await resign_documents(filenames, project_path, progress=progress)
+        job["status"] = "completed"
+    except Exception as e:
+        logger.error(f"Re-signing job {job['id']} failed: {e}")
+        job["status"] = "failed"
+    finally:
+        job["finished"] = datetime.datetime.now().isoformat(timespec="seconds")
+        async with lock:
+            await asyncio.to_thread(resign_jobs.set, job["id"], job_state(job, latest))
+
+
+async def start_job(filenames, project_path):
+    """Запускает повторную подпись документов в фоне и возвращает состояние задания."""
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "status": "running",
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "finished": None,
+        "worker": f"{socket.gethostname()}-{os.getpid()}",
+        "selected": len(filenames),
+    }
+    state = job_state(job, {})
+    await asyncio.to_thread(resign_jobs.set, job["id"], state)
+    task = asyncio.create_task(_run_job(job, filenames, project_path))
+    _job_tasks.add(task)  # Ссылка на задачу, чтобы ее не удалил сборщик мусора
+    task.add_done_callback(_job_tasks.discard)
+    return state
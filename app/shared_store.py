@@ -0,0 +1,160 @@
+# shared_store.py
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class SharedJsonStore:
+    """
+    Словарь, хранящийся в JSON-файле и безопасный для нескольких процессов.
+
+    Изменения выполняются под эксклюзивной блокировкой (flock на файле <path>.lock):
+    файл перечитывается, изменяется и атомарно заменяется через os.replace.
+    Чтение использует кэш, который обновляется при изменении файла другим процессом.
+    max_entries ограничивает размер словаря: при превышении удаляются записи, изменявшиеся
+    раньше остальных. Запись переписывает файл целиком, поэтому из асинхронного кода
+    изменения выполняются в потоке (asyncio.to_thread).
+    """
+
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock_path = f"{path}.lock"
+        self._thread_lock = threading.Lock()
+        self._cache = {}
+        self._cache_key = None
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_key(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        key = self._file_key()
+        if key is None:
+            self._cache, self._cache_key = {}, None
+        elif key != self._cache_key:
+            with open(self.path, "r") as f:
+                self._cache = json.load(f)
+            self._cache_key = key
+        return self._cache
+
+    def _save(self, data):
+        directory = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".store-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._cache, self._cache_key = data, self._file_key()
+
+    def all(self):
+        """Возвращает актуальную копию всего словаря."""
+        with self._locked(exclusive=False):
+            return dict(self._load())
+
+    def get(self, key, default=None):
+        return self.all().get(key, default)
+
+    def set(self, key, value):
+        with self._locked(exclusive=True):
+            data = dict(self._load())
+            data.pop(key, None)  # Измененная запись переносится в конец: порядок - по времени изменения
+            data[key] = value
+            if self.max_entries:
+                for stale_key in list(data)[:max(len(data) - self.max_entries, 0)]:
+                    del data[stale_key]
+            self._save(data)
+
+    def delete(self, keys):
+        with self._locked(exclusive=True):
+            data = dict(self._load())
+            for key in keys:
+                data.pop(key, None)
+            self._save(data)
+
+    def clear(self):
+        with self._locked(exclusive=True):
+            self._save({})
+
+
+class JsonDirStore:
+    """
+    Словарь, каждая запись которого хранится в отдельном JSON-файле каталога (<path>/<ключ>.json).
+
+    Запись атомарно заменяет только свой файл и не блокирует других писателей, поэтому ее
+    стоимость не зависит от числа записей. Подходит для данных, которые по каждому ключу пишет
+    один процесс (статистика конвертаций). Чтение - по ключам; число файлов ограничивает prune.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key, default=None):
+        try:
+            with open(self._file(key), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return default
+
+    def set(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".entry-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(temp_path, self._file(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        try:
+            with os.scandir(self.path) as entries:
+                return [entry for entry in entries if entry.name.endswith(".json") and entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def clear(self):
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def prune(self, max_entries):
+        """Удаляет записи, изменявшиеся раньше остальных, сверх max_entries; возвращает их число."""
+        entries = self._entries()
+        stale = sorted(entries, key=lambda entry: entry.stat().st_mtime)[:max(len(entries) - max_entries, 0)]
+        for entry in stale:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        return len(stale)
@@ -0,0 +1,310 @@
+# spool.py
+"""
+Прием заявлений через каталог-спул, без HTTP.
+
+Внешние системы кладут XML-файлы в SPOOL_DIR/inbox. Демон находит файлы, которые не
+изменялись SPOOL_MIN_AGE секунд, и захватывает каждый атомарным переименованием в свой
+подкаталог SPOOL_DIR/processing/<идентификатор процесса>; файл получает базовое имя документа
+(<имя>_YYYYMMDDHHMMSS), как при загрузке через /upload/. Файл конвертируется
+(convert_xml_to_pdf) пулом из SPOOL_WORKERS обработчиков; каждая конвертация, как и при загрузке,
+занимает слот полосы конвертаций (conversion_gate) по оценке стоимости документа. Входные данные и подписанный PDF
+сохраняются в STORAGE_PATH и OUTPUT_PATH под теми же именами, что и при загрузке, ошибки
+попадают в file_errors и каталог файлов. После обработки файл удаляется из processing,
+при ошибке переносится в SPOOL_DIR/failed вместе с файлом <имя>.error с текстом ошибки.
+
+Каталог процесса в processing заблокирован (flock) на все время работы демона. При запуске
+демон забирает файлы из каталогов, блокировка которых свободна (процесс-владелец завершился),
+и обрабатывает их повторно под прежними именами, поэтому результаты не дублируются.
+Несколько демонов (в том числе на разных узлах с общим каталогом) могут работать одновременно.
+
+Запуск из каталога app: python spool.py
+"""
+import asyncio
+import fcntl
+import json
+import os
+import signal
+import socket
+import time
+import uuid
+
+from admission import conversion_gate
+from config import (STORAGE_PATH, OUTPUT_PATH, FILE_ERRORS_PATH, CONVERSION_STATS_PATH,
+                    COMPRESS_OUTPUTS, KEEP_UNSIGNED_PDF, SPOOL_DIR, SPOOL_WORKERS, SPOOL_POLL_INTERVAL, SPOOL_MIN_AGE)
+from logger import get_logger, request_id_var
+import naming
+from profiling import ConversionProfile
+import resign
+from shared_store import SharedJsonStore, JsonDirStore
+import storage
+import warmup
+from xml_processor import convert_xml_to_pdf, find_values_in_xml, run_blocking, estimate_cost
+import xml_backend
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+INBOX_PATH = os.path.join(SPOOL_DIR, "inbox")
+PROCESSING_PATH = os.path.join(SPOOL_DIR, "processing")
+FAILED_PATH = os.path.join(SPOOL_DIR, "failed")
+LOCK_NAME = ".lock"
+
+file_errors = SharedJsonStore(FILE_ERRORS_PATH)
+conversion_stats = JsonDirStore(CONVERSION_STATS_PATH)
+
+
+class SpoolError(Exception):
+    """Документ из спула не может быть обработан (некорректный XML, нет обязательных полей)."""
+
+
+def is_candidate(entry, now):
+    """Файл готов к захвату: XML, не скрытый и не изменялся SPOOL_MIN_AGE секунд (запись завершена)."""
+    if not entry.is_file() or entry.name.startswith(".") or not entry.name.lower().endswith(".xml"):
+        return False
+    return now - entry.stat().st_mtime >= SPOOL_MIN_AGE
+
+
+def ready_files():
+    """Имена файлов inbox, готовых к захвату, от самых старых."""
+    now = time.time()
+    entries = [entry for entry in os.scandir(INBOX_PATH) if is_candidate(entry, now)]
+    return [entry.name for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime)]
+
+
+def claim(name, work_dir):
+    """
+    Захватывает файл inbox/name переименованием в work_dir под базовым именем документа.
+    Возвращает новое имя или None, если файл уже захвачен другим процессом.
+    """
+    base_filename, extension = naming.split_upload_name(name)
+    claimed = f"{base_filename}{extension}"
+    try:
+        os.rename(os.path.join(INBOX_PATH, name), os.path.join(work_dir, claimed))
+    except FileNotFoundError:
+        return None
+    return claimed
+
+
+def lock_work_dir(work_dir):
+    """Блокирует каталог процесса на время работы; блокировка снимается при завершении процесса."""
+    lock_file = open(os.path.join(work_dir, LOCK_NAME), "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return lock_file
+
+
+def create_work_dir(work_dir):
+    """
+    Создает и блокирует каталог процесса. Каталог создается и блокируется под скрытым именем,
+    которое recover пропускает, и только затем переименовывается: иначе другой демон,
+    запущенный одновременно, мог бы между созданием и блокировкой принять каталог за брошенный
+    и удалить его. Возвращает файл блокировки.
+    """
+    hidden_dir = os.path.join(os.path.dirname(work_dir), "." + os.path.basename(work_dir))
+    os.makedirs(hidden_dir)
+    lock_file = lock_work_dir(hidden_dir)
+    os.rename(hidden_dir, work_dir)
+    return lock_file
+
+
+def recover(work_dir):
+    """
+    Переносит в work_dir файлы из каталогов processing, владельцы которых завершились
+    (блокировка свободна), и удаляет эти каталоги. Возвращает имена перенесенных файлов.
+    """
+    recovered = []
+    for entry in os.scandir(PROCESSING_PATH):
+        # Скрытые каталоги еще создаются другим демоном (create_work_dir)
+        if not entry.is_dir() or entry.name.startswith(".") or entry.path == work_dir:
+            continue
+        names = []
+        try:
+            with open(os.path.join(entry.path, LOCK_NAME), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Владелец каталога работает
+                for name in os.listdir(entry.path):
+                    if name != LOCK_NAME:
+                        os.rename(os.path.join(entry.path, name), os.path.join(work_dir, name))
+                        names.append(name)
+                os.remove(os.path.join(entry.path, LOCK_NAME))
+            os.rmdir(entry.path)
+        except OSError as e:
+            # Каталог одновременно восстанавливает другой демон; остаток заберет следующий запуск
+            logger.warning(f"Recovery of {entry.name} incomplete: {e}")
+        if names:
+            logger.info(f"Recovered {len(names)} files of stopped process {entry.name}")
+        recovered.extend(names)
+    return recovered
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def fail(work_dir, name, message):
+    """Переносит файл в failed и сохраняет рядом текст ошибки."""
+    os.replace(os.path.join(work_dir, name), os.path.join(FAILED_PATH, name))
+    with open(os.path.join(FAILED_PATH, f"{name}.error"), "w", encoding="utf-8") as f:
+        f.write(message)
+
+
+async def process(work_dir, name, project_path):
+    """
+    Обрабатывает захваченный файл так же, как /upload/: сохраняет входные данные,
+    проверяет документ, конвертирует и сохраняет подписанный PDF.
+    """
+    base_filename, file_extension = os.path.splitext(name)
+    path = os.path.join(work_dir, name)
+    xml_content = await asyncio.to_thread(read_file, path)
+    await asyncio.to_thread(storage.write_file, STORAGE_PATH, name, xml_content, compress=True)
+
+    try:
+        root = await run_blocking(xml_backend.parse, xml_content)
+    except xml_backend.InvalidXml as e:
+        raise SpoolError(str(e))
+    unique_id = find_values_in_xml(root, 'UniqueID')
+    if not unique_id:
+        raise SpoolError("UniqueID not found in XML")
+    try:
+        await run_blocking(xml_backend.validate, root)
+    except xml_backend.InvalidDocument as e:
+        raise SpoolError(str(e))
+
+    input_filename = naming.input_filename(base_filename, unique_id, file_extension)
+    await asyncio.to_thread(storage.rename, STORAGE_PATH, name, input_filename)
+
+    # Слот полосы по стоимости документа, как при загрузке; при заполненной очереди ожидание повторяется
+    cost = await run_blocking(estimate_cost, root, len(xml_content))
+    ticket = await resign.acquire_slot(cost)
+    try:
+        await asyncio.to_thread(conversion_stats.set, input_filename,
+                                {"status": "in_progress", "unique_id": unique_id})
+        with ConversionProfile() as profile:
+            profile.queue_wait_ms = round(ticket.queue_wait * 1000)
+            try:
+                unsigned_filename = (resign.unsigned_filename(base_filename, unique_id)
+                                     if KEEP_UNSIGNED_PDF else None)
+                pdf_buffer = await convert_xml_to_pdf(xml_content, project_path, profile, unsigned_filename,
+                                                      root=root)
+            finally:
+                stats = dict(profile.summary(), unique_id=unique_id, lane=ticket.lane.name, cost_ms=cost,
+                             source="spool")
+                await asyncio.to_thread(conversion_stats.set, input_filename, stats)
+                logger.info(f"Conversion stats for {unique_id}: {json.dumps(stats)}")
+    finally:
+        conversion_gate.release(ticket)
+    pdf_filename = naming.signed_filename(base_filename, unique_id)
+    await asyncio.to_thread(storage.write_file, OUTPUT_PATH, pdf_filename, pdf_buffer.getbuffer(),
+                            compress=COMPRESS_OUTPUTS)
+    return pdf_filename
+
+
+class SpoolDaemon:
+    """Сканирование inbox, захват файлов и пул обработчиков."""
+
+    def __init__(self, workers=SPOOL_WORKERS, poll_interval=SPOOL_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.project_path = os.path.dirname(os.path.abspath(__file__))
+        self.work_dir = os.path.join(PROCESSING_PATH, f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.queue = asyncio.Queue()
+        # Захваченных, но еще не обработанных файлов не больше двух на обработчик:
+        # остальные остаются в inbox, доступные другим демонам
+        self.slots = asyncio.Semaphore(workers * 2)
+        self.stopping = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+
+    async def handle(self, name):
+        request_id_var.set(uuid.uuid4().hex[:16])
+        started = time.perf_counter()
+        try:
+            pdf_filename = await process(self.work_dir, name, self.project_path)
+        except Exception as e:
+            message = str(e)
+            logger.error(f"Spool file {name} failed: {message}")
+            self.failed += 1
+            await asyncio.to_thread(file_errors.set, name, message)
+            await asyncio.to_thread(fail, self.work_dir, name, message)
+            return
+        await asyncio.to_thread(os.remove, os.path.join(self.work_dir, name))
+        self.processed += 1
+        logger.info(f"Spool file {name} converted to {pdf_filename} in "
+                    f"{(time.perf_counter() - started) * 1000:.0f} ms")
+
+    async def worker(self):
+        while True:
+            name = await self.queue.get()
+            try:
+                await self.handle(name)
+            finally:
+                self.slots.release()
+                self.queue.task_done()
+
+    async def scan(self):
+        """
+        Захватывает готовые файлы из inbox, пока в очереди обработчиков есть место.
+        Обход каталога и захват выполняются в потоке: на большом или сетевом inbox
+        они не блокируют цикл событий и работающие конвертации.
+        """
+        for name in await asyncio.to_thread(ready_files):
+            if self.stopping.is_set():
+                return
+            await self.slots.acquire()
+            claimed = await asyncio.to_thread(claim, name, self.work_dir)
+            if claimed is None:
+                self.slots.release()
+                continue
+            self.queue.put_nowait(claimed)
+
+    async def run(self):
+        for directory in (INBOX_PATH, PROCESSING_PATH, FAILED_PATH):
+            os.makedirs(directory, exist_ok=True)
+        lock_file = create_work_dir(self.work_dir)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stopping.set)
+
+        try:
+            warmup.warm_up(self.project_path)
+        except Exception:
+            pass  # Ошибка залогирована; конвертации загрузят библиотеки сами
+
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        for name in sorted(await asyncio.to_thread(recover, self.work_dir)):
+            await self.slots.acquire()
+            self.queue.put_nowait(name)
+        logger.info(f"Spool daemon started: inbox {INBOX_PATH}, {self.workers} workers")
+
+        while not self.stopping.is_set():
+            try:
+                await self.scan()
+            except OSError as e:
+                logger.error(f"Spool scan failed: {e}")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+        # Захваченные файлы дорабатываются; при повторном сигнале процесс завершается сразу,
+        # а необработанные файлы заберет следующий запуск
+        logger.info("Spool daemon stopping, finishing claimed files")
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        await self.queue.join()
+        for task in workers:
+            task.cancel()
+        os.remove(os.path.join(self.work_dir, LOCK_NAME))
+        lock_file.close()
+        os.rmdir(self.work_dir)
+        logger.info(f"Spool daemon stopped: {self.processed} converted, {self.failed} failed")
+
+
+def main():
+    asyncio.run(SpoolDaemon().run())
+
+
+if __name__ == "__main__":
+    main()
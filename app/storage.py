@@ -0,0 +1,413 @@
+# storage.py
+import datetime
+import fcntl
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from config import STORAGE_DIR, STORAGE_COMPRESSION, COMPRESS_AFTER_DAYS, STORAGE_SHARDING
+from logger import get_logger
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Расширения сжатых файлов и соответствующие значения Content-Encoding
+SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+ENCODING_SUFFIXES = {encoding: suffix for suffix, encoding in SUFFIXES.items()}
+
+CHUNK_SIZE = 64 * 1024
+
+MAINTENANCE_LOCK_PATH = os.path.join(STORAGE_DIR, ".maintenance.lock")
+
+# Метка времени загрузки в имени файла: <имя>_YYYYMMDDHHMMSS[_UniqueID][_signed|_error].<расширение>
+TIMESTAMP_RE = re.compile(r'_(\d{14})(?=[_.])')
+
+# Права новых файлов: mkstemp создает временные файлы с правами 0600, а сохраненные файлы
+# должны получать обычные права по umask процесса (как при open). umask читается один раз:
+# os.umask меняет его для всего процесса
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def compression_method():
+    """Метод сжатия хранилища: gzip, zstd (если установлен zstandard) или None."""
+    if STORAGE_COMPRESSION == "zstd":
+        try:
+            import zstandard  # noqa: F401
+            return "zstd"
+        except ImportError:
+            logger.warning("zstandard is not installed, falling back to gzip")
+            return "gzip"
+    if STORAGE_COMPRESSION == "gzip":
+        return "gzip"
+    return None
+
+
+def logical_name(filename):
+    """Имя файла без расширения сжатия: под ним файл виден в каталоге и URL."""
+    root, suffix = os.path.splitext(filename)
+    return root if suffix in SUFFIXES else filename
+
+
+def find_timestamp(filename):
+    """
+    Метка времени загрузки в имени файла: (match, datetime) или (None, None), если метки нет.
+    Исходное имя файла само может содержать 14 цифр, поэтому берется последняя группа
+    _YYYYMMDDHHMMSS с корректной датой - метка, которую naming.split_upload_name добавляет
+    перед UniqueID и расширением.
+    """
+    for match in reversed(list(TIMESTAMP_RE.finditer(filename))):
+        try:
+            return match, datetime.datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+        except ValueError:
+            continue
+    return None, None
+
+
+def upload_name(filename):
+    """
+    Имя входного файла до добавления UniqueID (<имя>_YYYYMMDDHHMMSS.<расширение>): под ним
+    записываются ошибки обработки (handle_error). None, если метки времени в имени нет.
+    """
+    match, _ = find_timestamp(filename)
+    return filename[:match.end(1)] + os.path.splitext(filename)[1] if match else None
+
+
+def find_error(errors, filename):
+    """
+    Ошибка обработки входного файла и имя, под которым она записана: имя файла или, для ошибок
+    после добавления UniqueID, имя до его добавления (upload_name). (None, None), если ошибки нет.
+    """
+    for name in (filename, upload_name(filename)):
+        if name is not None and name in errors:
+            return errors[name], name
+    return None, None
+
+
+def _date_subdir(stamp):
+    return os.path.join(f"{stamp:%Y}", f"{stamp:%m}", f"{stamp:%d}")
+
+
+def shard_subdir(filename):
+    """Подкаталог YYYY/MM/DD по метке времени загрузки в имени файла; None, если метки нет."""
+    _, stamp = find_timestamp(filename)
+    return _date_subdir(stamp) if stamp is not None else None
+
+
+def file_locations(directory, filename):
+    """
+    Возможные пути файла по логическому имени: подкаталог по дате, затем подкаталоги по другим
+    группам из 14 цифр в имени (так раскладывались файлы, пока подкаталог определялся по первой
+    группе) и корень каталога (файлы, записанные до перехода на подкаталоги).
+    """
+    subdirs = []
+    for match in reversed(list(TIMESTAMP_RE.finditer(filename))):
+        try:
+            subdir = _date_subdir(datetime.datetime.strptime(match.group(1), "%Y%m%d%H%M%S"))
+        except ValueError:
+            continue
+        if subdir not in subdirs:
+            subdirs.append(subdir)
+    return [os.path.join(directory, subdir, filename) for subdir in subdirs] + [os.path.join(directory, filename)]
+
+
+def target_dir(directory, filename):
+    """Каталог для записи нового файла: подкаталог по дате при STORAGE_SHARDING, иначе сам каталог."""
+    subdir = shard_subdir(filename) if STORAGE_SHARDING else None
+    return os.path.join(directory, subdir) if subdir else directory
+
+
+def locate(directory, filename):
+    """
+    Находит сохраненный файл по логическому имени: сначала в подкаталоге по дате,
+    затем в корне каталога (файлы, записанные до перехода на подкаталоги).
+    Возвращает (путь, кодировка сжатия или None) либо (None, None), если файла нет.
+    """
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        return None, None
+    for path in file_locations(directory, filename):
+        if os.path.isfile(path):
+            return path, None
+        for suffix, encoding in SUFFIXES.items():
+            if os.path.isfile(path + suffix):
+                return path + suffix, encoding
+    return None, None
+
+
+def iter_files(directory):
+    """Обходит файлы каталога вместе с подкаталогами по дате (служебные файлы с точкой пропускаются)."""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_files(entry.path)
+        elif entry.is_file():
+            yield entry
+
+
+def open_compressed(path, encoding, mode="rb"):
+    """Открывает файл с прозрачной распаковкой (или упаковкой при записи)."""
+    if encoding == "gzip":
+        return gzip.open(path, mode)
+    if encoding == "zstd":
+        import zstandard
+        if "w" in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(path, mode))
+        return zstandard.ZstdDecompressor().stream_reader(open(path, mode))
+    return open(path, mode)
+
+
+def iter_decompressed(path, encoding):
+    """Читает распакованное содержимое файла частями."""
+    with open_compressed(path, encoding) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_range(path, start, length):
+    """Читает диапазон байтов файла частями."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def read_bytes(directory, filename):
+    """Возвращает распакованное содержимое файла или None, если файла нет."""
+    path, encoding = locate(directory, filename)
+    if path is None:
+        return None
+    with open_compressed(path, encoding) as f:
+        return f.read()
+
+
+def write_file(directory, filename, data, compress=False):
+    """
+    Атомарно записывает файл (через временный файл и os.replace).
+    Если compress и сжатие включено без задержки (COMPRESS_AFTER_DAYS = 0), файл сохраняется сжатым.
+    Возвращает путь к записанному файлу.
+    """
+    encoding = compression_method() if compress and COMPRESS_AFTER_DAYS == 0 else None
+    file_dir = target_dir(directory, filename)
+    os.makedirs(file_dir, exist_ok=True)
+    path = os.path.join(file_dir, filename) + (ENCODING_SUFFIXES[encoding] if encoding else "")
+    fd, temp_path = tempfile.mkstemp(dir=file_dir, prefix=".tmp-")
+    os.close(fd)
+    try:
+        with open_compressed(temp_path, encoding, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    remove_stale_variants(directory, filename, path)
+    return path
+
+
+def remove_stale_variants(directory, filename, current_path):
+    """
+    При замене файла удаляет прежние варианты с тем же логическим именем (с другим сжатием
+    или в корне каталога), чтобы поиск по имени находил только новый файл.
+    """
+    for location in file_locations(directory, filename):
+        for path in [location] + [location + suffix for suffix in SUFFIXES]:
+            if path != current_path and os.path.isfile(path):
+                os.remove(path)
+
+
+def rename(directory, old_filename, new_filename):
+    """Переименовывает сохраненный файл, сохраняя расширение сжатия. Возвращает новый путь."""
+    path, encoding = locate(directory, old_filename)
+    if path is None:
+        raise FileNotFoundError(os.path.join(directory, old_filename))
+    new_dir = target_dir(directory, new_filename)
+    os.makedirs(new_dir, exist_ok=True)
+    new_path = os.path.join(new_dir, new_filename) + (ENCODING_SUFFIXES[encoding] if encoding else "")
+    os.rename(path, new_path)
+    return new_path
+
+
+def remove(directory, filename):
+    """Удаляет файл по логическому имени (в любом виде); возвращает True, если файл был."""
+    path, _ = locate(directory, filename)
+    if path is None:
+        return False
+    os.remove(path)
+    return True
+
+
+def compress_file(path, encoding):
+    """Сжимает файл на месте: пишет <path><suffix>, сохраняет время изменения и удаляет исходный."""
+    compressed_path = path + ENCODING_SUFFIXES[encoding]
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    os.close(fd)
+    try:
+        with open(path, "rb") as src, open_compressed(temp_path, encoding, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        stat = os.stat(path)
+        os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.chmod(temp_path, stat.st_mode & 0o7777)  # Сжатый файл получает права исходного
+        os.replace(temp_path, compressed_path)
+        os.remove(path)
+    except FileNotFoundError:
+        # Файл уже обработан или удален другим процессом
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return compressed_path
+
+
+def compress_aged(directory, older_than_seconds):
+    """Сжимает несжатые файлы каталога старше заданного возраста. Возвращает число сжатых файлов."""
+    encoding = compression_method()
+    if encoding is None:
+        return 0
+    threshold = time.time() - older_than_seconds
+    compressed = 0
+    for entry in iter_files(directory):
+        if os.path.splitext(entry.name)[1] in SUFFIXES:
+            continue
+        if entry.stat().st_mtime < threshold:
+            compress_file(entry.path, encoding)
+            compressed += 1
+    return compressed
+
+
+def migrate_flat(directory, limit=None):
+    """
+    Переносит файлы из корня каталога в подкаталоги по дате (не более limit за вызов).
+    Файлы без метки времени в имени остаются на месте. Возвращает число перенесенных файлов.
+    """
+    moved = 0
+    for entry in os.scandir(directory):
+        if limit is not None and moved >= limit:
+            break
+        if entry.name.startswith(".") or not entry.is_file():
+            continue
+        subdir = shard_subdir(entry.name)
+        if subdir is None:
+            continue
+        new_dir = os.path.join(directory, subdir)
+        os.makedirs(new_dir, exist_ok=True)
+        try:
+            os.rename(entry.path, os.path.join(new_dir, entry.name))
+        except FileNotFoundError:
+            continue  # Файл удален или перенесен другим процессом
+        moved += 1
+    return moved
+
+
+def remove_empty_dirs(directory):
+    """Удаляет опустевшие подкаталоги по дате."""
+    for path, _, _ in os.walk(directory, topdown=False):
+        if path != directory and not os.listdir(path):
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass  # В каталог уже записан новый файл
+
+
+def clear(directory):
+    """Удаляет все файлы и подкаталоги каталога, кроме служебных."""
+    for entry in os.scandir(directory):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+def collect_expired(directories, max_age_seconds=0, max_total_bytes=0):
+    """
+    Отбирает файлы для очистки, от старых к новым: старше max_age_seconds, а также самые
+    старые, пока общий объем каталогов превышает max_total_bytes (0 - без ограничения).
+    Возвращает список (каталог, путь).
+    """
+    files = []
+    for directory in directories:
+        for entry in iter_files(directory):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, directory, entry.path))
+    files.sort()
+    total = sum(size for _, size, _, _ in files)
+    threshold = time.time() - max_age_seconds if max_age_seconds else None
+    expired = []
+    for mtime, size, directory, path in files:
+        too_old = threshold is not None and mtime < threshold
+        if not too_old and not (max_total_bytes and total > max_total_bytes):
+            break  # Остальные файлы новее, а объем в пределах ограничения
+        expired.append((directory, path))
+        total -= size
+    return expired
+
+
+def apply_retention(directories, max_age_seconds=0, max_total_bytes=0, archive_dir=None,
+                    batch_size=500, batch_pause=1.0):
+    """
+    Очищает каталоги по сроку хранения и общему объему. Файлы удаляются или, если задан
+    archive_dir, переносятся в него с сохранением относительного пути. Обработка идет
+    пакетами по batch_size файлов с паузой batch_pause секунд между ними, чтобы очистка
+    не создавала всплеска нагрузки на диск.
+    Возвращает список (каталог, логическое имя) обработанных файлов.
+    """
+    expired = collect_expired(directories, max_age_seconds, max_total_bytes)
+    processed = []
+    for offset in range(0, len(expired), batch_size):
+        if offset:
+            time.sleep(batch_pause)
+        for directory, path in expired[offset:offset + batch_size]:
+            try:
+                if archive_dir:
+                    archived = os.path.join(archive_dir, os.path.basename(directory),
+                                            os.path.relpath(path, directory))
+                    os.makedirs(os.path.dirname(archived), exist_ok=True)
+                    shutil.move(path, archived)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            processed.append((directory, logical_name(os.path.basename(path))))
+    if expired:
+        for directory in directories:
+            remove_empty_dirs(directory)
+    return processed
+
+
+@contextmanager
+def maintenance_lock():
+    """
+    Неблокирующая блокировка фоновых задач обслуживания хранилища:
+    при нескольких воркерах задачу выполняет только один. Возвращает True, если захвачена.
+    """
+    with open(MAINTENANCE_LOCK_PATH, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,62 @@
+# warmup.py
+import os
+import time
+
+from logger import get_logger
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Состояние прогрева для /readyz
+state = {"ready": False, "error": None, "duration_ms": None}
+
+
+def is_ready():
+    return state["ready"]
+
+
+def warm_up(project_path=BASE_DIR):
+    """
+    Прогревает тяжелые компоненты до обработки первого запроса: импортирует библиотеки PDF,
+    регистрирует шрифты, компилирует шаблоны, выполняет пробный рендеринг WeasyPrint
+    (загрузка pango/fontconfig и шрифтов) и рендерит статические секции документа.
+    После успешного прогрева /readyz отвечает 200.
+
+    При запуске через gunicorn с preload_app вызывается в мастер-процессе до fork,
+    и воркеры получают прогретые страницы памяти по copy-on-write; при запуске одного
+    процесса uvicorn выполняется в фоне после старта приложения.
+    """
+    if state["ready"]:
+        return
+    started = time.perf_counter()
+    try:
+        from weasyprint import HTML
+        import pdfminer.high_level  # noqa: F401
+        import pdfrw  # noqa: F401
+        import pyhanko.sign  # noqa: F401
+
+        from config import TEST_MODE
+        from pdf_utils import register_fonts, load_pikepdf, error_pdf_bytes
+        from xml_processor import get_template_env, document_sections, static_section_pdf
+
+        register_fonts()
+        load_pikepdf()
+        error_pdf_bytes()
+        env = get_template_env(os.path.join(project_path, 'templates'))
+        for template_name in ("template2.html", "coords_chunk.html"):
+            env.get_template(template_name)
+        HTML(string="<p>warm-up</p>", base_url=project_path).write_pdf()
+        # Статические секции документа рендерятся заранее (до fork - общие для всех воркеров)
+        for template_name, static in document_sections():
+            if static:
+                static_section_pdf(template_name, project_path, TEST_MODE)
+    except Exception as e:
+        state["error"] = str(e)
+        logger.error(f"Warm-up failed: {e}")
+        raise
+    state["duration_ms"] = round((time.perf_counter() - started) * 1000)
+    state["error"] = None
+    state["ready"] = True
+    logger.info(f"Warm-up completed in {state['duration_ms']} ms")
@@ -0,0 +1,179 @@
+# xml_backend.py
+import os
+import threading
+from functools import lru_cache
+import xml.etree.ElementTree as ET
+
+from config import XML_BACKEND, XML_SCHEMA_PATH, XML_REQUIRED_FIELDS
+from logger import get_logger
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+class InvalidXml(ValueError):
+    """Документ не является корректным XML."""
+
+
+class InvalidDocument(ValueError):
+    """XML корректен, но не соответствует схеме или в нем нет обязательных полей."""
+
+
+# Используемый парсер: lxml (если установлен) или ElementTree из стандартной библиотеки
+BACKEND = "lxml" if XML_BACKEND == "lxml" and etree is not None else "etree"
+if XML_BACKEND == "lxml" and etree is None:
+    logger.warning("lxml is not installed, falling back to ElementTree")
+
+# Парсеры и валидаторы lxml не потокобезопасны, поэтому у каждого потока экзекутора свои экземпляры
+_local = threading.local()
+
+
+def _lxml_parser(text_input):
+    """
+    Парсер lxml с безопасными настройками: без подстановки внешних сущностей, загрузки DTD
+    и обращений к сети, с ограничением размера дерева; комментарии и инструкции отбрасываются.
+    Для строк (str) кодировка из объявления XML не применяется - текст уже декодирован.
+    """
+    name = "text_parser" if text_input else "bytes_parser"
+    parser = getattr(_local, name, None)
+    if parser is None:
+        parser = etree.XMLParser(resolve_entities=False, load_dtd=False, no_network=True, huge_tree=False,
+                                 remove_comments=True, remove_pis=True,
+                                 encoding="utf-8" if text_input else None)
+        setattr(_local, name, parser)
+    return parser
+
+
+def parse(xml_content, backend=None):
+    """
+    Разбирает XML (str или bytes) и возвращает корневой элемент. Элементы обоих парсеров
+    поддерживают одинаковый интерфейс (findall, iter, get, tag, text).
+    При некорректном XML выбрасывает InvalidXml.
+    """
+    if (backend or BACKEND) == "lxml":
+        text_input = isinstance(xml_content, str)
+        data = xml_content.encode("utf-8") if text_input else xml_content
+        try:
+            root = etree.fromstring(data, _lxml_parser(text_input))
+        except etree.XMLSyntaxError as e:
+            logger.error(f"Error parsing XML: {e}")
+            raise InvalidXml("Invalid XML format")
+        if root is None:
+            raise InvalidXml("Invalid XML format")
+        return root
+    try:
+        return ET.fromstring(xml_content)
+    except ET.ParseError as e:
+        logger.error(f"Error parsing XML: {e}")
+        raise InvalidXml("Invalid XML format")
+
+
+def _xpath(expression):
+    """Скомпилированное выражение XPath (компилируется один раз на поток)."""
+    xpaths = getattr(_local, "xpaths", None)
+    if xpaths is None:
+        xpaths = _local.xpaths = {}
+    xpath = xpaths.get(expression)
+    if xpath is None:
+        xpath = xpaths[expression] = etree.XPath(expression)
+    return xpath
+
+
+def findall(element, target_name):
+    """Все потомки элемента с тегом target_name."""
+    if etree is not None and isinstance(element, etree._Element):
+        return _xpath(f"descendant::{target_name}")(element)
+    return element.findall(f".//{target_name}")
+
+
+def count(element, target_name):
+    """Число потомков элемента с тегом target_name (для lxml - без построения списка элементов)."""
+    if etree is not None and isinstance(element, etree._Element):
+        return int(_xpath(f"count(descendant::{target_name})")(element))
+    return sum(1 for _ in element.iter(target_name)) - (element.tag == target_name)
+
+
+def find(element, target_name):
+    """
+    Первый потомок элемента с тегом target_name или None. Выражение descendant::X[1]
+    libxml2 вычисляет с остановкой на первом совпадении, без обхода всего дерева.
+    """
+    if etree is not None and isinstance(element, etree._Element):
+        found = _xpath(f"descendant::{target_name}[1]")(element)
+        return found[0] if found else None
+    return element.find(f".//{target_name}")
+
+
+def point_values(polygon):
+    """
+    Значения (широта, долгота) точек полигона: для каждого Point - первые Latitude и Longitude
+    в его поддереве (None, если нет). Для lxml обход фильтруется по тегам на стороне libxml2.
+    """
+    if etree is not None and isinstance(polygon, etree._Element):
+        latitude = longitude = None
+        started = False
+        for element in polygon.iter("Point", "Latitude", "Longitude"):
+            tag = element.tag
+            if tag == "Point":
+                if started:
+                    yield latitude, longitude
+                latitude = longitude = None
+                started = True
+            elif tag == "Latitude":
+                if latitude is None:
+                    latitude = element.text
+            elif longitude is None:
+                longitude = element.text
+        if started:
+            yield latitude, longitude
+        return
+    for point in polygon.iter("Point"):
+        # Один обход поддерева точки вместо отдельного поиска каждого тега
+        latitude = longitude = None
+        for child in point.iter():
+            if child.tag == "Latitude" and latitude is None:
+                latitude = child.text
+            elif child.tag == "Longitude" and longitude is None:
+                longitude = child.text
+        yield latitude, longitude
+
+
+@lru_cache(maxsize=1)
+def _schema_document(path):
+    """Документ XSD-схемы читается один раз."""
+    logger.info(f"Loading XML schema {path}")
+    return etree.parse(path, etree.XMLParser(no_network=True))
+
+
+def _schema(path):
+    """Скомпилированная XSD-схема потока (компилируется один раз на поток)."""
+    schema = getattr(_local, "schema", None)
+    if schema is None:
+        schema = etree.XMLSchema(_schema_document(path))
+        _local.schema = schema
+    return schema
+
+
+def validate(root):
+    """
+    Быстрая проверка документа до рендеринга: обязательные поля (XML_REQUIRED_FIELDS)
+    и, если задан XML_SCHEMA_PATH и используется lxml, соответствие XSD-схеме.
+    Выбрасывает InvalidDocument с описанием первой ошибки.
+    """
+    for field in XML_REQUIRED_FIELDS:
+        value = find(root, field)
+        if value is None or not (value.text or "").strip():
+            raise InvalidDocument(f"Required field {field} is missing or empty")
+
+    if XML_SCHEMA_PATH:
+        if etree is None or not isinstance(root, etree._Element):
+            return  # Проверка по схеме выполняется только для документов, разобранных lxml
+        schema = _schema(os.path.abspath(XML_SCHEMA_PATH))
+        if not schema.validate(root):
+            error = schema.error_log.last_error
+            raise InvalidDocument(f"XML does not match schema: line {error.line}: {error.message}")
@@ -1,23 +1,37 @@
 import asyncio
+import contextvars
+import hashlib
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-import xml.etree.ElementTree as ET
+from functools import lru_cache
 from io import BytesIO
 import logging
 import os
+import tempfile
 
 from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML, CSS
 
-from config import TEST_MODE, SIGNER_NAME, SIGNER_PASSWORD, PFX_FILE, F_DATE
+from config import (TEST_MODE, SIGNER_NAME, SIGNER_PASSWORD, PFX_FILE, F_DATE, MAX_CONCURRENT_CONVERSIONS,
+                    LARGE_DOC_POINTS, LARGE_DOC_PLOTS, LARGE_DOC_CHUNK_POINTS, UNSIGNED_PATH, COMPRESS_OUTPUTS,
+                    DOCUMENT_SECTIONS, PDF_OPTIMIZE, COST_BASE_MS, COST_PER_PLOT_MS, COST_PER_POINT_MS,
+                    COST_PER_DEPOSIT_MS, COST_PER_INPUT_KB_MS, LARGE_LANE_COST_MS)
+from admission import current_executor, current_ticket
+from coordinates import parse_polygon
+import deadlines
 from logger import get_logger
-from pdf_utils import add_signature_stamp, sign_pdf, add_page_numbers
+from metrics import metrics
+from pdf_utils import add_stamp_and_page_numbers, sign_pdf, merge_pdfs, optimize_pdf
+from profiling import ConversionProfile, check_memory_budget
+import storage
+import xml_backend
 
 # Настройка логирования
 logger = get_logger(__name__)
 
-# Экзекутор для асинхронных задач
-executor = ThreadPoolExecutor()
+# Экзекутор для блокирующих задач вне полос конвертаций (разбор до допуска, повторная подпись);
+# допущенные конвертации выполняются в экзекуторе своей полосы (admission)
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CONVERSIONS)
 
 # Установка уровня логирования для сторонних библиотек
 logging.getLogger('fontTools').setLevel(logging.WARNING)
@@ -28,6 +42,29 @@ logging.getLogger('PIL').setLevel(logging.WARNING)
 MOSCOW_TZ = timezone(timedelta(hours=3))
 
 
+def run_blocking(func, *args):
+    """
+    Выполняет блокирующую функцию в экзекуторе полосы текущей конвертации (или в общем),
+    сохраняя контекст запроса (идентификатор для логов и срок конвертации).
+    При отмене ожидающее задание снимается с очереди экзекутора (executor_jobs_cancelled);
+    выполняющееся поток прервать не может, его результат отбрасывается (executor_jobs_abandoned),
+    а слот полосы освобождается после его завершения (задание регистрируется в разрешении).
+    """
+    ctx = contextvars.copy_context()
+    job = (current_executor.get() or executor).submit(ctx.run, func, *args)
+    ticket = current_ticket.get()
+    if ticket is not None:
+        ticket.track(job)
+    future = asyncio.wrap_future(job)
+
+    def count_cancelled(future):
+        if future.cancelled():
+            metrics.inc("executor_jobs_cancelled" if job.cancelled() else "executor_jobs_abandoned")
+
+    future.add_done_callback(count_cancelled)
+    return future
+
+
 def find_values_in_xml(element, target_name, multiple=False):
     """
     Находит значения в XML, используя XPath.
@@ -42,31 +79,34 @@ def find_values_in_xml(element, target_name, multiple=False):
         str/list: Найденное значение или список значений.
     """
     try:
-        values = element.findall(f".//{target_name}")
         if multiple:
-            return [value.text.strip() for value in values if value.text]
-        elif values:
-            return values[0].text.strip()
+            return [value.text.strip() for value in xml_backend.findall(element, target_name) if value.text]
+        value = xml_backend.find(element, target_name)
+        if value is not None:
+            return value.text.strip()
     except AttributeError:
         logger.warning(f"AttributeError in find_values_in_xml for target: {target_name}")
     return None if not multiple else []
 
 
 def extract_coordinates_from_xml(element):
+    """
+    Извлекает координаты участков. Точки каждого полигона хранятся в Polygon
+    (числовые массивы), который в шаблоне ведет себя как список строк "широта, долгота".
+    """
     coordinates = []
     try:
-        for plot in element.findall('.//Plot'):
+        for plot in xml_backend.findall(element, 'Plot'):
             plot_number = plot.get('Number', '')
             plot_name = plot.get('Name', '')
             plot_coords = []
-            for polygon in plot.findall('.//Polygon'):
-                polygon_coords = []  # Список координат для текущего полигона
-                for point in polygon.findall('.//Point'):
-                    latitude = find_values_in_xml(point, 'Latitude')
-                    longitude = find_values_in_xml(point, 'Longitude')
-                    if latitude and longitude:
-                        polygon_coords.append(f"{latitude}, {longitude}")
-                plot_coords.append(polygon_coords)  # Добавляем список координат полигона в список участка
+            for polygon in xml_backend.findall(plot, 'Polygon'):
+                latitudes, longitudes = [], []  # Значения координат текущего полигона
+                for latitude, longitude in xml_backend.point_values(polygon):
+                    if latitude and latitude.strip() and longitude and longitude.strip():
+                        latitudes.append(latitude)
+                        longitudes.append(longitude)
+                plot_coords.append(parse_polygon(latitudes, longitudes))  # Добавляем полигон в список участка
             coordinates.append({
                 "number": plot_number,
                 "name": plot_name,
@@ -89,7 +129,7 @@ def extract_deposit_info_from_xml(root):
     non_opi_deposits = []  # Список для остальных месторождений
     formatted_datetime = datetime.now(MOSCOW_TZ).strftime(F_DATE)
     try:
-        for deposit in root.findall('.//DepositInfo'):
+        for deposit in xml_backend.findall(root, 'DepositInfo'):
             last_change_date_str = find_values_in_xml(deposit, 'last_change_date')
 
             # Парсим и форматируем дату последнего изменения
@@ -123,11 +163,18 @@ def extract_deposit_info_from_xml(root):
 def enumerate_filter(iterable):
     return list(enumerate(iterable))
 
+@lru_cache(maxsize=None)
+def get_template_env(templates_dir):
+    """Окружение Jinja создается один раз на каталог, скомпилированные шаблоны кэшируются в нем."""
+    env = Environment(loader=FileSystemLoader(templates_dir))
+    env.filters['enumerate'] = enumerate_filter # Регистрируем фильтр
+    return env
+
+
 def render_template(template_name, context, project_path):
     try:
         templates_dir = os.path.join(project_path, 'templates')
-        env = Environment(loader=FileSystemLoader(templates_dir))
-        env.filters['enumerate'] = enumerate_filter # Регистрируем фильтр
+        env = get_template_env(templates_dir)
         template = env.get_template(template_name)
         return template.render(context)
     except Exception as e:
@@ -135,100 +182,362 @@ def render_template(template_name, context, project_path):
         raise
 
 
-async def convert_xml_to_pdf(xml_content: str, project_path: str):
-    try:
-        logger.info("Starting XML to PDF conversion")
-        root = ET.fromstring(xml_content)
-
-        request_datetime = find_values_in_xml(root, 'RequestDateTime')
-        opi_deposits, non_opi_deposits = extract_deposit_info_from_xml(root)
-
-
-        # Парсим и форматируем дату
-        date_object = datetime.strptime(request_datetime.split(".")[0], "%Y-%m-%dT%H:%M:%S").replace(
-            tzinfo=timezone.utc).astimezone(MOSCOW_TZ)
-        formatted_date = date_object.strftime(F_DATE)
-
-        # Формирование контекста для шаблона
-        context = {
-            "name": find_values_in_xml(root, 'FullName'),
-            "last_name": find_values_in_xml(root, 'LastName'),
-            "first_name": find_values_in_xml(root, 'FirstName'),
-            "middle_name": find_values_in_xml(root, 'MiddleName'),
-            "inn": find_values_in_xml(root, 'INN'),
-            "snils": find_values_in_xml(root, 'RepresentativeSNILS'),
-            "tel": find_values_in_xml(root, 'Phone'),
-            "email": find_values_in_xml(root, 'Email'),
-            "date": formatted_date,
-            "inv": find_values_in_xml(root, 'UniqueID'),
-            "coords": extract_coordinates_from_xml(root),
-            "is_deposit": find_values_in_xml(root, 'DepositPresence'),
-            "in_city": find_values_in_xml(root, 'HasAreaInCity'),
-            "test": TEST_MODE,
-            "opi_deposits": opi_deposits,
-            "non_opi_deposits": non_opi_deposits,
-            "has_opi_deposits": bool(opi_deposits), # Флаг наличия месторождений ОПИ
-            "has_non_opi_deposits": bool(non_opi_deposits), # Флаг наличия других месторождений
-        }
-
-        context['is_10'] = 1 if len(context.get('opi_deposits', [])) + len(
-            context.get('non_opi_deposits', [])) == 10 else 0
-
-        # Генерация HTML из шаблона
-        html_content = render_template("template2.html", context, project_path)
-
-        logger.info("Generating PDF from HTML")
-        pdf_buffer = BytesIO()
-        html = HTML(string=html_content, base_url=project_path)
-        css = CSS(string=''' 
-            @page {
-                size: A4;
-                margin-top: 10mm;
-                margin-right: 20mm;
-                margin-bottom: 35mm;
-                margin-left: 10mm;
-            }
-        ''')
+# Параметры страницы для всех рендерингов
+PAGE_CSS = '''
+    @page {
+        size: A4;
+        margin-top: 10mm;
+        margin-right: 20mm;
+        margin-bottom: 35mm;
+        margin-left: 10mm;
+    }
+'''
 
-        # Асинхронная генерация PDF
-        await asyncio.get_event_loop().run_in_executor(
-            executor, lambda: html.write_pdf(pdf_buffer, stylesheets=[css])
-        )
-        pdf_buffer.seek(0)
 
-        logger.info("Adding signature stamp")
-        stamped_pdf_buffer = BytesIO()
+def count_points(coords):
+    return sum(len(polygon) for plot in coords for polygon in plot["coords"])
+
 
-        # Асинхронное добавление штампа
-        await asyncio.get_event_loop().run_in_executor(
-            executor, lambda: add_signature_stamp(pdf_buffer, stamped_pdf_buffer, SIGNER_NAME)
-        )
-        stamped_pdf_buffer.seek(0)
+def split_coordinates(coords, chunk_points):
+    """
+    Разбивает координаты участков на части не более chunk_points точек.
+
+    Каждая часть - список участков вида {"number", "name", "continued", "polygons"},
+    где polygons - список {"index", "start", "points"}: номер полигона в участке,
+    смещение первой точки и сами точки. Длинный полигон продолжается в следующей части
+    с сохранением сквозной нумерации точек.
+    """
+    chunk, size = [], 0
+    for plot in coords:
+        chunk_plot = None
+        if not plot["coords"]:
+            chunk.append({"number": plot["number"], "name": plot["name"], "continued": False, "polygons": []})
+            continue
+        for polygon_index, polygon in enumerate(plot["coords"]):
+            start = 0
+            while True:
+                if size >= chunk_points:
+                    yield chunk
+                    chunk, size, chunk_plot = [], 0, None
+                if chunk_plot is None:
+                    chunk_plot = {"number": plot["number"], "name": plot["name"],
+                                  "continued": polygon_index > 0 or start > 0, "polygons": []}
+                    chunk.append(chunk_plot)
+                points = polygon[start:start + chunk_points - size]
+                chunk_plot["polygons"].append({"index": polygon_index, "start": start, "points": points})
+                size += len(points)
+                start += len(points)
+                if start >= len(polygon):
+                    break
+    if chunk:
+        yield chunk
+
+
+def exceeds_large_doc_thresholds(points, plots):
+    """Превышает ли документ заданные пороги режима больших документов (порог 0 не учитывается)."""
+    return bool((LARGE_DOC_POINTS and points > LARGE_DOC_POINTS) or (LARGE_DOC_PLOTS and plots > LARGE_DOC_PLOTS))
+
+
+def is_large_document(coords):
+    return exceeds_large_doc_thresholds(count_points(coords), len(coords))
+
+
+def estimate_cost(root, input_size):
+    """
+    Оценка стоимости конвертации (ожидаемое время, мс) по разобранному XML: числу участков,
+    точек и месторождений и размеру входных данных. Документы, которые рендерятся частями
+    (режим больших документов), всегда считаются большими.
+    """
+    plots = xml_backend.count(root, 'Plot')
+    points = xml_backend.count(root, 'Point')
+    deposits = xml_backend.count(root, 'DepositInfo')
+    cost = (COST_BASE_MS + plots * COST_PER_PLOT_MS + points * COST_PER_POINT_MS
+            + deposits * COST_PER_DEPOSIT_MS + input_size / 1024 * COST_PER_INPUT_KB_MS)
+    if exceeds_large_doc_thresholds(points, plots):
+        cost = max(cost, LARGE_LANE_COST_MS)
+    return round(cost)
 
-        logger.info("Adding page numbers")
-        # Асинхронное добавление номеров страниц
-        numbered_pdf_buffer = await asyncio.get_event_loop().run_in_executor(
-            executor, lambda: add_page_numbers(stamped_pdf_buffer)
-        )
 
-        logger.info("Signing PDF")
-        signed_pdf_buffer = BytesIO()
-        pfx_path = os.path.join(project_path, 'certs', PFX_FILE)
+# Основной шаблон документа: данные заявителя и таблицы координат
+MAIN_TEMPLATE = "template2.html"
 
-        # Подпись PDF
-        await sign_pdf(numbered_pdf_buffer, signed_pdf_buffer, pfx_path, SIGNER_NAME, SIGNER_PASSWORD, test=TEST_MODE)
 
-        # Ожидание завершения подписания
-        signed_pdf_content = signed_pdf_buffer.read()  # Читаем данные из буфера
+def document_sections():
+    """
+    Секции документа в порядке следования из DOCUMENT_SECTIONS: список (шаблон, статическая ли секция).
+    Статические секции (префикс static:) одинаковы для всех заявлений и рендерятся один раз.
+    """
+    sections = []
+    for item in DOCUMENT_SECTIONS.split(","):
+        item = item.strip()
+        if item:
+            static = item.startswith("static:")
+            sections.append((item[len("static:"):] if static else item, static))
+    return sections
+
+
+def html_to_pdf(html_content, project_path, target, css=None):
+    """Рендеринг HTML в PDF средствами WeasyPrint с параметрами страницы PAGE_CSS."""
+    from weasyprint import HTML, CSS  # Импорт при первом использовании, см. warmup.warm_up()
+
+    css = css or CSS(string=PAGE_CSS)
+    HTML(string=html_content, base_url=project_path).write_pdf(target, stylesheets=[css])
+    target.seek(0)
+    return target
+
+
+# Кэш PDF статических секций: (шаблон, хэш шаблона и его зависимостей, тестовый режим) -> PDF
+_static_sections = {}
+_static_sections_lock = threading.Lock()
+
+
+# Хэши шаблонов статических секций: (каталог, шаблон) -> (stat файлов шаблона и зависимостей, хэш)
+_template_digests = {}
 
-        logger.info("PDF conversion and signing completed successfully")
-        return BytesIO(signed_pdf_content)  # Возвращаем буфер с подписанными данными
 
+def file_keys(paths):
+    """(путь, время изменения, размер) файлов; None, если файла уже нет."""
+    keys = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        keys.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(keys)
 
 
-    except ET.ParseError as e:
-        logger.error(f"Error parsing XML: {e}")
-        raise ValueError("Invalid XML format")
+def template_digest(env, template_name):
+    """
+    Хэш текста шаблона, всех шаблонов, подключаемых им через include, extends и import
+    (рекурсивно, кроме имен, вычисляемых при рендеринге), и PAGE_CSS. Хэш кэшируется и
+    вычисляется заново, только если у файлов шаблона или зависимостей изменились время
+    изменения или размер: на каждый запрос выполняется только stat этих файлов.
+    """
+    from jinja2 import meta
+
+    cache_key = (tuple(env.loader.searchpath), template_name)
+    cached = _template_digests.get(cache_key)
+    if cached is not None and file_keys(path for path, _, _ in cached[0]) == cached[0]:
+        return cached[1]
+
+    digest = hashlib.sha256(PAGE_CSS.encode("utf-8"))
+    pending, seen, paths = [template_name], set(), []
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        source, path, _ = env.loader.get_source(env, name)
+        paths.append(path)
+        digest.update(name.encode("utf-8") + b"\0" + source.encode("utf-8") + b"\0")
+        pending.extend(referenced for referenced in meta.find_referenced_templates(env.parse(source))
+                       if referenced is not None)
+    keys = file_keys(paths)
+    if keys is not None:
+        _template_digests[cache_key] = (keys, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def static_section_pdf(template_name, project_path, test):
+    """
+    PDF статической секции. Рендерится один раз на версию шаблона: ключ кэша включает хэш
+    текста шаблона, подключаемых им шаблонов и PAGE_CSS, поэтому измененный шаблон рендерится
+    заново без перезапуска. Файлы, на которые шаблон ссылается как на ресурсы (изображения,
+    стили, шрифты из static), не отслеживаются: после их изменения нужен перезапуск.
+    Шаблон получает только флаг test и не должен использовать данные заявления.
+    """
+    env = get_template_env(os.path.join(project_path, 'templates'))
+    key = (template_name, template_digest(env, template_name), test)
+    with _static_sections_lock:
+        cached = _static_sections.get(key)
+    if cached is None:
+        html_content = render_template(template_name, {"test": test}, project_path)
+        cached = html_to_pdf(html_content, project_path, BytesIO()).getvalue()
+        with _static_sections_lock:
+            # Прежние версии шаблона больше не понадобятся
+            for old_key in [k for k in _static_sections if k[0] == template_name and k != key]:
+                del _static_sections[old_key]
+            _static_sections[key] = cached
+        logger.info(f"Rendered static section {template_name} ({len(cached)} bytes)")
+    return cached
+
+
+def render_pdf(context, project_path):
+    """
+    Рендеринг документа за один проход WeasyPrint на каждую динамическую секцию;
+    статические секции берутся из кэша и объединяются с динамическими в порядке DOCUMENT_SECTIONS.
+    """
+    sections = document_sections()
+    if sections == [(MAIN_TEMPLATE, False)]:
+        return html_to_pdf(render_template(MAIN_TEMPLATE, context, project_path), project_path, BytesIO())
+
+    parts = []
+    for template_name, static in sections:
+        if static:
+            parts.append(BytesIO(static_section_pdf(template_name, project_path, context["test"])))
+        else:
+            deadlines.check("render")
+            parts.append(html_to_pdf(render_template(template_name, context, project_path), project_path, BytesIO()))
+    return merge_pdfs(parts)
+
+
+def render_pdf_chunked(context, project_path):
+    """
+    Рендеринг большого документа частями: основной шаблон без таблиц координат,
+    затем таблицы координат частями по LARGE_DOC_CHUNK_POINTS точек (шаблон coords_chunk.html).
+    Каждая часть сразу записывается во временный файл, поэтому в памяти WeasyPrint
+    одновременно находится разметка только одной части. Нумерация страниц и штампы
+    добавляются позже, один раз для объединенного документа.
+    Статические секции DOCUMENT_SECTIONS берутся из кэша.
+    """
+    from weasyprint import CSS
+
+    css = CSS(string=PAGE_CSS)
+    parts = []
+
+    def write_part(html_content):
+        deadlines.check("render")  # Прерванная конвертация не рендерит оставшиеся части
+        part = tempfile.TemporaryFile()
+        parts.append(part)
+        html_to_pdf(html_content, project_path, part, css)
+
+    try:
+        for template_name, static in document_sections():
+            if static:
+                parts.append(BytesIO(static_section_pdf(template_name, project_path, context["test"])))
+            elif template_name != MAIN_TEMPLATE:
+                write_part(render_template(template_name, context, project_path))
+            else:
+                write_part(render_template(MAIN_TEMPLATE, dict(context, coords=[], coords_chunked=True),
+                                           project_path))
+                # Таблицы координат следуют сразу за основным шаблоном
+                for chunk in split_coordinates(context["coords"], LARGE_DOC_CHUNK_POINTS):
+                    write_part(render_template("coords_chunk.html", {"plots": chunk, "test": context["test"]},
+                                               project_path))
+        logger.info(f"Rendered large document in {len(parts)} parts")
+        return merge_pdfs(parts)
+    finally:
+        for part in parts:
+            part.close()
+
+
+def build_context(root):
+    """Формирует контекст шаблона из разобранного и проверенного XML заявления."""
+    request_datetime = find_values_in_xml(root, 'RequestDateTime')
+    opi_deposits, non_opi_deposits = extract_deposit_info_from_xml(root)
+
+    # Парсим и форматируем дату
+    date_object = datetime.strptime(request_datetime.split(".")[0], "%Y-%m-%dT%H:%M:%S").replace(
+        tzinfo=timezone.utc).astimezone(MOSCOW_TZ)
+    formatted_date = date_object.strftime(F_DATE)
+
+    # Формирование контекста для шаблона
+    context = {
+        "name": find_values_in_xml(root, 'FullName'),
+        "last_name": find_values_in_xml(root, 'LastName'),
+        "first_name": find_values_in_xml(root, 'FirstName'),
+        "middle_name": find_values_in_xml(root, 'MiddleName'),
+        "inn": find_values_in_xml(root, 'INN'),
+        "snils": find_values_in_xml(root, 'RepresentativeSNILS'),
+        "tel": find_values_in_xml(root, 'Phone'),
+        "email": find_values_in_xml(root, 'Email'),
+        "date": formatted_date,
+        "inv": find_values_in_xml(root, 'UniqueID'),
+        "coords": extract_coordinates_from_xml(root),
+        "is_deposit": find_values_in_xml(root, 'DepositPresence'),
+        "in_city": find_values_in_xml(root, 'HasAreaInCity'),
+        "test": TEST_MODE,
+        "opi_deposits": opi_deposits,
+        "non_opi_deposits": non_opi_deposits,
+        "has_opi_deposits": bool(opi_deposits), # Флаг наличия месторождений ОПИ
+        "has_non_opi_deposits": bool(non_opi_deposits), # Флаг наличия других месторождений
+    }
+
+    context['is_10'] = 1 if len(context.get('opi_deposits', [])) + len(
+        context.get('non_opi_deposits', [])) == 10 else 0
+    return context
+
+
+async def finalize_pdf(pdf_buffer: BytesIO, project_path: str, profile: ConversionProfile = None):
+    """
+    Завершающие этапы конвертации над отрендеренным PDF: штамп подписи, номера страниц,
+    оптимизация размера (PDF_OPTIMIZE) и подпись.
+    Используется и при конвертации, и при повторной подписи сохраненных неподписанных PDF (resign.py).
+    """
+    profile = profile or ConversionProfile(trace=False)
+    logger.info("Adding signature stamp and page numbers")
+    # Асинхронное добавление штампа и номеров страниц одним наложением
+    deadlines.check("stamp")
+    with profile.stage("stamp"):
+        numbered_pdf_buffer = await run_blocking(add_stamp_and_page_numbers, pdf_buffer, SIGNER_NAME)
+
+    # Сжатие и перепаковка выполняются до подписи: подписанный PDF изменять нельзя
+    if PDF_OPTIMIZE:
+        deadlines.check("optimize")
+        with profile.stage("optimize"):
+            numbered_pdf_buffer = await run_blocking(optimize_pdf, numbered_pdf_buffer)
+
+    logger.info("Signing PDF")
+    signed_pdf_buffer = BytesIO()
+    pfx_path = os.path.join(project_path, 'certs', PFX_FILE)
+
+    # Подпись PDF
+    deadlines.check("sign")
+    with profile.stage("sign"):
+        await sign_pdf(numbered_pdf_buffer, signed_pdf_buffer, pfx_path, SIGNER_NAME, SIGNER_PASSWORD,
+                       test=TEST_MODE)
+
+    # Ожидание завершения подписания
+    signed_pdf_content = signed_pdf_buffer.read()  # Читаем данные из буфера
+    return BytesIO(signed_pdf_content)  # Возвращаем буфер с подписанными данными
+
+
+async def convert_xml_to_pdf(xml_content, project_path: str, profile: ConversionProfile = None,
+                             unsigned_filename: str = None, root=None):
+    """
+    Конвертирует XML заявления (str или bytes) в подписанный PDF.
+    Если передан profile, в него записываются время и память по этапам.
+    Если передано unsigned_filename, отрендеренный PDF до штампа и подписи сохраняется
+    под этим именем в UNSIGNED_PATH для повторной подписи без рендеринга.
+    Если передан root, документ уже разобран и проверен (xml_backend.validate) вызывающим.
+    """
+    profile = profile or ConversionProfile(trace=False)
+    try:
+        logger.info("Starting XML to PDF conversion")
+        with profile.stage("parse"):
+            if root is None:
+                root = await run_blocking(xml_backend.parse, xml_content)
+                await run_blocking(xml_backend.validate, root)
+            # Извлечение данных O(числа точек) выполняется в экзекуторе полосы, не в цикле событий
+            context = await run_blocking(build_context, root)
+
+        # Прогноз памяти до рендеринга: большой документ рендерится частями,
+        # документ сверх бюджета отклоняется
+        points = count_points(context["coords"])
+        deposits = len(context["opi_deposits"]) + len(context["non_opi_deposits"])
+        chunked = check_memory_budget(points, deposits, is_large_document(context["coords"]))
+
+        # Асинхронная генерация PDF
+        deadlines.check("render")
+        with profile.stage("render"):
+            if chunked:
+                logger.info(f"Generating PDF from HTML in chunks: {points} points in {len(context['coords'])} plots")
+                pdf_buffer = await run_blocking(render_pdf_chunked, context, project_path)
+            else:
+                logger.info("Generating PDF from HTML")
+                pdf_buffer = await run_blocking(render_pdf, context, project_path)
+
+        if unsigned_filename:
+            # Сохраняем до штампа и подписи: при сбое подписи документ можно подписать повторно
+            await asyncio.to_thread(storage.write_file, UNSIGNED_PATH, unsigned_filename, pdf_buffer.getvalue(),
+                                    compress=COMPRESS_OUTPUTS)
+
+        signed_pdf_buffer = await finalize_pdf(pdf_buffer, project_path, profile)
+
+        logger.info("PDF conversion and signing completed successfully")
+        return signed_pdf_buffer
+
     except Exception as e:
         logger.error(f"Error converting XML to PDF: {e}")
         raise
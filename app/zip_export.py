@@ -0,0 +1,199 @@
+# zip_export.py
+"""
+Потоковая выгрузка сохраненных документов архивом ZIP.
+
+Архив собирается по мере отправки: файлы читаются из хранилища частями по storage.CHUNK_SIZE
+(сжатые файлы распаковываются на лету), каждая часть сразу записывается в ZIP и отдается клиенту.
+Ни архив, ни файлы целиком не хранятся ни на диске, ни в памяти; ZipFile пишет в поток без
+перемотки, поэтому размеры записей передаются в дескрипторах данных после содержимого,
+а для архивов больше 4 ГБ используется ZIP64. PDF уже сжаты и записываются без сжатия,
+XML и опись - со сжатием deflate.
+"""
+import csv
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+
+from config import STORAGE_PATH, OUTPUT_PATH, EXPORT_MAX_CONCURRENT
+from logger import get_logger
+from metrics import metrics
+import naming
+from pdf_utils import error_pdf_bytes
+import storage
+
+# Настройка логирования
+logger = get_logger(__name__)
+
+# Сохраненные входные данные: <имя>_YYYYMMDDHHMMSS_<UniqueID>.xml; метка - последняя в имени
+INPUT_RE = re.compile(r'^.*_(\d{14})_(.+?)\.xml$')
+STATUSES = ("all", "signed", "error")
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_FIELDS = ["document", "unique_id", "uploaded", "status", "pdf", "error"]
+
+# Выгрузки, формирующиеся одновременно; остальные запросы получают 503
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+class ExportSlot:
+    """
+    Занятое место выгрузки. Освобождается генератором архива по завершении, а если генератор
+    не был запущен (клиент отключился до начала отправки) - фоновой задачей ответа;
+    повторное освобождение ничего не делает.
+    """
+
+    def __init__(self):
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        _slots.release()
+
+
+def try_acquire_slot():
+    """Занимает место выгрузки без ожидания; None, если выгрузок уже EXPORT_MAX_CONCURRENT."""
+    return ExportSlot() if _slots.acquire(blocking=False) else None
+
+
+def upload_time(filename):
+    """Время загрузки документа по отметке в имени файла или None."""
+    return storage.find_timestamp(filename)[1]
+
+
+def select_documents(load_errors, unique_ids=None, since=None, until=None, status="all"):
+    """
+    Отбирает загруженные документы по UniqueID, дате загрузки (since и until - даты
+    datetime.date включительно) и статусу: signed - подписанные, error - с ошибкой, all - все.
+    load_errors - функция, возвращающая ошибки обработки по именам входных файлов (file_errors.all);
+    вызывается здесь, чтобы чтение хранилища ошибок выполнялось в том же потоке, что и отбор.
+    Возвращает описания документов от старых к новым.
+    """
+    unique_ids = {unique_id.lower() for unique_id in unique_ids} if unique_ids else None
+    errors = load_errors()
+    selected = []
+    for entry in storage.iter_files(STORAGE_PATH):
+        filename = storage.logical_name(entry.name)
+        match = INPUT_RE.search(filename)
+        unique_id = match.group(2) if match else None
+        if unique_ids is not None and (unique_id is None or unique_id.lower() not in unique_ids):
+            continue
+        uploaded = upload_time(filename)
+        if (since or until) and uploaded is None:
+            continue
+        if (since and uploaded.date() < since) or (until and uploaded.date() > until):
+            continue
+        # Ошибка записывается под именем входного файла до добавления UniqueID (<имя>_<отметка>.xml)
+        error, error_name = storage.find_error(errors, filename)
+        if (status == "signed" and error is not None) or (status == "error" and error is None):
+            continue
+        base_filename = os.path.splitext(filename)[0]
+        if error is None:
+            pdf_filename = f"{base_filename}_signed.pdf" if unique_id else f"{base_filename}.pdf"
+        else:
+            # PDF с ошибкой сохраняется под тем же именем, что и ошибка (conversion_error)
+            pdf_filename = naming.error_filename(os.path.splitext(error_name)[0])
+        selected.append({
+            "document": filename,
+            "unique_id": unique_id,
+            "uploaded": uploaded.strftime("%Y-%m-%d %H:%M:%S") if uploaded else "",
+            "status": "signed" if error is None else "error",
+            "pdf": pdf_filename,
+            "error": error,
+        })
+    selected.sort(key=lambda document: (document["uploaded"], document["document"]))
+    return selected
+
+
+class _ChunkSink(io.RawIOBase):
+    """Поток без перемотки, накапливающий записанные части до их отправки."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _write_entry(archive, sink, arcname, path, encoding, compress_type):
+    """Записывает файл хранилища в архив частями; после каждой части возвращает готовые байты."""
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.stat(path).st_mtime)[:6])
+    info.compress_type = compress_type
+    with archive.open(info, "w") as entry:
+        for chunk in storage.iter_decompressed(path, encoding):
+            entry.write(chunk)
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()  # Дескриптор данных записи
+    if data:
+        yield data
+
+
+def _manifest(documents):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    writer.writerows(documents)
+    return buffer.getvalue().encode("utf-8-sig")  # BOM - чтобы Excel открывал опись в UTF-8
+
+
+def stream_archive(documents, slot, include_inputs=False):
+    """
+    Генератор частей архива с PDF отобранных документов (и входными XML при include_inputs)
+    и описью manifest.csv. Синхронный: StreamingResponse выполняет его в пуле потоков,
+    каждая часть отправляется клиенту до чтения следующей. Документы, файлов которых нет
+    (удалены или еще конвертируются), отмечаются в описи пустым полем pdf.
+    slot - место выгрузки (try_acquire_slot), которое генератор освобождает по завершении.
+    """
+    started = time.perf_counter()
+    sent = 0
+    completed = False
+    try:
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+            for document in documents:
+                files = [("pdf", OUTPUT_PATH, document["pdf"], zipfile.ZIP_STORED)]
+                if include_inputs:
+                    files.append(("xml", STORAGE_PATH, document["document"], zipfile.ZIP_DEFLATED))
+                for folder, directory, filename, compress_type in files:
+                    path, encoding = storage.locate(directory, filename)
+                    if path is None and folder == "pdf" and document["status"] == "error":
+                        # PDF с ошибкой один для всех документов и не сохраняется для каждой ошибки
+                        archive.writestr(f"{folder}/{filename}", error_pdf_bytes(), compress_type=compress_type)
+                        continue
+                    if path is None:
+                        if folder == "pdf":
+                            document["pdf"] = ""
+                        continue
+                    for data in _write_entry(archive, sink, f"{folder}/{filename}", path, encoding,
+                                             compress_type):
+                        sent += len(data)
+                        yield data
+            archive.writestr(MANIFEST_NAME, _manifest(documents), compress_type=zipfile.ZIP_DEFLATED)
+        data = sink.drain()
+        sent += len(data)
+        yield data
+        completed = True
+    finally:
+        slot.release()
+        metrics.inc("export_bytes", sent)
+        metrics.inc("exports_completed" if completed else "exports_aborted")
+        metrics.observe("export", time.perf_counter() - started)
+        logger.info(f"Export of {len(documents)} documents {'completed' if completed else 'aborted'}: "
+                    f"{sent / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.1f} s")
@@ -1,12 +1,37 @@
 # test_main_app.py
+import asyncio
 import base64
+import json
+import logging
 import os
+import sys
+import time
+import zipfile
 from io import BytesIO
+from types import SimpleNamespace
 
 import pytest
 from fastapi.testclient import TestClient
+from admission import conversion_gate, parse_gate, ConversionRejected
+import main_app
+import naming
 from main_app import app
-from xml_processor import convert_xml_to_pdf
+from coordinates import parse_polygon, MAX_INPUT_PRECISION
+import logger
+from loop_monitor import LoopMonitor
+import profiling
+from profiling import check_memory_budget, MemoryBudgetExceeded
+import pdf_utils
+import resign
+from shared_store import SharedJsonStore, JsonDirStore
+import storage
+import warmup
+import xml_processor
+from xml_processor import convert_xml_to_pdf, estimate_cost, split_coordinates
+import spool
+import xml_backend
+from xml_backend import InvalidDocument
+import zip_export
 
 # Настройка тестового клиента
 client = TestClient(app)
@@ -23,6 +48,33 @@ def get_auth_header():
     return {"Authorization": "Basic " + base64.b64encode(f"{USERNAME}:{PASSWORD}".encode()).decode()}
 
 
+@pytest.fixture(autouse=True)
+def store(tmp_path_factory, monkeypatch):
+    """
+    Каталоги хранилища и общие файлы ошибок, статистики и заданий каждого теста - во временном
+    каталоге: тесты не оставляют файлов в рабочем хранилище и не удаляют их оттуда.
+    """
+    root = tmp_path_factory.mktemp("store")
+    paths = SimpleNamespace(input=str(root / "input_data"), output=str(root / "output_data"),
+                            unsigned=str(root / "unsigned_data"))
+    for path in vars(paths).values():
+        os.makedirs(path)
+    for module in (main_app, resign, spool, zip_export, pdf_utils, xml_processor):
+        for name, path in (("STORAGE_PATH", paths.input), ("OUTPUT_PATH", paths.output),
+                           ("UNSIGNED_PATH", paths.unsigned)):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, path)
+    paths.file_errors = SharedJsonStore(str(root / "file_errors.json"))
+    for module in (main_app, resign, spool):
+        monkeypatch.setattr(module, "file_errors", paths.file_errors)
+    paths.conversion_stats = JsonDirStore(str(root / "conversion_stats"))
+    for module in (main_app, spool):
+        monkeypatch.setattr(module, "conversion_stats", paths.conversion_stats)
+    monkeypatch.setattr(resign, "resign_jobs", SharedJsonStore(str(root / "resign_jobs.json")))
+    monkeypatch.setattr(storage, "MAINTENANCE_LOCK_PATH", str(root / ".maintenance.lock"))
+    return paths
+
+
 # Тесты для /upload/ endpoint
 @pytest.mark.parametrize("xml_filename", [
     "valid_xml.xml",
@@ -52,6 +104,46 @@ def test_upload_no_file_or_xml():
     assert "No file or XML data provided" in response.text
 
 
+def fake_conversion(monkeypatch, content=b"%PDF-1.4 converted"):
+    async def convert(xml_content, project_path, profile=None, unsigned_filename=None, root=None):
+        return BytesIO(content)
+
+    monkeypatch.setattr(main_app, "convert_xml_to_pdf", convert)
+
+
+def test_upload_served_from_stored_file(store, monkeypatch):
+    fake_conversion(monkeypatch)
+    xml = b"<Request><UniqueID>STORED</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>"
+    response = client.post("/upload/", files={"file": ("stored.xml", xml)}, headers=get_auth_header())
+
+    assert response.status_code == 200
+    assert response.content == b"%PDF-1.4 converted"
+    assert response.headers["cache-control"] == "no-store"
+    assert int(response.headers["x-queue-wait-ms"]) >= 0
+    assert int(response.headers["x-processing-ms"]) >= 0
+    # Ответ отдается из сохраненного файла, а не из буфера конвертации
+    stored = [storage.logical_name(entry.name) for entry in storage.iter_files(store.output)]
+    assert len(stored) == 1
+    assert storage.read_bytes(store.output, stored[0]) == response.content
+
+
+def test_upload_output_missing_after_conversion(store, monkeypatch):
+    fake_conversion(monkeypatch)
+
+    async def missing(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(main_app, "stored_file_response", missing)
+    headers = dict(get_auth_header(), Accept="application/json")
+    xml = b"<Request><UniqueID>MISSING</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>"
+    response = client.post("/upload/", files={"file": ("missing.xml", xml)}, headers=headers)
+
+    assert response.status_code == 500
+    assert response.json()["error"] == "output_missing"
+    # Конвертация прошла успешно: ошибка документа не записывается
+    assert store.file_errors.all() == {}
+
+
 # Тесты для функции convert_xml_to_pdf
 @pytest.mark.asyncio
 @pytest.mark.parametrize("xml_filename", [
@@ -91,4 +183,701 @@ def test_upload_without_auth():
 def test_upload_with_invalid_auth():
     response = client.post("/upload/", headers={"Authorization": "Basic invalid"})
     assert response.status_code == 401
-    assert "Invalid authentication credentials" in response.text
\ No newline at end of file
+    assert "Invalid authentication credentials" in response.text
+
+
+# Тесты ошибок загрузки в режиме API и проверки документа
+def test_upload_invalid_xml_json_mode(store):
+    headers = dict(get_auth_header(), Accept="application/json")
+    response = client.post("/upload/", files={"file": ("invalid.xml", b"<invalid")}, headers=headers)
+
+    assert response.status_code == 400
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["error"] == "invalid_xml"
+    # PDF с ошибкой не сохраняется; ссылка каталога файлов отдает общий PDF с ошибкой
+    error_pdf = f"{response.json()['document']}_error.pdf"
+    assert storage.locate(store.output, error_pdf) == (None, None)
+    response = client.get(f"/output/{error_pdf}", headers=get_auth_header())
+    assert response.status_code == 200
+    assert response.content == pdf_utils.error_pdf_bytes()
+    assert client.get("/output/unknown_error.pdf", headers=get_auth_header()).status_code == 404
+
+
+def test_upload_rejects_document_without_required_fields():
+    with pytest.raises(InvalidDocument):
+        xml_backend.validate(xml_backend.parse(b"<Request><UniqueID>NODATE</UniqueID></Request>"))
+
+    headers = dict(get_auth_header(), Accept="application/json")
+    xml = b"<Request><UniqueID>NODATE</UniqueID><RequestDateTime> </RequestDateTime></Request>"
+    response = client.post("/upload/", files={"file": ("nodate.xml", xml)}, headers=headers)
+
+    assert response.status_code == 422
+    assert response.json()["error"] == "invalid_document"
+    assert "RequestDateTime" in response.json()["message"]
+
+
+# Тесты контроля допуска и полос конвертаций
+def test_upload_rejected_when_queue_full(monkeypatch):
+    async def reject(cost=0, timeout=None):
+        raise ConversionRejected("Conversion queue is full", retry_after=7)
+
+    monkeypatch.setattr(conversion_gate, "acquire", reject)
+    xml = b"<Request><UniqueID>QUEUE</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>"
+    response = client.post("/upload/", files={"file": ("queue.xml", xml)}, headers=get_auth_header())
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+
+
+def test_upload_parsing_is_bounded_before_admission(store, monkeypatch):
+    import threading
+
+    threads = []
+    parse = xml_backend.parse
+
+    def tracked_parse(xml_content):
+        threads.append(threading.current_thread().name)
+        return parse(xml_content)
+
+    monkeypatch.setattr(xml_backend, "parse", tracked_parse)
+    headers = dict(get_auth_header(), Accept="application/json")
+    response = client.post("/upload/", files={"file": ("parse.xml", b"<invalid")}, headers=headers)
+    # Разбор выполняется в экзекуторе parse_gate, слот освобождается и при ошибке
+    assert response.status_code == 400
+    assert threads[0].startswith("parsing")
+    assert parse_gate.active == 0
+    stored = list(storage.iter_files(store.input))
+
+    async def reject(timeout=None):
+        raise ConversionRejected("Conversion queue is full", retry_after=3)
+
+    monkeypatch.setattr(parse_gate, "acquire", reject)
+    xml = b"<Request><UniqueID>PARSE</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>"
+    response = client.post("/upload/", files={"file": ("parse.xml", xml)}, headers=headers)
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+    assert response.json()["error"] == "server_busy"
+    # Отклоненный запрос не разбирается и не сохраняет входных данных
+    assert len(threads) == 1
+    assert len(list(storage.iter_files(store.input))) == len(stored)
+
+def test_large_documents_use_separate_lane(monkeypatch):
+    monkeypatch.setattr(xml_processor, "LARGE_DOC_POINTS", 100)
+    small = xml_backend.parse(b"<Request><Plot><Polygon><Point/></Polygon></Plot></Request>")
+    points = "<Point/>" * 101
+    large = xml_backend.parse(f"<Request><Plot><Polygon>{points}</Polygon></Plot></Request>")
+
+    assert conversion_gate.lane_for(estimate_cost(small, 100)) is conversion_gate.small
+    assert conversion_gate.lane_for(estimate_cost(large, 100)) is conversion_gate.large
+
+
+# Тест срока обработки запроса
+def test_upload_cancelled_when_deadline_exceeded(monkeypatch):
+    async def slow_conversion(*args, **kwargs):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(main_app, "convert_xml_to_pdf", slow_conversion)
+    xml = b"<Request><UniqueID>DEADLINE</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>"
+    headers = dict(get_auth_header(), Accept="application/json", **{"X-Request-Timeout": "0.2"})
+    response = client.post("/upload/", files={"file": ("deadline.xml", xml)}, headers=headers)
+
+    assert response.status_code == 504
+    assert response.json()["error"] == "deadline_exceeded"
+
+
+# Тесты координат и рендеринга частями
+def test_parse_polygon_pads_to_common_precision():
+    # "2" дополняется до точности полигона, запятая принимается как разделитель
+    assert list(parse_polygon(["55,75", "56"], ["2", "37.612"])) == ["55.750, 2.000", "56.000, 37.612"]
+    # Порядок учитывается при подсчете знаков: 1e-3 не округляется до 0.00
+    assert list(parse_polygon(["1e-3", "55.7"], ["2", "37.61"])) == ["0.001, 2.000", "55.700, 37.610"]
+
+
+def test_parse_polygon_caps_precision_of_long_input():
+    row = parse_polygon(["55.12345678901234567"], ["37.1"])[0]
+    assert row == "55.123456789012, 37.100000000000"
+    assert len(row.split(", ")[0].split(".")[1]) == MAX_INPUT_PRECISION
+
+
+@pytest.mark.parametrize("latitude, longitude", [
+    ("nan", "37.6"),
+    ("55.7", "inf"),
+    ("-inf", "37.6"),
+    ("90.5", "37.6"),
+    ("55.7", "-180.1"),
+    ("abc", "37.6"),
+])
+def test_parse_polygon_rejects_invalid_values(latitude, longitude):
+    with pytest.raises(ValueError):
+        parse_polygon([latitude], [longitude])
+
+
+def test_split_coordinates_chunk_boundaries():
+    def plot(number, *sizes):
+        polygons = [parse_polygon([str(i) for i in range(size)], [str(i) for i in range(size)]) for size in sizes]
+        return {"number": number, "name": f"Plot {number}", "coords": polygons}
+
+    def layout(chunks):
+        return [[(item["number"], item["continued"], [(p["index"], p["start"], len(p["points"]))
+                                                      for p in item["polygons"]]) for item in chunk]
+                for chunk in chunks]
+
+    # Ровно две части: вторая продолжает полигон с шестой точки
+    assert layout(split_coordinates([plot("1", 6)], 3)) == [
+        [("1", False, [(0, 0, 3)])],
+        [("1", True, [(0, 3, 3)])],
+    ]
+    # Остаток уходит в последнюю часть, второй полигон начинается в той же части
+    assert layout(split_coordinates([plot("1", 4, 3)], 3)) == [
+        [("1", False, [(0, 0, 3)])],
+        [("1", True, [(0, 3, 1), (1, 0, 2)])],
+        [("1", True, [(1, 2, 1)])],
+    ]
+    # Участок без полигонов и пустой полигон не создают отдельных частей
+    assert layout(split_coordinates([plot("1"), plot("2", 0), plot("3", 2)], 3)) == [
+        [("1", False, []), ("2", False, [(0, 0, 0)]), ("3", False, [(0, 0, 2)])],
+    ]
+    assert list(split_coordinates([], 3)) == []
+
+
+def test_chunked_rendering_keeps_all_coordinates_in_order(tmp_path, monkeypatch):
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+
+    # Основной шаблон, поддерживающий режим частей: таблицы координат - последний раздел
+    templates_dir = tmp_path / "templates"
+    templates_dir.mkdir()
+    with open(os.path.join(os.path.dirname(xml_processor.__file__), "templates", "coords_chunk.html"),
+              encoding="utf-8") as f:
+        (templates_dir / "coords_chunk.html").write_text(f.read(), encoding="utf-8")
+    (templates_dir / "template2.html").write_text(
+        "<html><body><p>Заявление {{ inv }}</p>"
+        "{% if coords_chunked %}<p>Координаты участков</p>{% else %}"
+        "{% for plot in coords %}{% for polygon in plot.coords %}{% for point in polygon %}"
+        "<p>{{ point }}</p>{% endfor %}{% endfor %}{% endfor %}{% endif %}</body></html>",
+        encoding="utf-8")
+    monkeypatch.setattr(xml_processor, "DOCUMENT_SECTIONS", "template2.html")
+    monkeypatch.setattr(xml_processor, "LARGE_DOC_CHUNK_POINTS", 5)
+
+    def polygon(plot, size):
+        return parse_polygon([f"55.{plot}{i:03d}" for i in range(size)], [f"37.{plot}{i:03d}" for i in range(size)])
+
+    coords = [{"number": "1", "name": "", "coords": [polygon(1, 7), polygon(2, 3)]},
+              {"number": "2", "name": "", "coords": [polygon(3, 4)]}]
+    context = {"inv": "CHUNKED", "coords": coords, "test": True}
+    pdf_buffer = xml_processor.render_pdf_chunked(context, str(tmp_path))
+
+    text = [element.get_text() for page in extract_pages(pdf_buffer) for element in page
+            if isinstance(element, LTTextContainer)]
+    text = "".join(text)
+    expected = [point for plot in coords for item in plot["coords"] for point in item]
+    found = [point for point in expected if point in text]
+    # Все точки на месте, в порядке участков и контуров, после основного шаблона
+    assert found == expected
+    assert sorted(expected, key=text.index) == expected
+    assert text.index("Заявление CHUNKED") < text.index(expected[0])
+
+
+
+def test_static_section_cache_follows_included_templates(tmp_path, monkeypatch):
+    import re
+    from pdfminer.high_level import extract_text
+    from reportlab.pdfgen import canvas
+
+    renders = []
+
+    def fake_html_to_pdf(html_content, project_path, target, css=None):
+        # PDF из одной страницы с текстом разметки вместо WeasyPrint
+        text = re.sub(r"<[^>]+>", " ", html_content).split()
+        renders.append(" ".join(text))
+        can = canvas.Canvas(target)
+        can.drawString(72, 720, " ".join(text))
+        can.save()
+        target.seek(0)
+        return target
+
+    templates_dir = tmp_path / "templates"
+    templates_dir.mkdir()
+    (templates_dir / "cover.html").write_text("<p>Cover</p>{% include 'part.html' %}", encoding="utf-8")
+    (templates_dir / "part.html").write_text("<p>Part one</p>", encoding="utf-8")
+    (templates_dir / "body.html").write_text("<p>Body {{ inv }}</p>", encoding="utf-8")
+    monkeypatch.setattr(xml_processor, "html_to_pdf", fake_html_to_pdf)
+    monkeypatch.setattr(xml_processor, "DOCUMENT_SECTIONS", "static:cover.html, body.html")
+    monkeypatch.setattr(xml_processor, "_static_sections", {})
+    monkeypatch.setattr(xml_processor, "_template_digests", {})
+
+    def render(inv):
+        return extract_text(xml_processor.render_pdf({"inv": inv, "test": False}, str(tmp_path))).split()
+
+    # Статическая секция рендерится один раз и объединяется перед динамической
+    assert render("A") == ["Cover", "Part", "one", "Body", "A"]
+    assert render("B") == ["Cover", "Part", "one", "Body", "B"]
+    assert renders == ["Cover Part one", "Body A", "Body B"]
+
+    # Изменение подключаемого шаблона сбрасывает кэш секции
+    part = templates_dir / "part.html"
+    part.write_text("<p>Part two</p>", encoding="utf-8")
+    mtime = part.stat().st_mtime + 10
+    os.utime(part, (mtime, mtime))
+    assert render("C") == ["Cover", "Part", "two", "Body", "C"]
+    assert renders[-2:] == ["Cover Part two", "Body C"]
+    assert len(xml_processor._static_sections) == 1
+
+# Тесты бюджета памяти конвертации
+def test_memory_budget_routes_to_chunks_or_rejects(monkeypatch):
+    monkeypatch.setattr(profiling, "MEMORY_BASE_MB", 10)
+    monkeypatch.setattr(profiling, "MEMORY_PER_POINT_KB", 10)
+    monkeypatch.setattr(profiling, "MEMORY_PER_POINT_CHUNKED_KB", 1)
+    monkeypatch.setattr(profiling, "MEMORY_PER_DEPOSIT_KB", 0)
+    monkeypatch.setattr(profiling, "LARGE_DOC_CHUNK_POINTS", 100)
+    monkeypatch.setattr(profiling, "MEMORY_BUDGET_MB", 20)
+    monkeypatch.setattr(profiling, "LARGE_DOC_CHUNKING", True)
+
+    assert check_memory_budget(100, 0, large=False) is False  # 11 МБ: укладывается в бюджет
+    assert check_memory_budget(2000, 0, large=False) is True  # 30 МБ целиком, 13 МБ частями
+    with pytest.raises(MemoryBudgetExceeded):
+        check_memory_budget(20000, 0, large=False)  # 30 МБ даже частями
+
+    # Режим частей выключен: документ, не укладывающийся целиком, отклоняется
+    monkeypatch.setattr(profiling, "LARGE_DOC_CHUNKING", False)
+    with pytest.raises(MemoryBudgetExceeded):
+        check_memory_budget(2000, 0, large=False)
+
+
+def test_upload_over_memory_budget_returns_413(monkeypatch):
+    def render_not_expected(*args, **kwargs):
+        raise AssertionError("document over budget must not be rendered")
+
+    monkeypatch.setattr(profiling, "MEMORY_BUDGET_MB", 1)
+    monkeypatch.setattr(xml_processor, "render_pdf", render_not_expected)
+    monkeypatch.setattr(xml_processor, "render_pdf_chunked", render_not_expected)
+    xml = (b"<Request><UniqueID>BUDGET</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime>"
+           b"<Plot Number='1'><Polygon><Point><Latitude>55.7</Latitude><Longitude>37.6</Longitude></Point>"
+           b"</Polygon></Plot></Request>")
+    headers = dict(get_auth_header(), Accept="application/json")
+    response = client.post("/upload/", files={"file": ("budget.xml", xml)}, headers=headers)
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "document_too_large"
+
+
+# Тесты каталога спула
+def test_spool_recovers_files_of_stopped_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, "PROCESSING_PATH", str(tmp_path))
+    stopped = tmp_path / "host-1-stopped"
+    stopped.mkdir()
+    (stopped / "doc_20240101120000.xml").write_bytes(b"<Request/>")
+    running = tmp_path / "host-2-running"
+    running.mkdir()
+    (running / "busy_20240101120000.xml").write_bytes(b"<Request/>")
+    lock_file = spool.lock_work_dir(str(running))
+    work_dir = tmp_path / "host-3-current"
+    work_dir.mkdir()
+
+    try:
+        assert spool.recover(str(work_dir)) == ["doc_20240101120000.xml"]
+    finally:
+        lock_file.close()
+    assert (work_dir / "doc_20240101120000.xml").exists()
+    assert not stopped.exists()
+    assert (running / "busy_20240101120000.xml").exists()
+
+
+def test_spool_work_dir_is_locked_before_it_becomes_visible(tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, "PROCESSING_PATH", str(tmp_path))
+    starting = tmp_path / ".host-1-starting"  # Каталог, который другой демон еще не заблокировал
+    starting.mkdir()
+    work_dir = tmp_path / "host-2-current"
+    lock_file = spool.create_work_dir(str(work_dir))
+    other_dir = tmp_path / "host-3-other"
+    other_dir.mkdir()
+
+    try:
+        assert spool.recover(str(other_dir)) == []
+        assert (work_dir / spool.LOCK_NAME).exists()
+        assert starting.exists()
+    finally:
+        lock_file.close()
+
+
+def test_spool_rejects_document_without_required_fields(tmp_path):
+    name = "nodate_20240101000000.xml"
+    (tmp_path / name).write_bytes(b"<Request><UniqueID>NODATE</UniqueID></Request>")
+    with pytest.raises(spool.SpoolError, match="RequestDateTime"):
+        asyncio.run(spool.process(str(tmp_path), name, "."))
+
+
+def test_spool_conversion_takes_conversion_slot(store, tmp_path, monkeypatch):
+    active = []
+
+    async def convert(xml_content, project_path, profile=None, unsigned_filename=None, root=None):
+        active.append(conversion_gate.active)
+        return BytesIO(b"%PDF-1.4 spool")
+
+    monkeypatch.setattr(spool, "convert_xml_to_pdf", convert)
+    name = "spool_20240101000000.xml"
+    (tmp_path / name).write_bytes(
+        b"<Request><UniqueID>SPOOL</UniqueID><RequestDateTime>2024-01-01T00:00:00</RequestDateTime></Request>")
+
+    pdf_filename = asyncio.run(spool.process(str(tmp_path), name, "."))
+    # Конвертация выполняется в занятом слоте полосы, слот освобождается после нее
+    assert active == [1]
+    assert conversion_gate.active == 0
+    assert storage.read_bytes(store.output, pdf_filename) == b"%PDF-1.4 spool"
+    stats = store.conversion_stats.get(naming.input_filename("spool_20240101000000", "SPOOL", ".xml"))
+    assert stats["lane"] == conversion_gate.lane_for(stats["cost_ms"]).name
+
+
+def test_conversion_stats_are_stored_per_document(tmp_path):
+    stats = JsonDirStore(str(tmp_path / "stats"))
+    assert stats.get("doc_20240101000000_A.xml") is None
+    for index, name in enumerate(["doc_20240101000000_A.xml", "doc_20240101000000_B.xml",
+                                  "doc_20240101000000_C.xml"]):
+        stats.set(name, {"status": "in_progress"})
+        os.utime(stats._file(name), (1000 + index, 1000 + index))
+    stats.set("doc_20240101000000_C.xml", {"stages": {}, "unique_id": "C"})
+
+    assert stats.get("doc_20240101000000_C.xml") == {"stages": {}, "unique_id": "C"}
+    # Сверх предела удаляются записи, изменявшиеся раньше остальных
+    assert stats.prune(2) == 1
+    assert stats.get("doc_20240101000000_A.xml") is None
+    assert stats.get("doc_20240101000000_B.xml") == {"status": "in_progress"}
+    stats.delete(["doc_20240101000000_B.xml", "missing.xml"])
+    stats.clear()
+    assert os.listdir(tmp_path / "stats") == []
+
+
+# Тесты повторной подписи
+def test_resign_clears_error_of_input_file(store, monkeypatch):
+    async def fake_finalize(pdf_buffer, project_path, profile=None):
+        return BytesIO(b"%PDF-1.4 signed")
+
+    monkeypatch.setattr(resign, "finalize_pdf", fake_finalize)
+    unsigned_filename = "resign_20240101000000_RESIGNTEST_unsigned.pdf"
+    storage.write_file(store.unsigned, unsigned_filename, b"%PDF-1.4 unsigned")
+    storage.write_file(store.output, "resign_20240101000000_error.pdf", b"%PDF-1.4 error")
+    # Ошибка записывается под именем входного файла без UniqueID
+    store.file_errors.set("resign_20240101000000.xml", "Failed to sign PDF")
+
+    pdf_filename = asyncio.run(resign.resign_document(unsigned_filename, "."))
+    assert pdf_filename == "resign_20240101000000_RESIGNTEST_signed.pdf"
+    assert "resign_20240101000000.xml" not in store.file_errors.all()
+    assert storage.locate(store.output, "resign_20240101000000_error.pdf") == (None, None)
+
+
+def test_resign_job_state_is_shared(store, monkeypatch):
+    async def fake_finalize(pdf_buffer, project_path, profile=None):
+        return BytesIO(b"%PDF-1.4 signed")
+
+    monkeypatch.setattr(resign, "finalize_pdf", fake_finalize)
+    unsigned_filename = "job_20240101000000_RESIGNJOB_unsigned.pdf"
+    storage.write_file(store.unsigned, unsigned_filename, b"%PDF-1.4 unsigned")
+    with TestClient(app) as job_client:
+        response = job_client.post("/admin/resign", json={"unique_ids": ["RESIGNJOB"]},
+                                   headers=get_auth_header())
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+        for _ in range(50):
+            if resign.resign_jobs.get(job_id)["status"] != "running":
+                break
+            time.sleep(0.05)
+    # Состояние читается из общего хранилища, а не из памяти принявшего запрос воркера
+    job = resign.get_job(job_id)
+    assert job["status"] == "completed"
+    assert job["resigned"] == 1 and job["failed"] == {}
+    assert client.get("/admin/resign/unknown", headers=get_auth_header()).status_code == 404
+
+
+# Тесты проверок живости и готовности
+def test_healthz_without_auth():
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+
+def test_readyz_reports_warm_up_state(monkeypatch):
+    monkeypatch.setitem(warmup.state, "ready", False)
+    assert client.get("/readyz").status_code == 503
+
+    monkeypatch.setitem(warmup.state, "ready", True)
+    assert client.get("/readyz").status_code == 200
+
+
+# Тесты кэширования и диапазонов для сохраненных PDF
+def test_output_pdf_conditional_and_range_requests(store):
+    pdf_filename = "cache_20240101000000_TEST_signed.pdf"
+    storage.write_file(store.output, pdf_filename, b"%PDF-1.4 test content")
+
+    response = client.get(f"/output/{pdf_filename}", headers=get_auth_header())
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("private")
+    etag = response.headers["etag"]
+
+    headers = dict(get_auth_header(), **{"If-None-Match": etag})
+    assert client.get(f"/output/{pdf_filename}", headers=headers).status_code == 304
+
+    headers = dict(get_auth_header(), Range="bytes=0-3")
+    response = client.get(f"/output/{pdf_filename}", headers=headers)
+    assert response.status_code == 206
+    assert response.content == b"%PDF"
+
+
+# Тест потоковой выгрузки документов архивом ZIP
+def test_export_streams_selected_documents(store):
+    xml_filename = "export_20240101000000_EXPORTTEST.xml"
+    pdf_filename = "export_20240101000000_EXPORTTEST_signed.pdf"
+    storage.write_file(store.input, xml_filename, b"<Root><UniqueID>EXPORTTEST</UniqueID></Root>", compress=True)
+    storage.write_file(store.output, pdf_filename, b"%PDF-1.4 test content")
+
+    response = client.get("/admin/export?unique_id=exporttest&inputs=true", headers=get_auth_header())
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["manifest.csv", f"pdf/{pdf_filename}", f"xml/{xml_filename}"]
+    assert archive.read(f"pdf/{pdf_filename}") == b"%PDF-1.4 test content"
+
+    response = client.get("/admin/export?unique_id=EXPORTTEST&status=error", headers=get_auth_header())
+    assert response.status_code == 404
+
+    # Ошибка записана под именем входного файла без UniqueID; PDF с ошибкой - общий
+    store.file_errors.set("export_20240101000000.xml", "Failed to sign PDF")
+    response = client.get("/admin/export?unique_id=EXPORTTEST&status=error", headers=get_auth_header())
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(BytesIO(response.content))
+    assert sorted(archive.namelist()) == ["manifest.csv", "pdf/export_20240101000000_error.pdf"]
+    assert archive.read("pdf/export_20240101000000_error.pdf") == pdf_utils.error_pdf_bytes()
+    assert "Failed to sign PDF" in archive.read("manifest.csv").decode("utf-8-sig")
+
+    # Каталог файлов ссылается на тот же PDF с ошибкой
+    [entry] = main_app.collect_files("EXPORTTEST")
+    assert entry["error"] == "Failed to sign PDF"
+    assert entry["pdf_filename"] == "export_20240101000000_error.pdf"
+
+
+# Тесты раскладки, сжатия и срока хранения файлов
+def test_shard_subdir_uses_upload_timestamp():
+    # Исходное имя содержит 14 цифр: подкаталог задает метка загрузки, добавленная последней
+    assert storage.shard_subdir("scan_20191231235959_20240102030405_ID.xml") == os.path.join("2024", "01", "02")
+    assert storage.shard_subdir("order_12345678901234_20240102030405.xml") == os.path.join("2024", "01", "02")
+    assert storage.shard_subdir("notes.xml") is None
+
+
+def test_migrate_flat_is_idempotent_and_batched(tmp_path):
+    for day in range(1, 6):
+        (tmp_path / f"doc_202401{day:02d}000000_ID.xml").write_bytes(b"<Request/>")
+    (tmp_path / "notes.xml").write_bytes(b"")
+
+    assert storage.migrate_flat(str(tmp_path), limit=2) == 2
+    assert storage.migrate_flat(str(tmp_path), limit=2) == 2
+    assert storage.migrate_flat(str(tmp_path), limit=2) == 1
+    assert storage.migrate_flat(str(tmp_path)) == 0
+    assert (tmp_path / "2024" / "01" / "05" / "doc_20240105000000_ID.xml").exists()
+    assert (tmp_path / "notes.xml").exists()
+    assert storage.locate(str(tmp_path), "doc_20240103000000_ID.xml")[0] is not None
+
+
+def test_apply_retention_removes_old_files_in_batches(tmp_path):
+    old = time.time() - 10 * 86400
+    for day in range(1, 4):
+        path = tmp_path / "2024" / "01" / f"{day:02d}" / f"doc_202401{day:02d}000000_ID.xml"
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"<Request/>")
+        os.utime(path, (old, old))
+    (tmp_path / "fresh_20240104000000_ID.xml").write_bytes(b"<Request/>")
+
+    processed = storage.apply_retention([str(tmp_path)], max_age_seconds=86400, batch_size=2, batch_pause=0)
+    assert sorted(name for _, name in processed) == [f"doc_202401{day:02d}000000_ID.xml" for day in range(1, 4)]
+    assert not (tmp_path / "2024").exists()  # Опустевшие подкаталоги удалены
+    assert (tmp_path / "fresh_20240104000000_ID.xml").exists()
+
+
+def test_compressed_storage_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_COMPRESSION", "gzip")
+    monkeypatch.setattr(storage, "COMPRESS_AFTER_DAYS", 0)
+    directory = str(tmp_path)
+    filename = "doc_20240101000000_GZIP.xml"
+
+    path = storage.write_file(directory, filename, b"<Request/>", compress=True)
+    assert path.endswith(".gz")
+    assert storage.locate(directory, filename) == (path, "gzip")
+    assert storage.read_bytes(directory, filename) == b"<Request/>"
+
+    # Несжатая запись заменяет сжатый вариант: по имени находится только новый файл
+    plain_path = storage.write_file(directory, filename, b"<Request>new</Request>")
+    assert not os.path.exists(path)
+    assert storage.locate(directory, filename) == (plain_path, None)
+
+    # Сжатие по возрасту сохраняет время изменения файла
+    old = time.time() - 3 * 86400
+    os.utime(plain_path, (old, old))
+    assert storage.compress_aged(directory, 86400) == 1
+    compressed_path, encoding = storage.locate(directory, filename)
+    assert encoding == "gzip" and not os.path.exists(plain_path)
+    assert os.stat(compressed_path).st_mtime == pytest.approx(old)
+    assert storage.read_bytes(directory, filename) == b"<Request>new</Request>"
+
+
+# Тест поиска блокировок цикла событий
+def test_loop_monitor_reports_blocking_frame(monkeypatch):
+    monitor = LoopMonitor(interval=0.02, threshold=0.05)
+
+    def blocking_call():
+        time.sleep(0.3)
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(monitor.run())
+        await asyncio.sleep(0.1)
+        blocking_call()
+        await asyncio.sleep(0.1)  # Задержка записывается при следующем пробуждении задачи
+        task.cancel()
+
+    asyncio.run(run())
+    assert monitor.blocked >= 1
+    offender = monitor.offenders()[0]  # Наибольшая суммарная длительность
+    assert offender["max_ms"] >= 200
+    assert "in blocking_call" in offender["stack"][-1]
+
+    monkeypatch.setattr(main_app, "LOOP_MONITOR", True)
+    monkeypatch.setattr(main_app, "loop_monitor", monitor)
+    response = client.get("/admin/event-loop", headers=get_auth_header())
+    assert response.status_code == 200
+    assert response.json()["blocked"] == monitor.blocked
+    assert sum(response.json()["lag_histogram_ms"].values()) > 0
+    assert "in blocking_call" in response.json()["offenders"][0]["stack"][-1]
+
+
+# Тест общего хранилища нескольких процессов
+def write_store_entries(path, prefix, count, start):
+    start.wait()
+    store = SharedJsonStore(path)
+    for index in range(count):
+        store.set(f"{prefix}{index}", index)
+
+
+def test_shared_store_keeps_updates_of_concurrent_processes(tmp_path):
+    import multiprocessing
+
+    path = str(tmp_path / "shared.json")
+    store = SharedJsonStore(path)
+    store.set("initial", 0)
+    assert store.all() == {"initial": 0}  # Кэш читателя до записи других процессов
+
+    context = multiprocessing.get_context("fork")
+    start = context.Event()
+    writers = [context.Process(target=write_store_entries, args=(path, prefix, 100, start))
+               for prefix in ("a", "b")]
+    for writer in writers:
+        writer.start()
+    start.set()
+    for writer in writers:
+        writer.join(30)
+        assert writer.exitcode == 0
+
+    # Ни одно изменение не потеряно, кэш читателя обновлен
+    expected = {"initial": 0}
+    expected.update({f"{prefix}{index}": index for prefix in ("a", "b") for index in range(100)})
+    assert store.all() == expected
+
+# Тест штампа и нумерации страниц
+def legacy_stamp_and_page_numbers(pdf_buffer, signer_name):
+    """Прежняя схема: отдельное наложение штампа и номера на каждую страницу, без сжатия."""
+    from pdfrw import PdfReader, PdfWriter, PageMerge
+    from reportlab.pdfgen import canvas
+
+    pdf_reader = PdfReader(pdf_buffer)
+    page_width = float(pdf_reader.pages[0]['/MediaBox'][2])
+    page_height = float(pdf_reader.pages[0]['/MediaBox'][3])
+    pdf_writer = PdfWriter()
+    for page_num, page in enumerate(pdf_reader.pages):
+        packet = BytesIO()
+        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+        pdf_utils.draw_stamp(can, signer_name, page_width, pdf_utils.stamp_offset(page, page_height))
+        pdf_utils.draw_page_number(can, page_num, len(pdf_reader.pages))
+        can.save()
+        packet.seek(0)
+        PageMerge(page).add(PdfReader(packet).pages[0]).render()
+        pdf_writer.addpage(page)
+    output_buffer = BytesIO()
+    pdf_writer.write(output_buffer)
+    return output_buffer
+
+
+def test_stamp_and_page_numbers_on_every_page(monkeypatch):
+    from pdfminer.high_level import extract_text
+    from pdfrw import PdfReader
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    # Шрифты штампа регистрируются по относительному пути static/fonts каталога app
+    app_dir = os.path.dirname(os.path.abspath(pdf_utils.__file__))
+    if not os.path.exists(os.path.join(app_dir, "static", "fonts", "Roboto-Regular.ttf")):
+        pytest.skip("Stamp fonts are not installed")
+    monkeypatch.chdir(app_dir)
+    pdf_utils.register_fonts.cache_clear()
+
+    pages = 5
+    document = BytesIO()
+    can = canvas.Canvas(document, pagesize=A4)
+    for page in range(pages):
+        can.drawString(50, 800, f"Page content {page + 1}")
+        can.showPage()
+    can.save()
+    data = document.getvalue()
+
+    output = pdf_utils.add_stamp_and_page_numbers(BytesIO(data), "Signer")
+    assert len(PdfReader(BytesIO(output.getvalue())).pages) == pages
+    for page in range(pages):
+        text = extract_text(BytesIO(output.getvalue()), page_numbers=[page])
+        assert f"Page content {page + 1}" in text
+        assert f"Страница {page + 1} из {pages}" in text
+        assert "Документ подписан электронной подписью" in text
+    # Шрифты штампа встраиваются один раз, а не в каждое наложение
+    assert len(output.getvalue()) < len(legacy_stamp_and_page_numbers(BytesIO(data), "Signer").getvalue())
+
+# Тесты логирования
+def test_log_record_keeps_request_id_and_traceback_through_queue():
+    token = logger.request_id_var.set("req-log")
+    try:
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            record = logging.getLogger("test_log").makeRecord(
+                "test_log", logging.ERROR, __file__, 1, "Failed %s", ("doc",), sys.exc_info())
+        assert logger.RequestIdFilter().filter(record)
+    finally:
+        logger.request_id_var.reset(token)
+
+    # Запись в том виде, в каком ее получает фоновый писатель
+    prepared = logger.queue_handler.prepare(record)
+    assert prepared.exc_info is None
+    entry = json.loads(logger.JsonFormatter().format(prepared))
+    assert entry["request_id"] == "req-log"
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "Failed doc"
+    assert entry["exc_info"].endswith("ValueError: broken")
+    text = logger.MoscowFormatter("[%(request_id)s] %(message)s").format(prepared)
+    assert text.startswith("[req-log] Failed doc\nTraceback")
+
+
+def test_log_rotation_by_several_writers_keeps_order(tmp_path):
+    # Обработчики воркеров пишут в один файл; ротация одного не уводит записи другого в архив
+    path = str(tmp_path / "app.log")
+    handlers = [logger.SafeRotatingFileHandler(path, maxBytes=100, backupCount=50, encoding="utf-8")
+                for _ in range(2)]
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    records = [f"record {index:03d}" for index in range(40)]
+    for index, message in enumerate(records):
+        handlers[index % 2].emit(logging.makeLogRecord({"msg": message}))
+    for handler in handlers:
+        handler.close()
+
+    backups = sorted((name for name in os.listdir(tmp_path) if name.startswith("app.log.") and name[8:].isdigit()),
+                     key=lambda name: -int(name[8:]))
+    assert len(backups) > 2
+    lines = []
+    for name in backups + ["app.log"]:
+        with open(tmp_path / name, encoding="utf-8") as f:
+            lines.extend(f.read().splitlines())
+    assert lines == records
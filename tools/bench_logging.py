@@ -0,0 +1,97 @@
+# bench_logging.py
+"""
+Замер накладных расходов логирования на поток обработки запроса.
+
+Сравнивает синхронные FileHandler + StreamHandler (прежняя схема) с очередью
+и фоновым писателем из logger.py. Измеряется время, которое тратит вызывающий
+поток (цикл событий) на одну запись и на один запрос (~10 записей).
+
+Параметр --write-latency-ms имитирует задержку записи на сетевой диск (/mnt):
+каждая операция записи в файл дополнительно ждет указанное время.
+
+Запуск: python tools/bench_logging.py [--requests N] [--write-latency-ms MS]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+LINES_PER_REQUEST = 10
+
+
+class SlowStream:
+    """Файловый поток, имитирующий задержку каждой записи."""
+
+    def __init__(self, stream, latency):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run(logger, requests):
+    started = time.perf_counter()
+    for i in range(requests):
+        for line in range(LINES_PER_REQUEST):
+            logger.info(f"Request {i}: pipeline step {line}")
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--write-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    latency = args.write_latency_ms / 1000
+
+    storage_dir = tempfile.mkdtemp()
+    os.environ["STORAGE_DIR"] = storage_dir
+    os.environ["LOG_QUEUE_SIZE"] = str(args.requests * LINES_PER_REQUEST + 1)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+    import logger as app_logger  # noqa: E402  (STORAGE_DIR должен быть задан до импорта)
+
+    # Консоль перенаправляем в /dev/null, чтобы замер не зависел от терминала
+    console = open(os.devnull, "w")
+    formatter = app_logger.MoscowFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    sync_file_handler = logging.FileHandler(os.path.join(storage_dir, "sync.log"), encoding="utf-8")
+    sync_file_handler.setStream(SlowStream(sync_file_handler.stream, latency))
+    sync_logger = logging.getLogger("bench.sync")
+    sync_logger.propagate = False
+    for handler in (sync_file_handler, logging.StreamHandler(console)):
+        handler.setFormatter(formatter)
+        sync_logger.addHandler(handler)
+    sync_logger.setLevel(logging.INFO)
+
+    app_logger.file_handler.setStream(SlowStream(app_logger.file_handler.stream, latency))
+    app_logger.console_handler.setStream(console)
+    queued_logger = app_logger.get_logger("bench.queued")
+    queued_logger.propagate = False
+
+    sync_time = run(sync_logger, requests=args.requests)
+    queued_time = run(queued_logger, requests=args.requests)
+    drain_started = time.perf_counter()
+    app_logger.stop_listener()
+    drain_time = time.perf_counter() - drain_started
+
+    total_lines = args.requests * LINES_PER_REQUEST
+    print(f"Requests: {args.requests}, lines per request: {LINES_PER_REQUEST}, "
+          f"simulated write latency: {args.write_latency_ms} ms")
+    for name, elapsed in (("sync FileHandler + StreamHandler", sync_time), ("queue + background writer", queued_time)):
+        print(f"{name:34s} {elapsed / total_lines * 1e6:10.1f} us/line "
+              f"{elapsed / args.requests * 1e6:10.1f} us/request")
+    print(f"Background writer drain after run: {drain_time:.2f} s, "
+          f"dropped records: {app_logger.DroppingQueueHandler.dropped}")
+
+
+if __name__ == "__main__":
+    main()
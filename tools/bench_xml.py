@@ -0,0 +1,67 @@
+# bench_xml.py
+"""
+Сравнение парсеров XML (xml_backend): ElementTree и lxml со скомпилированными XPath.
+
+Для синтетических заявлений разного размера замеряется разбор документа и извлечение
+данных, как в convert_xml_to_pdf: поля заявителя, координаты и месторождения.
+
+Запуск: python tools/bench_xml.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import xml_backend  # noqa: E402
+from synthetic_xml import make_xml  # noqa: E402
+from xml_processor import (find_values_in_xml, extract_coordinates_from_xml,  # noqa: E402
+                           extract_deposit_info_from_xml)
+
+FIELDS = ["FullName", "LastName", "FirstName", "MiddleName", "INN", "RepresentativeSNILS", "Phone", "Email",
+          "UniqueID", "RequestDateTime", "DepositPresence", "HasAreaInCity"]
+
+SIZES = [
+    ("small: 1 plot x 10 points", dict(plots=1, points=10, deposits=1)),
+    ("medium: 10 plots x 100 points, 10 deposits", dict(plots=10, points=100, deposits=10)),
+    ("large: 50 plots x 1000 points", dict(plots=50, points=1000, deposits=10)),
+]
+
+
+def extract(root):
+    for field in FIELDS:
+        find_values_in_xml(root, field)
+    extract_coordinates_from_xml(root)
+    extract_deposit_info_from_xml(root)
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = ["etree"] + (["lxml"] if xml_backend.etree is not None else [])
+    print(f"{'document':45} {'backend':8} {'parse ms':>9} {'extract ms':>11} {'validate ms':>12}")
+    for title, size in SIZES:
+        content = make_xml(**size)
+        for backend in backends:
+            root = xml_backend.parse(content, backend=backend)
+            parse_ms = measure(lambda: xml_backend.parse(content, backend=backend), args.repeat)
+            extract_ms = measure(lambda: extract(root), args.repeat)
+            validate_ms = measure(lambda: xml_backend.validate(root), args.repeat)
+            print(f"{title:45} {backend:8} {parse_ms:9.2f} {extract_ms:11.2f} {validate_ms:12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# import_time.py
+"""
+Отчет о времени импорта приложения.
+
+Запускает `python -X importtime` для main_app и для набора тяжелых библиотек,
+которые раньше импортировались вместе с ним, и печатает их совокупное время
+импорта. Библиотеки, которых нет в списке импортированных при загрузке main_app,
+теперь загружаются лениво (при первом запросе или в фоновом прогреве).
+
+Запуск из каталога app: python ../tools/import_time.py
+"""
+import os
+import re
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "weasyprint",
+    "pdfminer.high_level",
+    "pyhanko.sign",
+    "pdfrw",
+    "reportlab.pdfgen.canvas",
+    "reportlab.pdfbase.ttfonts",
+]
+
+LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(statement):
+    """Возвращает словарь модуль -> совокупное время импорта (мкс) для верхнеуровневых импортов."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, cwd=os.getcwd())
+    times = {}
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            _, cumulative, _, module = match.groups()
+            times[module] = int(cumulative)
+    if result.returncode != 0:
+        print(f"Import failed for `{statement}`: {result.stderr.splitlines()[-1]}")
+        return {}
+    return times
+
+
+def main():
+    app_times = import_times("import main_app")
+    print(f"import main_app: {app_times.get('main_app', 0) / 1000:.0f} ms")
+    print()
+    print(f"{'module':28s} {'eager import':>14s} {'loaded by main_app':>20s}")
+    available = []
+    for module in HEAVY_MODULES:
+        cumulative = import_times(f"import {module}").get(module)
+        if cumulative is None:
+            print(f"{module:28s} {'unavailable':>14s}")
+            continue
+        available.append(module)
+        loaded = module in app_times
+        print(f"{module:28s} {cumulative / 1000:11.0f} ms {'yes' if loaded else 'no (lazy)':>20s}")
+
+    # Совместный импорт: общие зависимости учитываются один раз
+    deferred = [module for module in available if module not in app_times]
+    if deferred:
+        combined = import_times("import " + ", ".join(deferred))
+        total = sum(combined.get(module, 0) for module in deferred)
+        print()
+        print(f"Deferred from startup (combined import of lazy modules): {total / 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# loadtest.py
+"""
+Нагрузочное тестирование /upload/ со ступенчатым ростом числа одновременных клиентов.
+
+Сервис запускается под uvicorn в отдельном процессе (по умолчанию), внутри процесса
+нагрузочного теста (--target inprocess, запросы через ASGI без сети) или используется уже
+запущенный (--url). Вместо csptest из КриптоПро подставляется tools/fake_csptest/csptest,
+имитирующий задержку подписи (--sign-latency-ms, --sign-jitter-ms, --sign-fail-rate),
+поэтому конвертации проходят весь путь, как в рабочем режиме (TEST_MODE=False).
+
+Заявления генерируются synthetic_xml в смеси размеров (--mix small:80,medium:18,large:2).
+На каждом уровне параллельности (--concurrency 1,2,4,8) клиенты в течение --duration секунд
+отправляют запросы без пауз. Для уровня выводятся пропускная способность, задержки
+p50/p95/p99, доля ошибок с разбивкой по кодам ответа, загрузка CPU и пиковая память
+процессов сервиса (вместе с дочерними процессами, через psutil). В режиме inprocess
+измеряется процесс теста целиком, включая клиентскую сторону.
+
+Запуск: python tools/loadtest.py [--target uvicorn|inprocess] [--url URL --pid PID]
+        [--workers N] [--concurrency 1,2,4,8] [--duration SECONDS] [--mix ...] [--json FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import httpx
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(TOOLS_DIR, "..", "app")
+FAKE_CSPTEST_DIR = os.path.join(TOOLS_DIR, "fake_csptest")
+
+sys.path.insert(0, TOOLS_DIR)
+
+from synthetic_xml import SHAPES, make_xml  # noqa: E402
+
+UNIQUE_ID_PLACEHOLDER = b"LOADTEST-UNIQUE-ID"
+CREDENTIALS = ("loadtest", "loadtest")
+
+
+class ProcessSampler:
+    """
+    Фоновый замер CPU и памяти дерева процессов (процесс и все его потомки).
+    Время CPU суммируется по приращениям между замерами, поэтому время коротких
+    дочерних процессов, завершившихся между замерами, не учитывается.
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.process = psutil.Process(pid) if psutil is not None and pid else None
+        self.interval = interval
+        self.cpu_times = {}
+        self.cpu_seconds = 0.0
+        self.peak_rss = 0
+        self.started = None
+        self.stopped = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        try:
+            processes = [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        rss = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+            total = times.user + times.system
+            previous = self.cpu_times.get(process.pid)
+            if previous is not None:
+                self.cpu_seconds += max(total - previous, 0)
+            self.cpu_times[process.pid] = total
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.process is None:
+            return
+        self._sample()
+        self.cpu_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.stopped = time.perf_counter()
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+    def result(self):
+        if self.process is None:
+            return {"cpu_percent": None, "peak_rss_mb": None}
+        elapsed = self.stopped - self.started
+        return {"cpu_percent": round(100 * self.cpu_seconds / elapsed, 1),
+                "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1)}
+
+
+def parse_mix(value):
+    """Смесь размеров заявлений: 'small:80,medium:18,large:2' -> [(размер, вес)]."""
+    mix = []
+    for item in value.split(","):
+        name, _, weight = item.partition(":")
+        name = name.strip()
+        if name not in SHAPES:
+            raise argparse.ArgumentTypeError(f"Unknown document size {name!r}, expected one of {list(SHAPES)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга (values отсортированы)."""
+    if not values:
+        return None
+    index = max(int(len(values) * percent / 100 + 0.5) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_environment(args, storage_dir):
+    """
+    Окружение сервиса: отдельный каталог хранилища, рабочий режим подписи с fake csptest.
+    TMPDIR задается отдельно, чтобы временные файлы сервиса не смешивались с системными.
+    """
+    temp_dir = os.path.join(storage_dir, "tmp")
+    os.makedirs(temp_dir, exist_ok=True)
+    return {
+        "STORAGE_DIR": storage_dir,
+        "TMPDIR": temp_dir,
+        "TEST_MODE": "False",
+        "SIGNER_NAME": "loadtest",
+        "SIGNER_PASSWORD": "loadtest",
+        "USERNAME": CREDENTIALS[0],
+        "PASSWORD": CREDENTIALS[1],
+        "PATH": FAKE_CSPTEST_DIR + os.pathsep + os.environ.get("PATH", ""),
+        "FAKE_CSPTEST_LATENCY_MS": str(args.sign_latency_ms),
+        "FAKE_CSPTEST_JITTER_MS": str(args.sign_jitter_ms),
+        "FAKE_CSPTEST_FAIL_RATE": str(args.sign_fail_rate),
+    }
+
+
+async def wait_ready(client, timeout, server=None):
+    """
+    Ждет ответа /healthz, затем готовности /readyz (не дольше timeout секунд).
+    server - запущенный процесс сервиса: если он завершился, ждать дальше бессмысленно.
+    """
+    deadline = time.monotonic() + timeout
+    alive = False
+    status = None
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Service exited with code {server.returncode}")
+        try:
+            if not alive:
+                alive = (await client.get("/healthz")).status_code == 200
+            if alive:
+                response = await client.get("/readyz")
+                if response.status_code == 200:
+                    return
+                status = response.text
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    if not alive:
+        raise RuntimeError(f"Service did not start within {timeout} s")
+    print(f"Warning: service is not ready after {timeout} s ({status}), continuing anyway")
+
+
+async def run_level(client, concurrency, duration, payloads, mix, counter):
+    """Один уровень нагрузки: concurrency клиентов отправляют запросы в течение duration секунд."""
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            number = next(counter)
+            name = rng.choices(names, weights)[0]
+            payload = payloads[name].replace(UNIQUE_ID_PLACEHOLDER, f"LT-{number:08d}".encode())
+            started = time.perf_counter()
+            try:
+                response = await client.post("/upload/", files={"file": (f"loadtest_{number}.xml", payload)},
+                                              headers={"Accept": "application/json"})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            samples.append((name, status, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(seed) for seed in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def summarize(concurrency, samples, elapsed, resources):
+    latencies = sorted(latency * 1000 for _, _, latency in samples)
+    statuses = Counter(str(status) for _, status, _ in samples)
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    ok_latencies = sorted(latency * 1000 for _, status, latency in samples if status == 200)
+    result = {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "throughput_rps": round(statuses["200"] / elapsed, 2),
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "statuses": dict(statuses),
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 1) if latencies else None for p in (50, 95, 99)},
+        "ok_latency_ms": {f"p{p}": round(percentile(ok_latencies, p), 1) if ok_latencies else None
+                          for p in (50, 95, 99)},
+        "by_size": {name: sum(1 for size, _, _ in samples if size == name) for name in SHAPES},
+    }
+    result.update(resources)
+    return result
+
+
+def print_report(results):
+    header = f"{'conc':>5} {'reqs':>6} {'ok rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} " \
+             f"{'errors':>7} {'cpu %':>7} {'rss MB':>8}  statuses"
+    print(header)
+    best = max(results, key=lambda result: result["throughput_rps"], default=None)
+    for result in results:
+        latency = result["latency_ms"]
+        cells = [f"{value:9.1f}" if value is not None else f"{'-':>9}" for value in latency.values()]
+        cpu = f"{result['cpu_percent']:7.1f}" if result["cpu_percent"] is not None else f"{'-':>7}"
+        rss = f"{result['peak_rss_mb']:8.1f}" if result["peak_rss_mb"] is not None else f"{'-':>8}"
+        statuses = " ".join(f"{status}:{count}" for status, count in sorted(result["statuses"].items()))
+        marker = " *" if result is best else ""
+        print(f"{result['concurrency']:>5} {result['requests']:>6} {result['throughput_rps']:8.2f} "
+              f"{' '.join(cells)} {result['error_rate']:7.1%} {cpu} {rss}  {statuses}{marker}")
+    if best is not None:
+        print(f"* peak throughput {best['throughput_rps']} rps at concurrency {best['concurrency']}")
+
+
+async def run(args, base_url, transport, pid, auth=CREDENTIALS, server=None):
+    mix = parse_mix(args.mix)
+    payloads = {name: make_xml(UNIQUE_ID_PLACEHOLDER.decode(), seed=index, **SHAPES[name])
+                for index, (name, _) in enumerate(mix)}
+    counter = iter(range(10 ** 8))
+    results = []
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, auth=auth,
+                                 timeout=timeout, limits=httpx.Limits(max_connections=None)) as client:
+        await wait_ready(client, args.ready_timeout, server)
+        for concurrency in args.concurrency:
+            sampler = ProcessSampler(pid)
+            sampler.start()
+            samples, elapsed = await run_level(client, concurrency, args.duration, payloads, mix, counter)
+            sampler.stop()
+            result = summarize(concurrency, samples, elapsed, sampler.result())
+            if args.json:
+                result["server_metrics"] = (await client.get("/metrics")).json()
+            results.append(result)
+            print(f"concurrency {concurrency}: {result['requests']} requests, "
+                  f"{result['throughput_rps']} rps, error rate {result['error_rate']:.1%}")
+            if args.pause:
+                await asyncio.sleep(args.pause)
+    return results
+
+
+def run_uvicorn(args, storage_dir):
+    port = free_port()
+    env = dict(os.environ, **server_environment(args, storage_dir))
+    command = [sys.executable, "-m", "uvicorn", "main_app:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    try:
+        return asyncio.run(run(args, f"http://127.0.0.1:{port}", None, server.pid, server=server))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def run_inprocess(args, storage_dir):
+    # Конфигурация читается при импорте, поэтому окружение задается до импорта main_app
+    os.environ.update(server_environment(args, storage_dir))
+    tempfile.tempdir = None
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    from main_app import app
+
+    async def main():
+        async with app.router.lifespan_context(app):
+            return await run(args, "http://loadtest", httpx.ASGITransport(app=app), os.getpid())
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=["uvicorn", "inprocess"], default="uvicorn")
+    parser.add_argument("--url", help="адрес уже запущенного сервиса (вместо запуска своего)")
+    parser.add_argument("--user", help="логин для --url")
+    parser.add_argument("--password", help="пароль для --url")
+    parser.add_argument("--pid", type=int, help="PID сервиса для замера CPU и памяти при --url")
+    parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn")
+    parser.add_argument("--storage-dir", help="каталог хранилища (по умолчанию временный)")
+    parser.add_argument("--concurrency", type=lambda value: [int(item) for item in value.split(",")],
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность уровня, секунды")
+    parser.add_argument("--pause", type=float, default=2.0, help="пауза между уровнями, секунды")
+    parser.add_argument("--mix", default="small:80,medium:18,large:2")
+    parser.add_argument("--sign-latency-ms", type=float, default=300.0)
+    parser.add_argument("--sign-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--sign-fail-rate", type=float, default=0.0)
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="сохранить отчет в JSON (с метриками сервиса /metrics)")
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    # Без psutil замер ресурсов невозможен: это допустимо только при нагрузке чужого сервиса без --pid
+    if psutil is None and not (args.url and args.pid is None):
+        parser.error("psutil is required to report CPU and memory (pip install psutil); "
+                     "use --url without --pid to run without resource metrics")
+
+    if args.url:
+        auth = (args.user or "", args.password or "")
+        results = asyncio.run(run(args, args.url, None, args.pid, auth))
+    else:
+        storage_dir = args.storage_dir or tempfile.mkdtemp(prefix="loadtest_")
+        print(f"Storage: {storage_dir}")
+        if args.target == "inprocess":
+            results = run_inprocess(args, storage_dir)
+        else:
+            results = run_uvicorn(args, storage_dir)
+
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"arguments": vars(args), "levels": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
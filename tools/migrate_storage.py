@@ -0,0 +1,44 @@
+# migrate_storage.py
+"""
+Перенос существующих файлов input_data и output_data из корня каталогов в подкаталоги
+YYYY/MM/DD по метке времени в имени файла.
+
+Фоновое обслуживание хранилища выполняет тот же перенос пакетами; скрипт позволяет
+провести его сразу, например при остановленном сервисе. Запускается с теми же
+переменными окружения (STORAGE_DIR), что и сервис. Повторный запуск безопасен.
+
+Запуск: python tools/migrate_storage.py [--batch-size N] [--pause SECONDS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import storage  # noqa: E402
+from config import STORAGE_PATH, OUTPUT_PATH  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0, help="пауза между пакетами (секунды)")
+    args = parser.parse_args()
+
+    with storage.maintenance_lock() as acquired:
+        if not acquired:
+            sys.exit("Storage maintenance is running in another process, try again later")
+        for directory in [STORAGE_PATH, OUTPUT_PATH]:
+            total = 0
+            while True:
+                moved = storage.migrate_flat(directory, limit=args.batch_size)
+                total += moved
+                if moved < args.batch_size:
+                    break
+                time.sleep(args.pause)
+            print(f"{directory}: moved {total} files")
+
+
+if __name__ == "__main__":
+    main()
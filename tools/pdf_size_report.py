@@ -0,0 +1,144 @@
+# pdf_size_report.py
+"""
+Сравнение размеров PDF после штампа и нумерации страниц (до подписи).
+
+Для каждого документа сравниваются:
+  legacy       - штамп отдельным документом и номер страницы отдельным документом на каждую
+                 страницу (шрифт встраивается в каждое наложение), pdfrw без сжатия - прежняя схема;
+  compressed   - штампы и номера в одном многостраничном наложении с общими шрифтами,
+                 сжатие потоков pdfrw;
+  objstreams   - дополнительно потоки объектов pikepdf (PDF_OBJECT_STREAMS);
+  linearized   - дополнительно линеаризация (PDF_LINEARIZE).
+
+Документы: пути к PDF в аргументах; без аргументов - последние --limit неподписанных PDF
+из хранилища (KEEP_UNSIGNED_PDF), а если их нет - синтетические документы reportlab
+на --pages страниц.
+
+Запуск: python tools/pdf_size_report.py [FILE.pdf ...] [--limit N] [--pages 1,10,50]
+"""
+import argparse
+import io
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)  # Шрифты штампа регистрируются по относительному пути static/fonts
+
+import storage  # noqa: E402
+from config import UNSIGNED_PATH, SIGNER_NAME  # noqa: E402
+from pdf_utils import (add_stamp_and_page_numbers, draw_stamp, draw_page_number, stamp_offset,  # noqa: E402
+                       optimize_pdf, load_pikepdf, register_fonts)
+
+
+def legacy_stamp_and_page_numbers(pdf_buffer):
+    """
+    Штамп и нумерация страниц прежней схемой: штамп - отдельный документ, номер - отдельное
+    наложение на каждую страницу, без сжатия.
+    """
+    from pdfrw import PdfReader, PdfWriter, PageMerge
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf_reader = PdfReader(pdf_buffer)
+    page_width = float(pdf_reader.pages[0]['/MediaBox'][2])
+    page_height = float(pdf_reader.pages[0]['/MediaBox'][3])
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+    draw_stamp(can, SIGNER_NAME, page_width)
+    can.save()
+    packet.seek(0)
+    stamp_page = PdfReader(packet).pages[0]
+
+    pdf_writer = PdfWriter()
+    for page_num, page in enumerate(pdf_reader.pages):
+        stamp_page.y = stamp_offset(page, page_height)
+        PageMerge(page).add(stamp_page).render()
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=letter)
+        draw_page_number(can, page_num, len(pdf_reader.pages))
+        can.save()
+        packet.seek(0)
+        PageMerge(page).add(PdfReader(packet).pages[0]).render()
+        pdf_writer.addpage(page)
+    output_buffer = io.BytesIO()
+    pdf_writer.write(output_buffer)
+    output_buffer.seek(0)
+    return output_buffer
+
+
+def synthetic_pdf(pages):
+    """Документ reportlab с таблицей координат на pages страниц."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    register_fonts()
+    buffer = io.BytesIO()
+    can = canvas.Canvas(buffer, pagesize=A4)
+    for page in range(pages):
+        can.setFont("Roboto-Bold", 12)
+        can.drawString(50, 800, f"Координаты участка {page + 1}")
+        can.setFont("Roboto-Regular", 9)
+        for row in range(60):
+            y = 780 - row * 12
+            can.drawString(50, y, f"{page * 60 + row + 1}")
+            can.drawString(120, y, f"{55 + row / 100:.6f}")
+            can.drawString(260, y, f"{37 + page / 100:.6f}")
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+
+def documents(args):
+    """Пары (название, содержимое PDF) для сравнения."""
+    if args.files:
+        for path in args.files:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+        return
+    entries = sorted(storage.iter_files(UNSIGNED_PATH), key=lambda entry: entry.name)[-args.limit:]
+    if entries:
+        for entry in entries:
+            filename = storage.logical_name(entry.name)
+            yield filename, storage.read_bytes(UNSIGNED_PATH, filename)
+        return
+    print("No stored unsigned PDFs, using synthetic documents")
+    for pages in args.pages:
+        yield f"synthetic {pages} pages", synthetic_pdf(pages)
+
+
+def variants(data):
+    """Размеры вариантов постобработки документа (байты)."""
+    legacy = legacy_stamp_and_page_numbers(io.BytesIO(data))
+    compressed = add_stamp_and_page_numbers(io.BytesIO(data), SIGNER_NAME)
+    sizes = {"legacy": len(legacy.getvalue()), "compressed": len(compressed.getvalue())}
+    if load_pikepdf() is not None:
+        sizes["objstreams"] = len(optimize_pdf(compressed, linearize=False).getvalue())
+        sizes["linearized"] = len(optimize_pdf(compressed, linearize=True).getvalue())
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--limit", type=int, default=10, help="сколько последних сохраненных PDF сравнить")
+    parser.add_argument("--pages", type=lambda value: [int(item) for item in value.split(",")], default=[1, 10, 50])
+    args = parser.parse_args()
+
+    register_fonts()
+    columns = ["legacy", "compressed", "objstreams", "linearized"]
+    print(f"{'document':<50} {'input KB':>9} " + " ".join(f"{column + ' KB':>14}" for column in columns))
+    for name, data in documents(args):
+        sizes = variants(data)
+        cells = []
+        for column in columns:
+            if column not in sizes:
+                cells.append(f"{'-':>14}")
+                continue
+            ratio = sizes[column] / sizes["legacy"]
+            cells.append(f"{sizes[column] / 1024:8.1f} {ratio:5.0%}")
+        print(f"{name[:50]:<50} {len(data) / 1024:9.1f} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
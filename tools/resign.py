@@ -0,0 +1,50 @@
+# resign.py
+"""
+Повторная подпись сохраненных документов без повторного рендеринга.
+
+Для документов, неподписанный PDF которых сохранен (KEEP_UNSIGNED_PDF=true), заново
+ставятся штамп, номера страниц и подпись, после чего подписанный PDF в output_data
+атомарно заменяется. Применяется после смены сертификата или имени подписанта
+(SIGNER_NAME) и после временных сбоев csptest. Запускается с теми же переменными
+окружения, что и сервис.
+
+Запуск: python tools/resign.py (--unique-id ID ... | --since YYYY-MM-DD [--until YYYY-MM-DD] | --all)
+        [--concurrency N]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)  # Шрифты штампа регистрируются по относительному пути static/fonts
+
+import resign  # noqa: E402
+from config import RESIGN_CONCURRENCY  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unique-id", action="append", dest="unique_ids")
+    parser.add_argument("--since", type=datetime.date.fromisoformat)
+    parser.add_argument("--until", type=datetime.date.fromisoformat)
+    parser.add_argument("--all", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=RESIGN_CONCURRENCY)
+    args = parser.parse_args()
+    if not (args.unique_ids or args.since or args.until or args.all):
+        parser.error("specify --unique-id, --since/--until or --all")
+
+    filenames = resign.select_documents(args.unique_ids, args.since, args.until)
+    print(f"Selected {len(filenames)} documents")
+    results = asyncio.run(resign.resign_documents(filenames, os.path.abspath(APP_DIR), args.concurrency))
+    failed = {filename: error for filename, error in results.items() if error != "ok"}
+    for filename, error in failed.items():
+        print(f"FAILED {filename}: {error}")
+    print(f"Re-signed {len(filenames) - len(failed)} of {len(filenames)} documents")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
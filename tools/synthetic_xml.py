@@ -0,0 +1,46 @@
+# synthetic_xml.py
+"""
+Генерация синтетических заявлений для замеров и нагрузочного тестирования.
+
+Структура повторяет поля, которые извлекает xml_processor: сведения о заявителе,
+участки (Plot/Polygon/Point) и месторождения (DepositInfo).
+"""
+import random
+
+# Типовые размеры заявлений: параметры make_xml
+SHAPES = {
+    "small": dict(plots=1, points=10, deposits=1),
+    "medium": dict(plots=10, points=100, deposits=10),
+    "large": dict(plots=50, points=1000, deposits=10),
+}
+
+
+def make_xml(unique_id="TEST-0001", plots=1, points=10, deposits=0, seed=0):
+    """Возвращает XML заявления (bytes) с plots участками по points точек и deposits месторождениями."""
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        "<Request>",
+        f"<UniqueID>{unique_id}</UniqueID>",
+        "<RequestDateTime>2024-09-01T10:15:30.123</RequestDateTime>",
+        "<Applicant><FullName>ООО Тест</FullName><LastName>Иванов</LastName><FirstName>Иван</FirstName>"
+        "<MiddleName>Иванович</MiddleName><INN>7700000000</INN>"
+        "<RepresentativeSNILS>000-000-000 00</RepresentativeSNILS>"
+        "<Phone>+70000000000</Phone><Email>test@example.com</Email></Applicant>",
+        "<DepositPresence>1</DepositPresence><HasAreaInCity>0</HasAreaInCity>",
+        "<Plots>",
+    ]
+    for plot in range(plots):
+        parts.append(f'<Plot Number="{plot + 1}" Name="Участок {plot + 1}"><Polygon>')
+        for _ in range(points):
+            parts.append(f"<Point><Latitude>{rng.uniform(40, 70):.6f}</Latitude>"
+                         f"<Longitude>{rng.uniform(30, 140):.6f}</Longitude></Point>")
+        parts.append("</Polygon></Plot>")
+    parts.append("</Plots><Deposits>")
+    for deposit in range(deposits):
+        parts.append(f"<DepositInfo><DepositName>Месторождение {deposit + 1}</DepositName>"
+                     f"<LicenseNumber>ЛИЦ{deposit:05d}</LicenseNumber>"
+                     f"<last_change_date>2024-08-01T00:00:00</last_change_date>"
+                     f"<isOPI>{deposit % 2}</isOPI></DepositInfo>")
+    parts.append("</Deposits></Request>")
+    return "\n".join(parts).encode("utf-8")